@@ -0,0 +1,195 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Validation and benchmark of the batched forward kinematics of blenderRCBPanel against
+# iDynTree KinDynComputations. It needs only numpy and the iDynTree bindings, not Blender.
+#
+# Usage:
+#   python fk_benchmark.py model.urdf --samples 100 1000 10000 100000
+#   python fk_benchmark.py --two-link
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import numpy as np
+import idyntree.bindings as iDynTree
+
+# Imported from its file, the package needs bpy
+spec = importlib.util.spec_from_file_location(
+    "batched_fk", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "blenderRCBPanel", "batched_fk.py"))
+batched_fk = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(batched_fk)
+
+
+def load_model(urdf_path):
+    mdlLoader = iDynTree.ModelLoader()
+    if not mdlLoader.loadModelFromFile(urdf_path):
+        raise RuntimeError("Unable to load " + urdf_path)
+    # The model of the loader is freed with it
+    return mdlLoader.model().copy()
+
+
+# Two revolute joints, the second one on a rotated axis, and a fixed tip frame
+TWO_LINK_URDF = """<?xml version="1.0"?>
+<robot name="two_link">
+  <link name="base_link">
+    <inertial><mass value="1.0"/><inertia ixx="0.01" ixy="0" ixz="0" iyy="0.01" iyz="0" izz="0.01"/></inertial>
+  </link>
+  <link name="link1">
+    <inertial><mass value="1.0"/><inertia ixx="0.01" ixy="0" ixz="0" iyy="0.01" iyz="0" izz="0.01"/></inertial>
+  </link>
+  <link name="link2">
+    <inertial><mass value="1.0"/><inertia ixx="0.01" ixy="0" ixz="0" iyy="0.01" iyz="0" izz="0.01"/></inertial>
+  </link>
+  <link name="tip"/>
+  <joint name="joint1" type="revolute">
+    <parent link="base_link"/><child link="link1"/>
+    <origin xyz="0 0 0.1" rpy="0 0 0"/><axis xyz="0 0 1"/>
+    <limit lower="-3.14" upper="3.14" effort="1" velocity="1"/>
+  </joint>
+  <joint name="joint2" type="revolute">
+    <parent link="link1"/><child link="link2"/>
+    <origin xyz="0.3 0 0" rpy="1.5707963267948966 0 0"/><axis xyz="0 1 0"/>
+    <limit lower="-3.14" upper="3.14" effort="1" velocity="1"/>
+  </joint>
+  <joint name="tip_joint" type="fixed">
+    <parent link="link2"/><child link="tip"/>
+    <origin xyz="0.25 0 0" rpy="0 0 0"/>
+  </joint>
+</robot>
+"""
+
+
+def two_link_tip_poses(q):
+    # base_H_tip = Tz(0.1) Rz(q1) Tx(0.3) Rx(pi/2) Ry(q2) Tx(0.25), computed by hand
+    c1, s1 = np.cos(q[:, 0]), np.sin(q[:, 0])
+    c12, s12 = np.cos(q[:, 0] + q[:, 1]), np.sin(q[:, 0] + q[:, 1])
+    poses = np.zeros((len(q), 4, 4))
+    poses[:, 0, 0], poses[:, 0, 2] = c12, s12
+    poses[:, 1, 0], poses[:, 1, 2] = s12, -c12
+    poses[:, 2, 1] = 1.0
+    poses[:, 0, 3] = 0.3 * c1 + 0.25 * c12
+    poses[:, 1, 3] = 0.3 * s1 + 0.25 * s12
+    poses[:, 2, 3] = 0.1
+    poses[:, 3, 3] = 1.0
+    return poses
+
+
+def check_two_link(n, rng):
+    """Batched forward kinematics of the tip of TWO_LINK_URDF against the poses computed by hand."""
+    mdlLoader = iDynTree.ModelLoader()
+    if not mdlLoader.loadModelFromString(TWO_LINK_URDF):
+        raise RuntimeError("Unable to load the two link chain")
+    fk = batched_fk.BatchedForwardKinematics(mdlLoader.model().copy())
+    q = rng.uniform(-np.pi, np.pi, size=(n, 2))
+    actual = fk.frame_poses(q, ["tip"], ["joint1", "joint2"])[:, 0]
+    expected = two_link_tip_poses(q)
+    position_error = np.abs(actual[:, :3, 3] - expected[:, :3, 3]).max()
+    rotation_error = np.abs(actual[:, :3, :3] - expected[:, :3, :3]).max()
+    return {"configurations": n, "frames": 1,
+            "max_position_error": float(position_error), "max_rotation_error": float(rotation_error)}
+
+
+def random_configurations(model, n, rng):
+    # Uniform within the position limits of the joints, [-pi, pi] for the unlimited ones
+    lower = np.full(model.getNrOfDOFs(), -np.pi)
+    upper = np.full(model.getNrOfDOFs(), np.pi)
+    for joint_idx in range(model.getNrOfJoints()):
+        joint = model.getJoint(joint_idx)
+        if joint.getNrOfDOFs() == 1 and joint.hasPosLimits():
+            lower[joint.getDOFsOffset()] = joint.getMinPosLimit(0)
+            upper[joint.getDOFsOffset()] = joint.getMaxPosLimit(0)
+    return rng.uniform(lower, upper, size=(n, model.getNrOfDOFs()))
+
+
+def idyntree_poses(model, q, frame_names):
+    # Reference, one configuration at a time, poses respect to the base link
+    dynComp = iDynTree.KinDynComputations()
+    dynComp.loadRobotModel(model)
+    base_link = model.getLinkName(model.getDefaultBaseLink())
+    poses = np.empty((q.shape[0], len(frame_names), 4, 4))
+    for idx, configuration in enumerate(q):
+        dynComp.setJointPos(iDynTree.VectorDynSize.FromPython(configuration))
+        for column, frame_name in enumerate(frame_names):
+            poses[idx, column] = dynComp.getRelativeTransform(base_link, frame_name).asHomogeneousTransform().toNumPy()
+    return poses
+
+
+def validate(model, fk, n, rng):
+    frame_names = [model.getFrameName(idx) for idx in range(model.getNrOfFrames())]
+    q = random_configurations(model, n, rng)
+    expected = idyntree_poses(model, q, frame_names)
+    actual = fk.frame_poses(q, frame_names)
+    position_error = np.abs(actual[..., :3, 3] - expected[..., :3, 3]).max()
+    rotation_error = np.abs(actual[..., :3, :3] - expected[..., :3, :3]).max()
+    return {"configurations": n, "frames": len(frame_names),
+            "max_position_error": float(position_error), "max_rotation_error": float(rotation_error)}
+
+
+def benchmark(model, fk, n, frame_name, rng, loop_limit):
+    q = random_configurations(model, n, rng)
+    start = time.perf_counter()
+    fk.frame_poses(q, [frame_name])
+    batched = time.perf_counter() - start
+
+    # The loop is timed on at most loop_limit configurations and scaled
+    n_loop = min(n, loop_limit)
+    start = time.perf_counter()
+    idyntree_poses(model, q[:n_loop], [frame_name])
+    loop = (time.perf_counter() - start) * n / n_loop
+    return {"configurations": n, "batched_s": batched, "idyntree_loop_s": loop, "speedup": loop / batched}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Validation and benchmark of the batched forward kinematics.")
+    parser.add_argument("urdf", type=str, nargs="?", default="")
+    parser.add_argument("--samples", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--frame", type=str, default="", help="frame of the benchmark, the last one by default")
+    parser.add_argument("--validation-samples", type=int, default=200)
+    parser.add_argument("--loop-limit", type=int, default=10000,
+                        help="maximum number of configurations timed with the iDynTree loop")
+    parser.add_argument("--tolerance", type=float, default=1e-8)
+    parser.add_argument("--two-link", action="store_true",
+                        help="only check against the hand-computed poses of a two link chain")
+    parser.add_argument("--output", type=str, default="", help="optional .json file for the results")
+    args = parser.parse_args(argv)
+    rng = np.random.default_rng(0)
+
+    two_link = check_two_link(args.validation_samples, rng)
+    print(f"two link chain on {two_link['configurations']} configurations: "
+          f"position error {two_link['max_position_error']:.2e} m, rotation error {two_link['max_rotation_error']:.2e}")
+    two_link_ok = max(two_link["max_position_error"], two_link["max_rotation_error"]) < args.tolerance
+    if args.two_link or not args.urdf:
+        return 0 if two_link_ok else 1
+
+    model = load_model(args.urdf)
+    fk = batched_fk.BatchedForwardKinematics(model)
+
+    validation = validate(model, fk, args.validation_samples, rng)
+    print(f"validation on {validation['configurations']} configurations and {validation['frames']} frames: "
+          f"position error {validation['max_position_error']:.2e} m, rotation error {validation['max_rotation_error']:.2e}")
+
+    frame_name = args.frame or model.getFrameName(model.getNrOfFrames() - 1)
+    results = []
+    print(f"{'N':>8} {'batched(s)':>11} {'loop(s)':>10} {'speedup':>9}")
+    for n in args.samples:
+        r = benchmark(model, fk, n, frame_name, rng, args.loop_limit)
+        results.append(r)
+        print(f"{n:>8} {r['batched_s']:>11.4f} {r['idyntree_loop_s']:>10.4f} {r['speedup']:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"two_link": two_link, "validation": validation, "benchmark": results}, f, indent=4)
+
+    ok = max(validation["max_position_error"], validation["max_rotation_error"]) < args.tolerance
+    return 0 if ok and two_link_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
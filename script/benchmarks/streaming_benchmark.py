@@ -0,0 +1,127 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Benchmark of the streaming path of blenderRCBPanel (frame change -> move() -> control boards)
+# using the in-process fake control boards, no YARP server or simulator is needed.
+#
+# Usage:
+#   blender -b --python-use-system-env -P streaming_benchmark.py -- --parts 1 2 4 --joints 6 12 --frames 500
+
+import bpy
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import blenderRCBPanel
+from blenderRCBPanel import blenderRCBPanel as rcb
+from blenderRCBPanel import controlboard_backends as cb
+from blenderRCBPanel import streaming_stats as sstats
+
+ARMATURE_NAME = "benchmark_rig"
+
+
+def build_armature(n_bones, n_frames):
+    armature = bpy.data.armatures.new(ARMATURE_NAME)
+    armature_object = bpy.data.objects.new(ARMATURE_NAME, armature)
+    bpy.context.scene.collection.objects.link(armature_object)
+    bpy.context.view_layer.objects.active = armature_object
+
+    bpy.ops.object.mode_set(mode='EDIT')
+    parent = None
+    for i in range(n_bones):
+        bone = armature.edit_bones.new(f"joint_{i}")
+        bone.head = (0, 0, 0.1 * i)
+        bone.tail = (0, 0, 0.1 * (i + 1))
+        bone.parent = parent
+        parent = bone
+
+    bpy.ops.object.mode_set(mode='POSE')
+    for i, pbone in enumerate(armature_object.pose.bones):
+        pbone.lock_location = (True, True, True)
+        pbone.lock_rotation = (True, False, True)
+        pbone.rotation_mode = 'XYZ'
+        # A sinusoid sampled on a few keyframes, so that every frame has new targets
+        for frame in range(1, n_frames + 1, max(1, n_frames // 8)):
+            pbone.rotation_euler[1] = math.sin(2 * math.pi * frame / n_frames + i) * 0.5
+            pbone.keyframe_insert(data_path="rotation_euler", frame=frame)
+    bpy.ops.object.mode_set(mode='OBJECT')
+    return armature_object
+
+
+def remove_armature(armature_object):
+    armature = armature_object.data
+    bpy.data.objects.remove(armature_object)
+    bpy.data.armatures.remove(armature)
+
+
+def run(n_parts, n_joints, n_frames, latency):
+    scene = bpy.context.scene
+    armature_object = build_armature(n_parts * n_joints, n_frames)
+    scene.my_tool.my_armature = ARMATURE_NAME
+    scene.frame_start = 1
+    scene.frame_end = n_frames
+
+    for part in range(n_parts):
+        axis_names = [f"joint_{part * n_joints + j}" for j in range(n_joints)]
+        board = cb.FakeControlBoard(axis_names, latency=latency)
+        rcb.register_rcb(rcb.open_rcb(("BENCHMARK", part), board), f"part_{part}")
+    sstats.part_stats.clear()
+
+    bpy.app.handlers.frame_change_post.append(rcb.move)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.monotonic()
+        for frame in range(1, n_frames + 1):
+            scene.frame_set(frame)
+        elapsed = time.monotonic() - start
+    bpy.app.handlers.frame_change_post.remove(rcb.move)
+
+    commands = sum(stats.commands for stats in sstats.part_stats.values())
+    handler_p95 = max(stats.handler_duration.percentile(95) for stats in sstats.part_stats.values())
+    for part in range(n_parts):
+        bpy.types.Scene.rcb_wrapper[f"part_{part}"].board.close()
+        rcb.unregister_rcb(f"part_{part}")
+    remove_armature(armature_object)
+
+    return {"parts": n_parts,
+            "joints_per_part": n_joints,
+            "frames": n_frames,
+            "fps": n_frames / elapsed,
+            "commands_per_second": commands / elapsed,
+            "handler_p95_ms": handler_p95}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark of the blenderRCBPanel streaming path.")
+    parser.add_argument("--parts", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--joints", type=int, nargs="+", default=[6, 12, 24])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0, help="latency of the fake boards in ms")
+    parser.add_argument("--output", type=str, default="", help="optional .json file for the results")
+    args = parser.parse_args(argv)
+
+    blenderRCBPanel.register()
+    results = []
+    print(f"{'parts':>6} {'joints':>7} {'fps':>10} {'cmds/s':>12} {'p95(ms)':>9}")
+    for n_parts in args.parts:
+        for n_joints in args.joints:
+            r = run(n_parts, n_joints, args.frames, args.latency / 1000.0)
+            results.append(r)
+            print(f"{n_parts:>6} {n_joints:>7} {r['fps']:>10.1f} {r['commands_per_second']:>12.1f} {r['handler_p95_ms']:>9.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    main(argv[argv.index("--") + 1:] if "--" in argv else [])
@@ -32,15 +32,44 @@ from bpy.props import (StringProperty,
 from .blenderRCBPanel import (MyProperties,
                               WM_OT_Disconnect,
                               WM_OT_Connect,
+                              WM_OT_ConnectAll,
+                              WM_OT_ReplayCommandLog,
+                              WM_OT_MirrorRobot,
+                              WM_OT_ImportEncoderLog,
+                              close_dry_run_recorder,
+                              close_broadcaster,
+                              unregister_joint_properties,
                               WM_OT_Configure,
+                              WM_OT_ResetStreamingStats,
+                              WM_OT_ExportStreamingStats,
+                              WM_OT_KeyFullPose,
+                              WM_OT_ThinKeyframes,
                               WM_OT_ReachTarget,
+                              WM_OT_BatchReachTarget,
+                              WM_OT_BuildReachabilityMap,
+                              WM_OT_CheckSelfCollisions,
+                              WM_OT_ValidateLimits,
+                              WM_OT_Retime,
+                              WM_OT_CheckDynamics,
+                              WM_OT_ExportDynamics,
+                              WM_OT_AddIkTarget,
+                              WM_OT_RemoveIkTarget,
+                              WM_OT_ReachAllTargets,
                               WM_OT_initiate_drag_drop,
                               ModalOperator,
                               OBJECT_PT_robot_controller,
                               OT_OpenConfigurationFile,
                               ListItem,
+                              IkTargetItem,
+                              MY_UL_IkTargets,
                               MY_UL_List,
                               )
+from .controlboard_backends import close_all_boards
+from .joint_table import armature_update_handler
+from .common_functions import drivers_update_handler
+from . import trajectory_overlay
+from . import robot_mirror
+from . import command_coalescing
 
 # ------------------------------------------------------------------------
 #    Registration
@@ -50,14 +79,34 @@ classes = (
     MyProperties,
     WM_OT_Disconnect,
     WM_OT_Connect,
+    WM_OT_ConnectAll,
+    WM_OT_ReplayCommandLog,
+    WM_OT_MirrorRobot,
+    WM_OT_ImportEncoderLog,
     WM_OT_Configure,
+    WM_OT_ResetStreamingStats,
+    WM_OT_ExportStreamingStats,
+    WM_OT_KeyFullPose,
+    WM_OT_ThinKeyframes,
     WM_OT_ReachTarget,
+    WM_OT_BatchReachTarget,
+    WM_OT_BuildReachabilityMap,
+    WM_OT_CheckSelfCollisions,
+    WM_OT_ValidateLimits,
+    WM_OT_Retime,
+    WM_OT_CheckDynamics,
+    WM_OT_ExportDynamics,
+    WM_OT_AddIkTarget,
+    WM_OT_RemoveIkTarget,
+    WM_OT_ReachAllTargets,
     WM_OT_initiate_drag_drop,
     ModalOperator,
     OBJECT_PT_robot_controller,
     OT_OpenConfigurationFile,
     ListItem,
-    MY_UL_List
+    MY_UL_List,
+    IkTargetItem,
+    MY_UL_IkTargets
 )
 
 
@@ -72,6 +121,8 @@ def register():
         bpy.types.Scene.my_tool = PointerProperty(type=MyProperties)
         bpy.types.Scene.my_list = CollectionProperty(type=ListItem)
         bpy.types.Scene.list_index = IntProperty(name="Index for my_list", default=0)
+        bpy.types.Scene.my_ik_targets = CollectionProperty(type=IkTargetItem)
+        bpy.types.Scene.my_ik_target_index = IntProperty(name="Index for my_ik_targets", default=0)
 
     except:
         print("A problem in the registration occurred")
@@ -79,8 +130,16 @@ def register():
     # initialize the dict
     bpy.types.Scene.rcb_wrapper = {}
 
+    # invalidate the joint table when the armature changes
+    bpy.app.handlers.depsgraph_update_post.append(armature_update_handler)
+    # refresh the bones moved by drivers when the drivers change
+    bpy.app.handlers.depsgraph_update_post.append(drivers_update_handler)
+    # mark the trajectory overlay for a refresh when the keys change
+    bpy.app.handlers.depsgraph_update_post.append(trajectory_overlay.overlay_update_handler)
+
 
 def unregister():
+    unregister_joint_properties()
     for cls in reversed(classes):
         try:
             bpy.utils.unregister_class(cls)
@@ -90,6 +149,8 @@ def unregister():
         del bpy.types.Scene.my_tool
         del bpy.types.Scene.my_list
         del bpy.types.Scene.list_index
+        del bpy.types.Scene.my_ik_targets
+        del bpy.types.Scene.my_ik_target_index
     except:
         print("Exception raised when deleting the scene.")
 
@@ -99,6 +160,24 @@ def unregister():
     except:
         print("Exception raised when removing the callback")
 
+    trajectory_overlay.show(False)
+    for handler in (armature_update_handler, drivers_update_handler, trajectory_overlay.overlay_update_handler):
+        if handler in bpy.app.handlers.depsgraph_update_post:
+            bpy.app.handlers.depsgraph_update_post.remove(handler)
+
+    # the mirroring reads the boards from its thread, it is stopped before closing them
+    robot_mirror.stop()
+    WM_OT_ReplayCommandLog.stop()
+    command_coalescing.clear()
+    # the sinks of the broadcaster send to the boards from their threads
+    close_broadcaster()
+    # close the drivers of the connected parts and the ones kept for reconnecting
+    for rcb_instance in bpy.types.Scene.rcb_wrapper.values():
+        rcb_instance.board.close()
+    bpy.types.Scene.rcb_wrapper.clear()
+    close_all_boards()
+    close_dry_run_recorder()
+
 
 if __name__ == "__main__":
     register()
@@ -0,0 +1,103 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import concurrent.futures
+import multiprocessing
+import sys
+import threading
+import numpy as np
+import idyntree.bindings as iDynTree
+
+from .common_functions import IkChainSolver
+from .dls_ik import DlsChainSolver
+
+# Threads of the addon that may hold locks (files, solvers, boards) when the workers are forked.
+# The threads of the Connect all pool are idle between the connections.
+FORK_UNSAFE_THREADS = ("rcb_command_recorder", "rcb_ik_worker", "rcb_mirror", "rcb_sink_", "rcb_replay")
+
+
+def fork_context():
+    """Context forking the worker processes, None if they must run sequentially.
+
+    The other start methods would launch another Blender, so the workers are forked, only on
+    Linux and only while none of the threads of the addon is running: a lock held by one of
+    them at the fork would stay locked forever in the children.
+    """
+    if sys.platform != "linux":
+        return None
+    busy = [thread.name for thread in threading.enumerate() if thread.name.startswith(FORK_UNSAFE_THREADS)]
+    if busy:
+        print("Running sequentially, the workers are not forked while these threads run:", ", ".join(busy))
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def build_solver(model, base_frame, endeffector_frame, considered_joints, method, limits):
+    solver = IkChainSolver(model, base_frame, endeffector_frame, considered_joints)
+    if method == "DLS":
+        solver = DlsChainSolver(model, base_frame, endeffector_frame, considered_joints, limits, fallback=solver)
+    return solver
+
+
+def solve_sequence(solver, positions, rpys, seed):
+    # Every target warm-starts from the solution of the previous one.
+    # The failed targets are None and do not change the warm start.
+    solutions = []
+    q = seed
+    for position, rpy in zip(positions, rpys):
+        target = iDynTree.Transform(iDynTree.Rotation.RPY(*rpy), iDynTree.Position(*position))
+        solution = solver.solve(target, q)
+        if solution is not None:
+            q = solution
+        solutions.append(solution)
+    return solutions
+
+
+def solve_chunk(model_urdf, base_frame, endeffector_frame, considered_joints, method, limits,
+                positions, rpys, seed):
+    # Runs in the worker processes, each one loads its own model and solver
+    mdlLoader = iDynTree.ModelLoader()
+    mdlLoader.loadModelFromString(model_urdf)
+    solver = build_solver(mdlLoader.model(), base_frame, endeffector_frame, considered_joints, method, limits)
+    return solve_sequence(solver, positions, rpys, seed)
+
+
+def solve_batch(model_urdf, base_frame, endeffector_frame, considered_joints, method, limits,
+                positions, rpys, initial_pose, n_workers):
+    """Solves the inverse kinematics of a sequence of targets expressed in the base frame.
+
+    positions is (N x 3) in meters, rpys is (N x 3) in radians, initial_pose is a dict
+    joint name -> position used as warm start of the first target. The sequence is split in
+    n_workers contiguous chunks solved in parallel. The first targets of the chunks are solved
+    before, in order and warm-starting each other, so that all the chunks start from
+    consistent configurations.
+    Returns (joint_names, solutions) with one list of joint positions (or None) per target.
+    """
+    mdlLoader = iDynTree.ModelLoader()
+    mdlLoader.loadModelFromString(model_urdf)
+    solver = build_solver(mdlLoader.model(), base_frame, endeffector_frame, considered_joints, method, limits)
+    seed = [initial_pose.get(name, 0.0) for name in solver.joint_names]
+
+    n = len(positions)
+    n_chunks = max(1, min(n_workers, n // 50))
+    bounds = np.linspace(0, n, n_chunks + 1).astype(int)
+
+    context = fork_context() if n_chunks > 1 else None
+    if context is None:
+        return solver.joint_names, solve_sequence(solver, positions, rpys, seed)
+
+    # Seeds of the chunks, i.e. the solutions of their first targets
+    seeds = solve_sequence(solver, positions[bounds[:-1]], rpys[bounds[:-1]], seed)
+    seeds = [s if s is not None else seed for s in seeds]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_chunks, mp_context=context) as executor:
+        futures = [executor.submit(solve_chunk, model_urdf, base_frame, endeffector_frame, considered_joints,
+                                   method, limits, positions[begin:end], rpys[begin:end], chunk_seed)
+                   for begin, end, chunk_seed in zip(bounds[:-1], bounds[1:], seeds)]
+        solutions = []
+        for future in futures:
+            solutions.extend(future.result())
+    return solver.joint_names, solutions
@@ -0,0 +1,167 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import numpy as np
+import idyntree.bindings as iDynTree
+
+FIXED = 0
+REVOLUTE = 1
+PRISMATIC = 2
+
+
+def skew(v):
+    return np.array([[0.0, -v[2], v[1]],
+                     [v[2], 0.0, -v[0]],
+                     [-v[1], v[0], 0.0]])
+
+
+def invert_transforms(H):
+    # Inverse of a stack of homogeneous transforms (..., 4, 4)
+    R_T = np.swapaxes(H[..., :3, :3], -1, -2)
+    H_inv = np.zeros_like(H)
+    H_inv[..., :3, :3] = R_T
+    H_inv[..., :3, 3] = -np.einsum("...ij,...j->...i", R_T, H[..., :3, 3])
+    H_inv[..., 3, 3] = 1.0
+    return H_inv
+
+
+class BatchedForwardKinematics:
+    """Forward kinematics of an iDynTree Model for batches of joint configurations.
+
+    The tree is visited once from the base link, storing for each link its parent,
+    the transform at rest of the joint to the parent and the joint axis expressed in
+    the link frame. The poses are then computed for all the configurations at once,
+    link by link, with NumPy. Only the links needed by the requested frames are computed.
+    It does not use bpy.
+    """
+
+    def __init__(self, model, base_link=None):
+        traversal = iDynTree.Traversal()
+        if base_link is None:
+            ok = model.computeFullTreeTraversal(traversal)
+        else:
+            ok = model.computeFullTreeTraversal(traversal, model.getLinkIndex(base_link))
+        if not ok:
+            raise ValueError("Unable to get the traversal of the model")
+
+        self.model = model
+        self.dofs = model.getNrOfDOFs()
+        n_links = model.getNrOfLinks()
+        # Indexed by link index
+        self.parent = np.full(n_links, -1, dtype=np.int64)
+        self.kind = np.full(n_links, FIXED, dtype=np.int8)
+        self.dof = np.full(n_links, -1, dtype=np.int64)
+        self.rest = np.tile(np.eye(4), (n_links, 1, 1))
+        self.axis_direction = np.zeros((n_links, 3))
+        self.axis_origin = np.zeros((n_links, 3))
+        # Order in which the links are computed, the parents come before the children
+        self.order = []
+        self.joint_names = [""] * self.dofs
+        # joint name -> index of the link it moves, also for the fixed joints
+        self.joint_child_link = {}
+
+        for traversal_idx in range(traversal.getNrOfVisitedLinks()):
+            link_idx = traversal.getLink(traversal_idx).getIndex()
+            self.order.append(link_idx)
+            parent_link = traversal.getParentLink(traversal_idx)
+            if parent_link is None:
+                continue
+            parent_idx = parent_link.getIndex()
+            joint = traversal.getParentJoint(traversal_idx)
+            self.parent[link_idx] = parent_idx
+            self.joint_child_link[model.getJointName(joint.getIndex())] = link_idx
+            # parent_H_link when the joint position is zero
+            self.rest[link_idx] = joint.getRestTransform(parent_idx, link_idx).asHomogeneousTransform().toNumPy()
+            if joint.getNrOfDOFs() == 0:
+                continue
+            if joint.isRevoluteJoint():
+                self.kind[link_idx] = REVOLUTE
+                axis = joint.asRevoluteJoint().getAxis(link_idx, parent_idx)
+            elif joint.isPrismaticJoint():
+                self.kind[link_idx] = PRISMATIC
+                axis = joint.asPrismaticJoint().getAxis(link_idx, parent_idx)
+            else:
+                raise ValueError("Unsupported joint " + model.getJointName(joint.getIndex()))
+            self.dof[link_idx] = joint.getDOFsOffset()
+            self.joint_names[joint.getDOFsOffset()] = model.getJointName(joint.getIndex())
+            self.axis_direction[link_idx] = axis.getDirection().toNumPy()
+            self.axis_origin[link_idx] = axis.getOrigin().toNumPy()
+
+        self.base_link = self.order[0]
+        self.dof_index = {name: idx for idx, name in enumerate(self.joint_names)}
+
+    def frame_link(self, frame_name):
+        # (link index, link_H_frame) of a link or of an additional frame
+        frame_idx = self.model.getFrameIndex(frame_name)
+        if frame_idx < 0:
+            raise ValueError("Unknown frame " + frame_name)
+        link_idx = self.model.getFrameLink(frame_idx)
+        link_H_frame = self.model.getFrameTransform(frame_idx).asHomogeneousTransform().toNumPy()
+        return link_idx, link_H_frame
+
+    def full_configurations(self, q, joint_names=None):
+        # (N x dofs) array ordered as the model, joint_names are the columns of q if not all the joints are given
+        q = np.atleast_2d(np.asarray(q, dtype=np.float64))
+        if joint_names is None:
+            return q
+        full = np.zeros((q.shape[0], self.dofs))
+        full[:, [self.dof_index[name] for name in joint_names]] = q
+        return full
+
+    def joint_transforms(self, link_idx, q):
+        # parent_H_link for all the configurations, (N, 4, 4)
+        n = q.shape[0]
+        if self.kind[link_idx] == FIXED:
+            return np.broadcast_to(self.rest[link_idx], (n, 4, 4))
+        values = q[:, self.dof[link_idx]]
+        direction = self.axis_direction[link_idx]
+        H = np.tile(np.eye(4), (n, 1, 1))
+        if self.kind[link_idx] == REVOLUTE:
+            # Rodrigues' formula, rotation around the axis that passes through its origin
+            K = skew(direction)
+            R = (np.eye(3) + np.sin(values)[:, None, None] * K
+                 + (1.0 - np.cos(values))[:, None, None] * (K @ K))
+            H[:, :3, :3] = R
+            H[:, :3, 3] = self.axis_origin[link_idx] - R @ self.axis_origin[link_idx]
+        else:
+            H[:, :3, 3] = values[:, None] * direction
+        return self.rest[link_idx] @ H
+
+    def link_poses(self, q, links):
+        # base_H_link of the given link indices and of their ancestors, dict link index -> (N, 4, 4)
+        needed = set()
+        for link_idx in links:
+            while link_idx >= 0 and link_idx not in needed:
+                needed.add(link_idx)
+                link_idx = self.parent[link_idx]
+        poses = {}
+        for link_idx in self.order:
+            if link_idx not in needed:
+                continue
+            if self.parent[link_idx] < 0:
+                poses[link_idx] = np.broadcast_to(np.eye(4), (q.shape[0], 4, 4))
+            else:
+                poses[link_idx] = poses[self.parent[link_idx]] @ self.joint_transforms(link_idx, q)
+        return poses
+
+    def frame_poses(self, q, frame_names, joint_names=None, chunk_size=20000):
+        """Poses of the frames respect to the base link, (N, len(frame_names), 4, 4).
+        q is (N x dofs), or (N x len(joint_names)) with the other joints at zero.
+        The configurations are processed in chunks to limit the memory."""
+        q = self.full_configurations(q, joint_names)
+        frames = [self.frame_link(name) for name in frame_names]
+        result = np.empty((q.shape[0], len(frames), 4, 4))
+        for begin in range(0, q.shape[0], chunk_size):
+            chunk = q[begin:begin + chunk_size]
+            poses = self.link_poses(chunk, [link_idx for link_idx, _ in frames])
+            for column, (link_idx, link_H_frame) in enumerate(frames):
+                result[begin:begin + chunk_size, column] = poses[link_idx] @ link_H_frame
+        return result
+
+    def relative_transforms(self, q, base_frame, target_frame, joint_names=None, chunk_size=20000):
+        # base_frame_H_target_frame for all the configurations, (N, 4, 4)
+        poses = self.frame_poses(q, [base_frame, target_frame], joint_names, chunk_size)
+        return invert_transforms(poses[:, 0]) @ poses[:, 1]
@@ -4,23 +4,49 @@
 # This software may be modified and distributed under the terms of the
 # BSD-3-Clause license. See the accompanying LICENSE file for details.
 
-from ntpath import join
 import bpy
+import mathutils
 import os
 # import sys
-import yarp
 import idyntree.bindings as iDynTree
-# import numpy as np
 import math
 import json
+import time
+import concurrent.futures
+import threading
+import numpy as np
 from .common_functions import (printError,
-                               look_for_bones_with_drivers,
-                               bones_with_driver,
+                               get_armature_joint_table,
+                               armature_joint_limits,
+                               get_ik_solver,
+                               get_multi_target_ik_solver,
+                               target_transform,
+                               current_joint_positions,
+                               apply_joint_positions,
                                IkVariables as ikv,
                                InverseKinematics,
                                )
-
-from bpy_extras.io_utils import ImportHelper
+from .ik_worker import IkWorker
+from .batch_ik import solve_batch
+from . import reachability
+from . import trajectory_overlay
+from .batched_fk import BatchedForwardKinematics
+from .self_collision import link_bodies, SelfCollisionChecker
+from . import limit_validator
+from . import retiming
+from . import dynamics_check
+from . import log_import
+from . import robot_mirror
+from . import command_coalescing
+from . import keyframe_thinning
+from . import broadcaster
+from . import streaming_stats as sstats
+from . import controlboard_backends as cb
+from . import command_log
+from . import fcurve_utils as fcu
+from . import joint_table as jt
+
+from bpy_extras.io_utils import ImportHelper, ExportHelper
 from bpy_extras import view3d_utils
 
 from bpy.props import (StringProperty,
@@ -29,11 +55,9 @@ from bpy.props import (StringProperty,
                        FloatProperty,
                        FloatVectorProperty,
                        EnumProperty,
-                       PointerProperty,
-                       CollectionProperty
+                       PointerProperty
                        )
 from bpy.types import (Panel,
-                       Menu,
                        Operator,
                        PropertyGroup,
                        UIList
@@ -41,6 +65,14 @@ from bpy.types import (Panel,
 
 list_of_links = []
 
+# Recorder of the commands while the dry run is enabled
+dry_run_recorder = None
+# DynamicsResult of the last dynamics check
+dynamics_result = None
+# Broadcaster of the targets and the options its sinks were built with
+active_broadcaster = None
+broadcaster_signature = None
+
 global robot_name
 robot_name = "R1Mk3" # R1SN003 or iCub or R1Mk3
 
@@ -49,14 +81,12 @@ robot_name = "R1Mk3" # R1SN003 or iCub or R1Mk3
 # ------------------------------------------------------------------------
 
 class rcb_wrapper():
-    def __init__(self, driver, icm, iposDir, ipos, ienc, encs, iax, joint_limits):
-        self.driver = driver
-        self.icm = icm
-        self.iposDir = iposDir
-        self.ipos = ipos
-        self.ienc = ienc
-        self.encs = encs
-        self.iax = iax
+    def __init__(self, board, axis_names, joint_limits, pool_key=None):
+        # board is one of the backends defined in controlboard_backends
+        self.board = board
+        self.pool_key = pool_key
+        self.axis_names = axis_names
+        self.encs = []
         self.joint_limits = joint_limits
 
 
@@ -66,44 +96,203 @@ class rcb_wrapper():
 def register_rcb(rcb_instance, rcb_name):
     scene = bpy.types.Scene
     scene.rcb_wrapper[rcb_name] = rcb_instance
+    jt.map_part(rcb_name, rcb_instance.axis_names)
+    command_coalescing.reset(rcb_name)
+    robot_mirror.update_parts(scene.rcb_wrapper)
 
 
 def unregister_rcb(rcb_name):
+    # The sink of the part must not send to the board once it is released, the
+    # broadcaster is rebuilt at the next frame change
+    close_broadcaster()
+    jt.unmap_part(rcb_name)
     try:
         del bpy.types.Scene.rcb_wrapper[rcb_name]
     except:
         pass
+    command_coalescing.reset(rcb_name)
+    robot_mirror.update_parts(bpy.types.Scene.rcb_wrapper)
+
+
+def open_rcb(pool_key, new_board):
+    # Open the board (or reuse the one parked by a previous disconnection), put all its
+    # joints in position direct and fetch their limits.
+    # It runs on the worker threads of "Connect all", so it must not touch bpy.
+    board = cb.acquire_board(pool_key, new_board)
+    if board is None:
+        return None
+    board.set_control_modes(cb.CM_POSITION_DIRECT)
+    joint_limits = [list(limits) for limits in board.get_all_limits()]
+    return rcb_wrapper(board, board.get_axis_names(), joint_limits, pool_key)
+
+
+def close_rcb(rcb_instance):
+    # The board is not closed, it is kept for the next connection of the same part
+    cb.release_board(rcb_instance.pool_key, rcb_instance.board)
+
+
+def park_late_rcb(future):
+    # Called when a connection that already timed out completes
+    if future.exception() is None and future.result() is not None:
+        close_rcb(future.result())
+
+
+def part_axis_names(part):
+    return [name.strip() for name in part.axisNames.split(",") if name.strip()]
+
+
+def board_pool_key(part_name, mytool):
+    return (mytool.my_backend, mytool.my_string, part_name)
+
+
+def create_board(part_name, axis_names, mytool):
+    # Only builds the board, it is opened by open_rcb
+    if mytool.my_backend == "FAKE":
+        table = get_armature_joint_table(mytool.my_armature)
+        if not axis_names:
+            # Without an explicit list of axes the fake part controls all the joints of the armature
+            axis_names = list(table.names)
+        return cb.FakeControlBoard(axis_names,
+                                   [table.limits_deg(name) if name in table.index else (-360.0, 360.0)
+                                    for name in axis_names],
+                                   latency=mytool.my_fake_latency / 1000.0,
+                                   time_constant=mytool.my_fake_time_constant)
+    # print(f'remote port: {"/"+mytool.my_string+"/"+part_name}')
+    return cb.YarpControlBoard(mytool.my_string,
+                               "/blender_controller/client/" + part_name,
+                               "/r1mk3Sim/" + part_name)
+
+
+def get_dry_run_recorder(mytool):
+    global dry_run_recorder
+    if dry_run_recorder is None:
+        dry_run_recorder = command_log.CommandRecorder(bpy.path.abspath(mytool.my_dry_run_log))
+    return dry_run_recorder
+
+
+def close_dry_run_recorder():
+    global dry_run_recorder
+    if dry_run_recorder is not None:
+        # The recorder sink of the broadcaster writes in it
+        close_broadcaster()
+        dry_run_recorder.close()
+        dry_run_recorder = None
+
+
+def dry_run_callback(self, context):
+    # The log is closed as soon as the dry run is disabled, so that it can be replayed
+    if not self.my_bool:
+        close_dry_run_recorder()
+
+
+def get_broadcaster(mytool, table):
+    # The sinks are rebuilt when the connected parts or the options change
+    global active_broadcaster, broadcaster_signature
+    rcb_wrappers = bpy.types.Scene.rcb_wrapper
+    signature = (tuple(table.names),
+                 tuple((name, id(rcb_instance.board)) for name, rcb_instance in rcb_wrappers.items()),
+                 mytool.my_bool, mytool.my_broadcast_record, mytool.my_publish_address, mytool.my_jump_threshold,
+                 mytool.my_settle_tolerance, mytool.my_scrub_rate, mytool.my_approach_speed)
+    if active_broadcaster is not None and signature == broadcaster_signature:
+        return active_broadcaster
+    close_broadcaster()
+    # The log stays open only if it is written
+    if not mytool.my_bool and not mytool.my_broadcast_record:
+        close_dry_run_recorder()
+    # The sinks of the parts coalesce their own targets, the ones waiting for the timer are dropped
+    command_coalescing.clear()
+    active_broadcaster = broadcaster.Broadcaster(table.names)
+    # Without connected parts the whole rig is recorded as a single part
+    parts = ([(name, rcb_instance.axis_names, table.columns(name)) for name, rcb_instance in rcb_wrappers.items()]
+             or [("rig", table.names, list(enumerate(range(len(table)))))])
+    if not mytool.my_bool:
+        # One sink per part, so a slow board does not delay the others
+        for name, rcb_instance in rcb_wrappers.items():
+            active_broadcaster.add_sink(broadcaster.BoardSink(
+                name, rcb_instance.board, table.columns(name),
+                command_coalescing.PartCoalescer(rcb_instance.board), sstats.get_part_stats(name),
+                mytool.my_jump_threshold, mytool.my_settle_tolerance, mytool.my_scrub_rate, mytool.my_approach_speed))
+    if mytool.my_bool or mytool.my_broadcast_record:
+        # The same recorder of the dry run, the log is not reopened when the sinks are rebuilt
+        active_broadcaster.add_sink(broadcaster.RecorderSink(
+            "recorder", get_dry_run_recorder(mytool), parts))
+    if mytool.my_publish_address:
+        try:
+            address = broadcaster.parse_address(mytool.my_publish_address)
+        except ValueError:
+            print(f"Invalid publisher address {mytool.my_publish_address}, expected host:port")
+        else:
+            active_broadcaster.add_sink(broadcaster.UdpPublisherSink("publisher", address, table.names))
+    broadcaster_signature = signature
+    return active_broadcaster
+
+
+def close_broadcaster():
+    global active_broadcaster, broadcaster_signature
+    if active_broadcaster is not None:
+        active_broadcaster.close()
+        active_broadcaster = None
+        broadcaster_signature = None
+
+
+def broadcast_callback(self, context):
+    # The sinks are closed, and the log if the dry run is not using it, so it can be replayed
+    if not self.my_broadcast:
+        close_broadcaster()
+        if not self.my_bool:
+            close_dry_run_recorder()
 
 
 def move(dummy):
+    # Timestamp of the frame change, all the latencies of this call are measured from here
+    t_frame = sstats.now()
     threshold = 10.0 # degrees
     scene = bpy.types.Scene
     mytool = bpy.context.scene.my_tool
+    frame = bpy.context.scene.frame_current
+    frame_step = bpy.context.scene.frame_step
+    is_playing = bpy.context.screen is not None and bpy.context.screen.is_animation_playing
+    # While mirroring the pose follows the robot, it must not be sent back,
+    # while replaying a log the boards are commanded by the replay
+    if robot_mirror.is_running() or WM_OT_ReplayCommandLog.is_running():
+        return
+    # The frame changes out of the playback come from the timeline scrubbing or from jumps,
+    # without a screen (blender -b) the frames are set by a script
+    scrubbing = bpy.context.screen is not None and not is_playing
+    # In dry run the commands go to the log instead of the control boards
+    recorder = get_dry_run_recorder(mytool) if mytool.my_bool else None
+    table = get_armature_joint_table(mytool.my_armature)
+    # The targets of all the joints are extracted once, in degrees
+    targets = np.degrees(table.joint_values(bpy.data.objects[mytool.my_armature]))
+    if mytool.my_broadcast:
+        # The sinks send the targets on their own threads
+        get_broadcaster(mytool, table).publish(frame, t_frame, targets, frame_step, is_playing, scrubbing)
+        return
     for key in scene.rcb_wrapper:
         rcb_instance = scene.rcb_wrapper[key]
+        stats = sstats.get_part_stats(key)
+        stats.frame_changed(frame, frame_step, is_playing)
         # Get the handles
-        icm     = rcb_instance.icm
-        iposDir = rcb_instance.iposDir
-        ipos    = rcb_instance.ipos
-        ienc    = rcb_instance.ienc
-        encs    = rcb_instance.encs
-        iax     = rcb_instance.iax
+        board   = rcb_instance.board
+        coalescer = command_coalescing.get_coalescer(key, board)
+        coalescer.frame_changed(frame, frame_step, is_playing)
         joint_limits     = rcb_instance.joint_limits
         # Get the targets from the rig
-        ok_enc = ienc.getEncoders(encs.data())
-        if not ok_enc:
+        encs = board.get_encoders()
+        if encs is None:
+            stats.frame_dropped()
             print("I cannot read the encoders, skipping")
-            return
-
-        for joint in range(0, ipos.getAxes()):
-            # TODO handle the name of the armature, just keep robot_name for now
-            joint_name = iax.getAxisName(joint)
-            if joint_name not in bpy.data.objects[mytool.my_armature].pose.bones.keys():
-                print(f"Skipping the motion of the requested joint {joint_name} because it is not present in the armature of the model.")
-                print("May have you mispelled the name? Check the joint tag names in the .urdf file, or the names of the bones in the .blend file of the model")
-                continue
-
-            target = math.degrees(bpy.data.objects[mytool.my_armature].pose.bones[joint_name].rotation_euler[1])
+            stats.handler_done(t_frame, sstats.now())
+            continue
+        rcb_instance.encs = encs
+        # Close the pending commands whose joint reached the target
+        stats.encoders_read(encs, mytool.my_settle_tolerance, sstats.now())
+
+        # The axes that are not joints of the armature are not mapped, see joint_table.map_part
+        for joint, column in table.columns(key):
+            joint_name = table.names[column]
+            target = float(targets[column])
+            t_extract = sstats.now()
             min    = joint_limits[joint][0]
             max    = joint_limits[joint][1]
             # if max < min:
@@ -124,45 +313,57 @@ def move(dummy):
 
             safety_check = False
 
-            if safety_check:
+            if recorder is not None:
+                recorder.record(key, rcb_instance.axis_names, joint, target)
+                stats.command_sent(joint, target, t_frame, t_extract, sstats.now())
+            elif safety_check:
                 print("The target is too far, reaching in position control, for joint", joint_name, "by ", abs(encs[joint] - target), " degrees" )
 
                 # Pause the animation
                 bpy.ops.screen.animation_play() # We have to check if it is ok
                 # Switch to position control and move to the target
                 # TODO try to find a way to use the s methods
-                icm.setControlMode(joint, yarp.VOCAB_CM_POSITION)
-                ipos.setRefSpeed(joint,10)
-                ipos.positionMove(joint,target)
-                done = ipos.isMotionDone(joint)
+                board.set_control_mode(joint, cb.CM_POSITION)
+                board.set_ref_speed(joint,10)
+                board.position_move(joint,target)
+                done = board.is_motion_done(joint)
                 while not done:
-                    done = ipos.isMotionDone(joint)
-                    yarp.delay(0.001)
+                    done = board.is_motion_done(joint)
+                    time.sleep(0.001)
                 # Once finished put the joints in position direct and replay the animation back
-                icm.setControlMode(joint, yarp.VOCAB_CM_POSITION_DIRECT)
+                board.set_control_mode(joint, cb.CM_POSITION_DIRECT)
                 bpy.ops.screen.animation_play()
-            else:
+            elif coalescer.submit(joint, target, encs[joint], scrubbing, mytool.my_jump_threshold, stats):
                 print(f"move() has been called, moving joint {joint_name} to target {target}")
-                iposDir.setPosition(joint,target)
-
-
-def float_callback(self, context):
-    # Callback for sliders. Find each object in the links dictionary and set its rotation.
-    try:
-        joint_tool = context.scene.my_joints
-        pose_bones = bpy.data.objects[bpy.context.scene.my_tool.my_armature].pose.bones
-        for joint_name, joint_value in joint_tool.items():
-            joint = pose_bones[joint_name]
-            # It is a prismatic joint (to be tested)
-            if joint.lock_rotation[1]:
-                joint.delta_location[1] = joint_value
-            # It is a revolute joint
-            else:
-                joint.rotation_euler[1] = joint_value * math.pi / 180.0
-                joint.keyframe_insert(data_path="rotation_euler")
-
-    except AttributeError:
-        pass
+                board.set_position(joint,target)
+                stats.command_sent(joint, target, t_frame, t_extract, sstats.now())
+
+        if coalescer.pending:
+            command_coalescing.schedule_flush(mytool.my_scrub_rate, mytool.my_approach_speed)
+        stats.handler_done(t_frame, sstats.now())
+
+
+def write_joint(armature_object, joint_name, joint_value, frame, insert_key=True):
+    # Write a single slider value (degrees for the revolute joints) on its bone and key it
+    joint = armature_object.pose.bones[joint_name]
+    # It is a prismatic joint (to be tested)
+    if joint.lock_rotation[1]:
+        joint.delta_location[1] = joint_value
+    # It is a revolute joint
+    else:
+        joint.rotation_euler[1] = joint_value * math.pi / 180.0
+        if insert_key:
+            fcu.insert_key(fcu.joint_fcurve(armature_object, joint_name), frame, joint.rotation_euler[1])
+
+
+def joint_callback(joint_name):
+    # Callback for the slider of joint_name, only the bone of the changed joint is written
+    def callback(self, context):
+        armature_object = bpy.data.objects.get(context.scene.my_tool.my_armature)
+        if armature_object is None or joint_name not in armature_object.pose.bones:
+            return
+        write_joint(armature_object, joint_name, getattr(self, joint_name), context.scene.frame_current)
+    return callback
 
 
 class AllJoints:
@@ -174,26 +375,12 @@ class AllJoints:
 
     def generate_joint_classes(self):
 
-        self.joint_names = bpy.data.objects[bpy.context.scene.my_tool.my_armature].pose.bones.keys()
-
-        for joint_name, joint in bpy.data.objects[bpy.context.scene.my_tool.my_armature].pose.bones.items():
-
-            # Our bones rotate around y (revolute joint), translate along y (prismatic joint), if both are locked, it
-            # means it is a fixed joint.
-            if joint.lock_rotation[1] and joint.lock_location[1]:
-                continue
-
-            joint_min = -360
-            joint_max =  360
+        table = get_armature_joint_table(bpy.context.scene.my_tool.my_armature)
+        self.signature = table.signature()
+        self.joint_names = table.names
 
-            rot_constraint = None
-            for constraint in joint.constraints:
-                if constraint.type == "LIMIT_ROTATION":
-                    rot_constraint = constraint
-                    break
-            if rot_constraint is not None:
-                joint_min = rot_constraint.min_y * 180 / math.pi
-                joint_max = rot_constraint.max_y * 180 / math.pi
+        for joint_name in table.names:
+            joint_min, joint_max = table.limits_deg(joint_name)
 
             self.annotations[joint_name] = FloatProperty(
                 name=joint_name,
@@ -201,7 +388,7 @@ class AllJoints:
                 default=0,
                 min=joint_min,
                 max=joint_max,
-                update=float_callback,
+                update=joint_callback(joint_name),
             )
 
 
@@ -212,14 +399,107 @@ class AllJoints:
 def getLinks(self, context):
     return list_of_links
 
+
+def trajectory_callback(self, context):
+    trajectory_overlay.show(self.my_show_trajectory)
+
+
+def armature_callback(self, context):
+    jt.invalidate()
+
 class MyProperties(PropertyGroup):
 
     my_bool: BoolProperty(
         name="Dry run",
-        description="If ticked, the movement will not replayed",
+        description="If ticked, the movement will not replayed, the commands are saved in the dry run log",
+        default=False,
+        update=dry_run_callback
+        )
+
+    my_dry_run_log: StringProperty(
+        name="Dry run log",
+        description="File where the commands are appended during the dry run",
+        default="//commands.rcblog",
+        maxlen=1024,
+        subtype='FILE_PATH'
+        )
+
+    my_broadcast: BoolProperty(
+        name="Broadcast",
+        description="Extract the targets once per frame and send them to all the sinks, each on its own thread",
+        default=False,
+        update=broadcast_callback
+        )
+
+    my_broadcast_record: BoolProperty(
+        name="Record",
+        description="Add a sink recording the broadcast targets in the dry run log",
         default=False
         )
 
+    my_publish_address: StringProperty(
+        name="Publish to",
+        description="host:port where the broadcast targets are published as JSON over UDP, empty for not publishing",
+        default="",
+        maxlen=1024
+        )
+
+    my_replay_speed: FloatProperty(
+        name="Replay speed",
+        description="Scale of the speed used for replaying the command log",
+        default=1.0,
+        min=0.1,
+        max=10.0
+        )
+
+    my_mirror_rate: FloatProperty(
+        name="Read rate (Hz)",
+        description="Rate of the reads of the encoders while mirroring the robot",
+        default=100.0,
+        min=1.0,
+        max=1000.0
+        )
+
+    my_mirror_display_rate: FloatProperty(
+        name="Display rate (Hz)",
+        description="Maximum rate of the updates of the pose while mirroring the robot",
+        default=30.0,
+        min=1.0,
+        max=120.0
+        )
+
+    my_mirror_record: BoolProperty(
+        name="Record",
+        description="Key the mirrored motion in the action when the mirroring is stopped",
+        default=False
+        )
+
+    my_log_axis_names: StringProperty(
+        name="Axis names",
+        description="Comma separated names of the axes of the log, if empty the names in the CSV header or the axes of the selected connected part",
+        default=""
+        )
+
+    my_log_header_columns: IntProperty(
+        name="Leading columns",
+        description="Columns before the axes in the yarp logs (counter and timestamp), the timestamp is the last of them",
+        default=2,
+        min=1
+        )
+
+    my_log_resample: BoolProperty(
+        name="One key per frame",
+        description="Resample the log at the scene frame rate instead of keying every sample",
+        default=True
+        )
+
+    my_log_tolerance: FloatProperty(
+        name="Simplify tolerance (deg)",
+        description="Drop the samples that can be interpolated from the kept ones within this tolerance, 0 for keeping all of them",
+        default=0.0,
+        min=0.0
+        )
+
     my_int: IntProperty(
         name="Int Value",
         description="A integer property",
@@ -236,6 +516,77 @@ class MyProperties(PropertyGroup):
         max=15.0
         )
 
+    my_backend: EnumProperty(
+        name="Backend",
+        description="Control boards used for the connection",
+        items=[("YARP", "YARP", "remote_controlboard of a YARP-based robot or simulator"),
+               ("FAKE", "Fake", "In-process simulated control board, no YARP server needed")]
+        )
+
+    my_fake_latency: FloatProperty(
+        name="Fake latency(ms)",
+        description="Delay added to every call of the fake control boards",
+        default=0.0,
+        min=0.0,
+        max=1000.0
+        )
+
+    my_fake_time_constant: FloatProperty(
+        name="Fake time constant(s)",
+        description="Time constant of the simulated joints of the fake control boards",
+        default=0.05,
+        min=0.0,
+        max=10.0
+        )
+
+    my_connect_timeout: FloatProperty(
+        name="Connection timeout(s)",
+        description="Time after which \"Connect all\" gives up on the parts that are not connected yet",
+        default=10.0,
+        min=0.5,
+        max=120.0
+        )
+
+    my_settle_tolerance: FloatProperty(
+        name="Settle tolerance(degrees)",
+        description="Distance from the target under which a joint is considered arrived, used for the latency statistics",
+        default=1.0,
+        min=0.01,
+        max=10.0
+        )
+
+    my_scrub_rate: FloatProperty(
+        name="Scrub rate (Hz)",
+        description="Maximum rate of the commands while scrubbing the timeline, the intermediate frames are merged",
+        default=20.0,
+        min=1.0,
+        max=200.0
+        )
+
+    my_jump_threshold: FloatProperty(
+        name="Jump threshold(degrees)",
+        description="Targets farther than this from the last command are approached at the approach speed",
+        default=5.0,
+        min=0.1,
+        max=180.0
+        )
+
+    my_approach_speed: FloatProperty(
+        name="Approach speed(degrees/s)",
+        description="Speed used for reaching the targets after a jump",
+        default=30.0,
+        min=1.0,
+        max=360.0
+        )
+
+    my_thinning_tolerance: FloatProperty(
+        name="Tolerance(degrees)",
+        description="Maximum difference of the joints from the original keys after the thinning",
+        default=0.1,
+        min=0.0001,
+        max=10.0
+        )
+
     my_float_vector: FloatVectorProperty(
         name="Float Vector Value",
         description="Something",
@@ -256,6 +607,7 @@ class MyProperties(PropertyGroup):
         description=":",
         default=robot_name,
         maxlen=1024,
+        update=armature_callback
         )
 
     my_path: StringProperty(
@@ -314,6 +666,122 @@ class MyProperties(PropertyGroup):
         max=360.0
         )
 
+    my_ik_solver: EnumProperty(
+        name="Solver",
+        description="Inverse kinematics solver",
+        items=[("OPTIMIZATION", "Optimization", "iDynTree InverseKinematics, accurate but slow"),
+               ("DLS", "Damped least-squares", "Fast differential inverse kinematics, the optimization is used for the targets it cannot reach")]
+        )
+
+    my_live_drag: BoolProperty(
+        name="Live drag",
+        description="If ticked, the Drag & Drop follows the mouse while the left button is pressed, the waypoint is set on release",
+        default=False
+        )
+
+    my_ik_target_object: PointerProperty(
+        name="Target",
+        description="Animated object (e.g. an empty) or curve followed by the end-effector over the frame range",
+        type=bpy.types.Object
+        )
+
+    my_ik_target_rotation: BoolProperty(
+        name="Follow rotation",
+        description="If ticked, the end-effector follows also the rotation of the animated object in every frame, otherwise (and along a curve) it keeps the orientation set in the panel",
+        default=True
+        )
+
+    my_batch_workers: IntProperty(
+        name="Workers",
+        description="Number of processes solving the inverse kinematics of the frame range in parallel",
+        default=min(os.cpu_count() or 1, 8),
+        min=1,
+        max=64
+        )
+
+    my_show_trajectory: BoolProperty(
+        name="Show trajectory",
+        description="Draw in the viewport the path of the end-effector frame over the frame range",
+        default=False,
+        update=trajectory_callback
+        )
+
+    my_validation_rate: FloatProperty(
+        name="Rate (Hz)",
+        description="Rate at which the animation is sampled for validating the limits, the one of the controller",
+        default=100.0,
+        min=1.0,
+        max=10000.0
+        )
+
+    my_max_velocity: FloatProperty(
+        name="Max velocity (deg/s)",
+        description="Maximum speed of the joints, 0 for not checking it",
+        default=100.0,
+        min=0.0
+        )
+
+    my_max_acceleration: FloatProperty(
+        name="Max acceleration (deg/s^2)",
+        description="Maximum acceleration of the joints, 0 for not checking it",
+        default=0.0,
+        min=0.0
+        )
+
+    my_retime_mode: EnumProperty(
+        name="Retime",
+        description="How the retimed animation is written",
+        items=[("KEYS", "Move keys", "Move the keyframes, their values are kept"),
+               ("BAKE", "Bake", "Key the joints in every frame of the retimed animation, it follows exactly the original path")]
+        )
+
+    my_max_torque: FloatProperty(
+        name="Max torque (Nm)",
+        description="Maximum torque of the joints, 0 for not checking it",
+        default=0.0,
+        min=0.0
+        )
+
+    my_support_frames: StringProperty(
+        name="Support frames",
+        description="Comma separated frames in contact with the ground (e.g. the soles), the support polygon is the hull of their rectangles",
+        default=""
+        )
+
+    my_support_half_length: FloatProperty(
+        name="Half length",
+        description="Half size along x of the support rectangle of each frame (m)",
+        default=0.1,
+        min=0.0
+        )
+
+    my_support_half_width: FloatProperty(
+        name="Half width",
+        description="Half size along y of the support rectangle of each frame (m)",
+        default=0.05,
+        min=0.0
+        )
+
+    my_min_com_margin: FloatProperty(
+        name="Min COM margin (m)",
+        description="Minimum distance of the center of mass projection inside the support polygon",
+        default=0.0
+        )
+
+    my_collision_convex: BoolProperty(
+        name="Convex hulls",
+        description="Check the self-collisions on the convex hulls of the link meshes, faster and conservative",
+        default=True
+        )
+
+    my_reach_samples: IntProperty(
+        name="Samples",
+        description="Number of configurations sampled for the reachability map of the chain",
+        default=20000,
+        min=1000,
+        max=1000000
+        )
+
     my_baseframeenum: EnumProperty(
         name="Base frame name:",
         description="Select the base frame:",
@@ -337,12 +805,63 @@ class ListItem(PropertyGroup):
            description="",
            default="")
 
+    axisNames: StringProperty(
+           name="Axis names",
+           description="Comma separated axes of the part, used by the fake control boards",
+           default="")
+
     isConnected: BoolProperty(
         name="",
         default = False
     )
 
 
+class IkTargetItem(PropertyGroup):
+    frame: EnumProperty(
+        name="Frame",
+        description="Frame that has to reach the target",
+        items=getLinks
+        )
+
+    mode: EnumProperty(
+        name="Mode",
+        description="How the target is enforced",
+        items=[("COST", "Weighted", "The target is reached as much as possible, according to the weights"),
+               ("POSITION", "Position constraint", "The position is a constraint, the rotation is weighted"),
+               ("ROTATION", "Rotation constraint", "The rotation is a constraint, the position is weighted"),
+               ("FULL", "Constraint", "The target is a constraint")]
+        )
+
+    x: FloatProperty(name="X", description="The target along x axis", default=0.0, min=-100.0, max=100.0)
+    y: FloatProperty(name="Y", description="The target along y axis", default=0.0, min=-100.0, max=100.0)
+    z: FloatProperty(name="Z", description="The target along z axis", default=0.0, min=-100.0, max=100.0)
+    roll: FloatProperty(name="Roll", description="The target around Roll", default=0.0, min=-360.0, max=360.0)
+    pitch: FloatProperty(name="Pitch", description="The target around Pitch", default=0.0, min=-360.0, max=360.0)
+    yaw: FloatProperty(name="Yaw", description="The target around Yaw", default=0.0, min=-360.0, max=360.0)
+
+    position_weight: FloatProperty(
+        name="Position weight",
+        description="Weight of the position error in the cost",
+        default=1.0,
+        min=0.0
+        )
+
+    rotation_weight: FloatProperty(
+        name="Rotation weight",
+        description="Weight of the rotation error in the cost, 0 for reaching only the position",
+        default=1.0,
+        min=0.0
+        )
+
+
+class MY_UL_IkTargets(UIList):
+
+    def draw_item(self, context, layout, data, item, icon, active_data,
+                  active_propname, index):
+        mode = item.bl_rna.properties["mode"].enum_items[item.mode].name
+        layout.label(text=f"{item.frame} ({mode})", icon='EMPTY_AXIS')
+
+
 class MY_UL_List(UIList):
 
     def draw_item(self, context, layout, data, item, icon, active_data,
@@ -371,9 +890,10 @@ class WM_OT_Disconnect(bpy.types.Operator):
 
         if rcb_instance is None:
             return {'CANCELLED'}
-        rcb_instance.driver.close()
+        # The mirroring stops reading the board before it is released
+        unregister_rcb(getattr(parts[scene.list_index], "value"))
 
-        del bpy.types.Scene.rcb_wrapper[getattr(parts[scene.list_index], "value")]
+        close_rcb(rcb_instance)
 
         setattr(parts[scene.list_index], "isConnected", False)
 
@@ -390,70 +910,349 @@ class WM_OT_Connect(bpy.types.Operator):
         parts = scene.my_list
         mytool = scene.my_tool
 
-        yarp.Network.init()
-        if not yarp.Network.checkNetwork():
+        part = parts[scene.list_index]
+        if mytool.my_backend == "YARP" and not cb.YarpControlBoard.init_network():
             printError(self, "YARP server is not running!")
             return {'CANCELLED'}
 
-        options = yarp.Property()
-        driver = yarp.PolyDriver()
+        rcb_instance = open_rcb(board_pool_key(part.value, mytool),
+                                create_board(part.value, part_axis_names(part), mytool))
+        if rcb_instance is None:
+            printError(self, "Cannot open the driver!")
+            return {'CANCELLED'}
 
-        # set the poly driver options
-        options.put("robot", mytool.my_string)
-        options.put("device", "remote_controlboard")
-        print(f'local port: {"/blender_controller/client/"+getattr(parts[scene.list_index], "value")}')
-        options.put("local", "/blender_controller/client/"+getattr(parts[scene.list_index], "value"))
-        # print(f'remote port: {"/"+mytool.my_string+"/"+getattr(parts[scene.list_index], "value")}')
-        # options.put("remote", "/"+mytool.my_string+"/"+getattr(parts[scene.list_index], "value"))
-        print(f'remote port: {"/r1mk3Sim/"+getattr(parts[scene.list_index], "value")}')
-        options.put("remote", "/r1mk3Sim/"+getattr(parts[scene.list_index], "value"))
+        register_rcb(rcb_instance, getattr(parts[scene.list_index], "value"))
 
-        # opening the drivers
-        print('Opening the motor driver...')
-        driver.open(options)
+        setattr(parts[scene.list_index], "isConnected", True)
 
-        if not driver.isValid():
-            printError(self, "Cannot open the driver!")
+        # TODO check if we need this
+        #bpy.app.handlers.frame_change_post.clear()
+        #bpy.app.handlers.frame_change_post.append(move)
+
+        return {'FINISHED'}
+
+
+class WM_OT_ConnectAll(bpy.types.Operator):
+    bl_label = "Connect all"
+    bl_idname = "wm.connect_all"
+    bl_description= "connect concurrently all the parts that are not connected yet"
+
+    # Shown by the panel while the parts are being connected
+    progress = ""
+
+    _timer = None
+    _executor = None
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+
+        if mytool.my_backend == "YARP" and not cb.YarpControlBoard.init_network():
+            printError(self, "YARP server is not running!")
             return {'CANCELLED'}
 
-        # opening the drivers
-        print('Viewing motor position/encoders...')
-        icm = driver.viewIControlMode()
-        iposDir = driver.viewIPositionDirect()
-        ipos = driver.viewIPositionControl()
-        ienc = driver.viewIEncoders()
-        iax = driver.viewIAxisInfo()
-        ilim = driver.viewIControlLimits()
-        if ienc is None or ipos is None or icm is None or iposDir is None or iax is None or ilim is None:
-            printError(self, "Cannot view one of the interfaces!")
+        if WM_OT_ConnectAll._executor is None:
+            WM_OT_ConnectAll._executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="rcb_connect")
+
+        # The boards are built here since create_board reads the armature, only the
+        # blocking part (opening the drivers and querying them) runs on the workers
+        self.futures = {}
+        for part in scene.my_list:
+            if part.value in bpy.types.Scene.rcb_wrapper:
+                continue
+            board = create_board(part.value, part_axis_names(part), mytool)
+            self.futures[part.value] = WM_OT_ConnectAll._executor.submit(
+                open_rcb, board_pool_key(part.value, mytool), board)
+
+        if not self.futures:
             return {'CANCELLED'}
 
-        encs = yarp.Vector(ipos.getAxes())
-        joint_limits = []
+        self.n_parts = len(self.futures)
+        self.failed = []
+        self.start = time.monotonic()
+        self.timeout = mytool.my_connect_timeout
+        context.window_manager.progress_begin(0, self.n_parts)
+        self._timer = context.window_manager.event_timer_add(0.05, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        self.update_progress(context)
+        return {'RUNNING_MODAL'}
 
-        for joint in range(0, ipos.getAxes()):
-            min = yarp.Vector(1)
-            max = yarp.Vector(1)
-            icm.setControlMode(joint, yarp.VOCAB_CM_POSITION_DIRECT)
-            ilim.getLimits(joint, min.data(), max.data())
-            joint_limits.append([min.get(0), max.get(0)])
+    def update_progress(self, context):
+        done = self.n_parts - len(self.futures)
+        WM_OT_ConnectAll.progress = f"Connecting {done}/{self.n_parts}..."
+        context.window_manager.progress_update(done)
+        for area in context.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
 
-        register_rcb(rcb_wrapper(driver, icm, iposDir, ipos, ienc, encs, iax, joint_limits), getattr(parts[scene.list_index], "value"))
+    def modal(self, context, event):
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        parts = context.scene.my_list
+        timed_out = time.monotonic() - self.start > self.timeout
+        for part_name in list(self.futures.keys()):
+            future = self.futures[part_name]
+            if future.done():
+                del self.futures[part_name]
+                rcb_instance = future.result() if future.exception() is None else None
+                if rcb_instance is None:
+                    self.failed.append(part_name)
+                    continue
+                register_rcb(rcb_instance, part_name)
+                for part in parts:
+                    if part.value == part_name:
+                        part.isConnected = True
+            elif timed_out:
+                del self.futures[part_name]
+                self.failed.append(part_name)
+                # If the driver opens later it is parked, so the next connection can reuse it
+                future.add_done_callback(park_late_rcb)
+
+        self.update_progress(context)
+        if self.futures:
+            return {'RUNNING_MODAL'}
 
-        setattr(parts[scene.list_index], "isConnected", True)
+        context.window_manager.event_timer_remove(self._timer)
+        context.window_manager.progress_end()
+        WM_OT_ConnectAll.progress = ""
+        elapsed = time.monotonic() - self.start
+        if self.failed:
+            printError(self, "Cannot open the driver of:", ", ".join(self.failed))
+        else:
+            self.report({'INFO'}, f"{self.n_parts} parts connected in {elapsed:.2f} s")
+        return {'FINISHED'}
 
-        # TODO check if we need this
-        #bpy.app.handlers.frame_change_post.clear()
-        #bpy.app.handlers.frame_change_post.append(move)
 
+class WM_OT_ReplayCommandLog(bpy.types.Operator, ImportHelper):
+    bl_label = "Replay log"
+    bl_idname = "wm.replay_command_log"
+    bl_description = "replay a command log recorded in dry run to the connected parts"
+
+    filter_glob: StringProperty(
+        default='*.rcblog',
+        options={'HIDDEN'}
+    )
+
+    _timer = None
+    # The replay running, move() does not stream to the boards meanwhile
+    _thread = None
+    _stop_event = None
+
+    @staticmethod
+    def is_running():
+        return WM_OT_ReplayCommandLog._thread is not None and WM_OT_ReplayCommandLog._thread.is_alive()
+
+    @staticmethod
+    def stop():
+        # Stops the replay and waits for it, so that the boards can be closed
+        if WM_OT_ReplayCommandLog.is_running():
+            WM_OT_ReplayCommandLog._stop_event.set()
+            WM_OT_ReplayCommandLog._thread.join()
+
+    def execute(self, context):
+        boards = {name: rcb_instance.board for name, rcb_instance in bpy.types.Scene.rcb_wrapper.items()}
+        if not boards:
+            printError(self, "No part is connected!")
+            return {'CANCELLED'}
+        if WM_OT_ReplayCommandLog.is_running():
+            printError(self, "A command log is already being replayed")
+            return {'CANCELLED'}
+        if robot_mirror.is_running():
+            printError(self, "Stop mirroring before replaying a command log")
+            return {'CANCELLED'}
+        if context.screen is not None and context.screen.is_animation_playing:
+            bpy.ops.screen.animation_cancel(restore_frame=False)
+        # The sinks of the broadcaster and the coalescing timer must not command the boards meanwhile
+        close_broadcaster()
+        command_coalescing.clear()
+
+        self.stop_event = threading.Event()
+        self.result = []
+        speed = context.scene.my_tool.my_replay_speed
+
+        def run():
+            # Any failure is reported by modal(), the thread must not die without a result
+            try:
+                self.result.append(command_log.replay(self.filepath, boards, speed, self.stop_event))
+            except Exception as e:
+                self.result.append(e)
+
+        self.thread = threading.Thread(target=run, name="rcb_replay", daemon=True)
+        WM_OT_ReplayCommandLog._thread = self.thread
+        WM_OT_ReplayCommandLog._stop_event = self.stop_event
+        self.thread.start()
+        self._timer = context.window_manager.event_timer_add(0.1, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        self.report({'INFO'}, "Replaying the command log, press ESC to stop")
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.stop_event.set()
+        if event.type != 'TIMER' or self.thread.is_alive():
+            return {'PASS_THROUGH'}
+
+        context.window_manager.event_timer_remove(self._timer)
+        if not self.result:
+            printError(self, "The replay of the command log stopped unexpectedly")
+            return {'CANCELLED'}
+        if isinstance(self.result[0], Exception):
+            printError(self, "Cannot replay the command log:", str(self.result[0]))
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"{self.result[0]} commands replayed")
+        return {'FINISHED'}
+
+
+class WM_OT_MirrorRobot(bpy.types.Operator):
+    bl_label = "Mirror robot"
+    bl_idname = "wm.mirror_robot"
+    bl_description = "start or stop moving the rig with the encoders of all the connected parts, the commands are not streamed while mirroring"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        if robot_mirror.is_running():
+            reader = robot_mirror.stop()
+            elapsed = time.monotonic() - reader.start_time
+            message = (f"Mirroring stopped, {reader.reads} reads ({reader.failed_reads} failed) "
+                       f"and {robot_mirror.MirrorState.updates} pose updates in {elapsed:.1f} s")
+            armature_object = bpy.data.objects.get(mytool.my_armature)
+            if reader.record and armature_object is not None:
+                fps = scene.render.fps / scene.render.fps_base
+                n_keys = 0
+                for log in reader.recorded_logs():
+                    n_keys += log_import.import_log(armature_object, log, scene.frame_current, fps)[2]
+                    scene.frame_end = max(scene.frame_end, int(np.ceil(scene.frame_current + log.times[-1] * fps)))
+                message += f", {n_keys} keys recorded"
+            self.report({'INFO'}, message)
+            return {'FINISHED'}
+
+        rcb_wrappers = bpy.types.Scene.rcb_wrapper
+        if not rcb_wrappers:
+            printError(self, "No part is connected!")
+            return {'CANCELLED'}
+        if bpy.data.objects.get(mytool.my_armature) is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+        if context.screen is not None and context.screen.is_animation_playing:
+            bpy.ops.screen.animation_cancel(restore_frame=False)
+        # The sinks of the broadcaster may still be approaching their targets
+        close_broadcaster()
+        robot_mirror.start(mytool.my_armature, rcb_wrappers, mytool.my_mirror_rate, mytool.my_mirror_display_rate,
+                           mytool.my_mirror_record)
+        self.report({'INFO'}, f"Mirroring {len(rcb_wrappers)} parts")
+        return {'FINISHED'}
+
+
+class WM_OT_ImportEncoderLog(bpy.types.Operator, ImportHelper):
+    bl_label = "Import encoder log"
+    bl_idname = "wm.import_encoder_log"
+    bl_description = "key the joints of the armature from a yarpdatadumper, yarp read or CSV log of the encoders (degrees), starting at the current frame"
+
+    filter_glob: StringProperty(
+        default='*.log;*.txt;*.csv',
+        options={'HIDDEN'}
+    )
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        if armature_object is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+
+        axis_names = [name.strip() for name in mytool.my_log_axis_names.split(",") if name.strip()]
+        if not axis_names and not self.filepath.lower().endswith(".csv") and len(scene.my_list):
+            rcb_instance = bpy.types.Scene.rcb_wrapper.get(getattr(scene.my_list[scene.list_index], "value"))
+            if rcb_instance is not None:
+                axis_names = list(rcb_instance.axis_names)
+
+        t_start = time.perf_counter()
+        try:
+            log = log_import.read_log(self.filepath, axis_names, mytool.my_log_header_columns)
+        except (OSError, ValueError) as e:
+            printError(self, "Cannot read the log:", str(e))
+            return {'CANCELLED'}
+        if not log.axis_names:
+            printError(self, "The log has no axis names, set them or connect the logged part")
+            return {'CANCELLED'}
+
+        fps = scene.render.fps / scene.render.fps_base
+        imported, skipped, n_keys = log_import.import_log(armature_object, log, scene.frame_current, fps,
+                                                         mytool.my_log_resample, mytool.my_log_tolerance)
+        if not imported:
+            printError(self, "No axis of the log is a bone of", armature_object.name)
+            return {'CANCELLED'}
+        scene.frame_end = max(scene.frame_end, int(np.ceil(scene.frame_current + log.times[-1] * fps)))
+        elapsed = time.perf_counter() - t_start
+
+        message = (f"{len(log.times)} samples of {len(imported)} joints imported as {n_keys} keys "
+                   f"in {elapsed:.2f} s")
+        if skipped:
+            print("Axes without a bone:", ", ".join(skipped))
+            self.report({'WARNING'}, message + f", {len(skipped)} axes without a bone skipped")
+        else:
+            self.report({'INFO'}, message)
+        return {'FINISHED'}
+
+
+class WM_OT_ResetStreamingStats(bpy.types.Operator):
+    bl_label = "Reset statistics"
+    bl_idname = "wm.reset_streaming_stats"
+    bl_description = "reset the latency and jitter statistics of all the parts"
+
+    def execute(self, context):
+        sstats.reset_all()
+        return {'FINISHED'}
+
+
+class WM_OT_ExportStreamingStats(bpy.types.Operator, ExportHelper):
+    bl_label = "Export statistics"
+    bl_idname = "wm.export_streaming_stats"
+    bl_description = "export the latency and jitter statistics of all the parts (.json format)"
+
+    filename_ext = ".json"
+
+    filter_glob: StringProperty(
+        default='*.json',
+        options={'HIDDEN'}
+    )
+
+    transport: StringProperty(
+        name="Transport",
+        description="Label of the transport used (e.g. tcp, fast_tcp, shmem), saved for comparisons",
+        default="tcp"
+    )
+
+    def execute(self, context):
+        try:
+            sstats.export_json(self.filepath, self.transport)
+        except OSError as e:
+            printError(self, "Cannot export the statistics:", str(e))
+            return {'CANCELLED'}
         return {'FINISHED'}
 
 
+def unregister_joint_properties():
+    if WM_OT_Configure.joint_properties is None:
+        return
+    del bpy.types.Scene.my_joints
+    bpy.utils.unregister_class(WM_OT_Configure.joint_properties)
+    WM_OT_Configure.joint_properties = None
+    WM_OT_Configure.joint_properties_signature = None
+
+
 class WM_OT_Configure(bpy.types.Operator):
     bl_label = "Configure"
     bl_idname = "wm.configure"
     bl_description= "configure the parts by uploading a configuration file (.json format)"
 
+    # Class of the joint sliders currently registered
+    joint_properties = None
+    joint_properties_signature = None
+
     def execute(self, context):
         scene = bpy.context.scene
         mytool = scene.my_tool
@@ -462,12 +1261,25 @@ class WM_OT_Configure(bpy.types.Operator):
 
         try:
             # init the callback
-            bpy.app.handlers.frame_change_post.append(move)
+            if move not in bpy.app.handlers.frame_change_post:
+                bpy.app.handlers.frame_change_post.append(move)
         except:
             printError(self, "A problem when initialising the callback")
 
+        if bpy.data.objects.get(mytool.my_armature) is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+
+        # The table is rebuilt, the armature may have been changed since the last configuration
+        jt.invalidate()
         robot = AllJoints()
 
+        # The class of the sliders is registered again only if the joints changed
+        if WM_OT_Configure.joint_properties is not None:
+            if WM_OT_Configure.joint_properties_signature == robot.signature:
+                return {'FINISHED'}
+            unregister_joint_properties()
+
         # Dynamically create the same class
         JointProperties = type(
             # Class name
@@ -481,10 +1293,60 @@ class WM_OT_Configure(bpy.types.Operator):
         # OBJECT_PT_robot_controller.set_joint_names(my_list)
         bpy.utils.register_class(JointProperties)
         bpy.types.Scene.my_joints = PointerProperty(type=JointProperties)
+        WM_OT_Configure.joint_properties = JointProperties
+        WM_OT_Configure.joint_properties_signature = robot.signature
 
         return {'FINISHED'}
 
 
+class WM_OT_KeyFullPose(bpy.types.Operator):
+    bl_label = "Key full pose"
+    bl_idname = "wm.key_full_pose"
+    bl_description = "insert a keyframe for all the joints at the current frame"
+
+    def execute(self, context):
+        scene = context.scene
+        armature_object = bpy.data.objects.get(scene.my_tool.my_armature)
+        if armature_object is None:
+            printError(self, "Armature", scene.my_tool.my_armature, "not found")
+            return {'CANCELLED'}
+        # The current pose is keyed as it is, it may have been set by the inverse kinematics
+        # without updating the sliders
+        table = get_armature_joint_table(scene.my_tool.my_armature)
+        pose_bones = armature_object.pose.bones
+        for joint_name in table.controllable_names():
+            if not table.is_prismatic(joint_name):
+                fcu.insert_key(fcu.joint_fcurve(armature_object, joint_name), scene.frame_current,
+                               pose_bones[joint_name].rotation_euler[fcu.JOINT_INDEX])
+        return {'FINISHED'}
+
+
+class WM_OT_ThinKeyframes(bpy.types.Operator):
+    bl_label = "Thin keyframes"
+    bl_idname = "wm.thin_keyframes"
+    bl_description = "remove the keyframes of all the joints that can be interpolated within the tolerance, the curves become linear"
+
+    def execute(self, context):
+        mytool = context.scene.my_tool
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        if armature_object is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+        table = get_armature_joint_table(mytool.my_armature)
+        results = keyframe_thinning.thin_joints(armature_object, table.controllable_names(),
+                                                math.radians(mytool.my_thinning_tolerance))
+        if not results:
+            self.report({'INFO'}, "No joint is animated")
+            return {'FINISHED'}
+        before = sum(r[0] for r in results.values())
+        after = sum(r[1] for r in results.values())
+        deviation = math.degrees(max(r[2] for r in results.values()))
+        self.report({'INFO'}, f"{before} keyframes of {len(results)} joints reduced to {after} "
+                              f"({100.0 * (1.0 - after / max(before, 1)):.1f}% less), "
+                              f"maximum deviation {deviation:.4f} degrees")
+        return {'FINISHED'}
+
+
 class WM_OT_ReachTarget(bpy.types.Operator):
     bl_label = "Reach Target"
     bl_idname = "wm.reach_target"
@@ -495,6 +1357,474 @@ class WM_OT_ReachTarget(bpy.types.Operator):
         return InverseKinematics.execute(self)
 
 
+def spline_path(spline):
+    # Points of a spline in the local space of the curve, in the order of the path
+    if spline.type == 'BEZIER':
+        points = spline.bezier_points
+        n = len(points)
+        n_segments = n if spline.use_cyclic_u else n - 1
+        path = [points[0].co.copy()] if n else []
+        for i in range(n_segments):
+            a, b = points[i], points[(i + 1) % n]
+            segment = mathutils.geometry.interpolate_bezier(a.co, a.handle_right, b.handle_left, b.co,
+                                                             spline.resolution_u + 1)
+            path.extend(segment[1:])
+        return [tuple(co) for co in path]
+    # Poly and NURBS splines follow their control points
+    path = [tuple(point.co[:3]) for point in spline.points]
+    if spline.use_cyclic_u and path:
+        path.append(path[0])
+    return path
+
+
+def sample_target_poses(context, armature_object, target_object, frames):
+    """Positions (N, 3) and rotations (N, 3, 3) of the target in the armature frame, one for
+    each frame. The rotations are None along a curve, positions None if the curve is empty."""
+    if target_object.type == 'CURVE':
+        # The splines are followed one after the other, the frames are spread on them
+        # proportionally to their length
+        evaluated = target_object.evaluated_get(context.evaluated_depsgraph_get())
+        matrix = np.array(armature_object.matrix_world.inverted() @ target_object.matrix_world)
+        points, arcs = [], []
+        length = 0.0
+        for spline in evaluated.data.splines:
+            path = np.array(spline_path(spline), dtype=np.float64).reshape(-1, 3)
+            if len(path) < 2:
+                continue
+            path = path @ matrix[:3, :3].T + matrix[:3, 3]
+            arc = length + np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(path, axis=0), axis=1))))
+            points.append(path)
+            arcs.append(arc)
+            length = arc[-1]
+        if not points:
+            return None, None
+        points = np.concatenate(points)
+        arc = np.concatenate(arcs)
+        s = np.linspace(0.0, arc[-1], len(frames))
+        return np.stack([np.interp(s, arc, points[:, axis]) for axis in range(3)], axis=1), None
+
+    # Animated object, the scene is evaluated frame by frame without streaming to the robot
+    scene = context.scene
+    frame_current = scene.frame_current
+    streaming = move in bpy.app.handlers.frame_change_post
+    if streaming:
+        bpy.app.handlers.frame_change_post.remove(move)
+    positions = np.empty((len(frames), 3), dtype=np.float64)
+    rotations = np.empty((len(frames), 3, 3), dtype=np.float64)
+    try:
+        for i, frame in enumerate(frames):
+            scene.frame_set(int(frame))
+            matrix = armature_object.matrix_world.inverted() @ target_object.matrix_world
+            positions[i] = matrix.to_translation()
+            rotations[i] = matrix.to_3x3().normalized()
+    finally:
+        scene.frame_set(frame_current)
+        if streaming:
+            bpy.app.handlers.frame_change_post.append(move)
+    return positions, rotations
+
+
+def rpy_from_rotations(R):
+    # Roll, pitch and yaw (N, 3) of the rotations (N, 3, 3), R = Rz(yaw) Ry(pitch) Rx(roll) as in iDynTree
+    roll = np.arctan2(R[:, 2, 1], R[:, 2, 2])
+    pitch = np.arctan2(-R[:, 2, 0], np.hypot(R[:, 2, 1], R[:, 2, 2]))
+    yaw = np.arctan2(R[:, 1, 0], R[:, 0, 0])
+    return np.stack((roll, pitch, yaw), axis=1)
+
+
+class WM_OT_BatchReachTarget(bpy.types.Operator):
+    bl_label = "Reach target over the frame range"
+    bl_idname = "wm.batch_reach_target"
+
+    bl_description = "Solve the inverse kinematics for the target object in every frame of the scene range and key the joints"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        base_frame = mytool.my_baseframeenum
+        endeffector_frame = mytool.my_eeframeenum
+        if base_frame == endeffector_frame:
+            printError(self, "Base frame and end-effector frame are coincident!")
+            return {'CANCELLED'}
+        target_object = mytool.my_ik_target_object
+        if target_object is None:
+            printError(self, "Select the target object")
+            return {'CANCELLED'}
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        if armature_object is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+
+        # The cached solver gives the joints of the chain
+        solver = get_ik_solver(self, base_frame, endeffector_frame, mytool.my_ik_solver)
+        if solver is None:
+            return {'CANCELLED'}
+
+        frames = np.arange(scene.frame_start, scene.frame_end + 1, dtype=np.float64)
+        positions, rotations = sample_target_poses(context, armature_object, target_object, frames)
+        if positions is None:
+            printError(self, "The curve", target_object.name, "has no points")
+            return {'CANCELLED'}
+        # Same convention of the drag & drop, the x axis is mirrored
+        positions[:, 0] = -positions[:, 0]
+        if rotations is not None and mytool.my_ik_target_rotation:
+            # The mirrored rotation is S R S with S = diag(-1, 1, 1)
+            mirror = np.diag([-1.0, 1.0, 1.0])
+            rpys = rpy_from_rotations(mirror @ rotations @ mirror)
+        else:
+            rpy = np.radians([mytool.my_reach_roll, mytool.my_reach_pitch, mytool.my_reach_yaw])
+            rpys = np.tile(rpy, (len(frames), 1))
+
+        initial_pose = dict(zip(solver.joint_names, current_joint_positions(mytool.my_armature, solver.joint_names)))
+        t_start = time.perf_counter()
+        joint_names, solutions = solve_batch(scene['model_urdf'], base_frame, endeffector_frame,
+                                             solver.considered_joints, mytool.my_ik_solver,
+                                             armature_joint_limits(mytool.my_armature),
+                                             positions, rpys, initial_pose, mytool.my_batch_workers)
+        elapsed = time.perf_counter() - t_start
+
+        solved = np.array([solution is not None for solution in solutions], dtype=bool)
+        if not solved.any():
+            printError(self, "Impossible to solve inverse kinematics problem.")
+            return {'CANCELLED'}
+        values = np.array([solution for solution in solutions if solution is not None], dtype=np.float64)
+        table = get_armature_joint_table(mytool.my_armature)
+        for column, joint_name in enumerate(joint_names):
+            if joint_name not in table.index:
+                continue
+            fcu.merge_keys(fcu.joint_fcurve(armature_object, joint_name), frames[solved], values[:, column])
+        # The pose follows the new keys
+        scene.frame_set(scene.frame_current)
+
+        failed = len(frames) - int(solved.sum())
+        message = f"Solved {int(solved.sum())} frames in {elapsed:.2f} s"
+        if failed:
+            message += f", {failed} frames not reachable and not keyed"
+        self.report({'WARNING'} if failed else {'INFO'}, message)
+        return {'FINISHED'}
+
+
+class WM_OT_ValidateLimits(bpy.types.Operator):
+    bl_label = "Validate limits"
+    bl_idname = "wm.validate_limits"
+
+    bl_description = "Check the position limits and the velocity and acceleration caps of the joints over the frame range, marking the violations on the timeline"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        table = get_armature_joint_table(mytool.my_armature)
+        if armature_object is None or table is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+
+        joint_names = table.controllable_names()
+        columns = {name: column for column, name in enumerate(joint_names)}
+        limits = np.degrees([table.limits[table.index[name]] for name in joint_names]).reshape(-1, 2)
+        # The limits of the connected parts, read from the control boards, take precedence
+        for rcb_instance in bpy.types.Scene.rcb_wrapper.values():
+            for axis, axis_name in enumerate(rcb_instance.axis_names):
+                if axis_name in columns:
+                    limits[columns[axis_name]] = sorted(rcb_instance.joint_limits[axis])
+
+        fps = scene.render.fps / scene.render.fps_base
+        frames, values = limit_validator.sample_action(armature_object, joint_names, scene.frame_start,
+                                                       scene.frame_end, fps, mytool.my_validation_rate)
+        violations = limit_validator.validate(values, 1.0 / mytool.my_validation_rate, limits[:, 0], limits[:, 1],
+                                              mytool.my_max_velocity, mytool.my_max_acceleration)
+
+        limit_validator.clear_markers(scene)
+        if not violations:
+            self.report({'INFO'}, f"No limit violations in {len(joint_names)} joints")
+            return {'FINISHED'}
+        limit_validator.add_markers(scene, joint_names, violations, frames)
+        for column, joint_violations in sorted(violations.items()):
+            for kind, first, last, worst in joint_violations:
+                print(f"Joint {joint_names[column]}: {kind} limit violated from frame {frames[first]:.1f} "
+                      f"to {frames[min(last + 1, len(frames) - 1)]:.1f}, worst value {worst:.2f}")
+        self.report({'WARNING'}, f"{len(violations)} joints violate their limits, see the markers and the console")
+        return {'FINISHED'}
+
+
+class WM_OT_Retime(bpy.types.Operator):
+    bl_label = "Retime"
+    bl_idname = "wm.retime"
+
+    bl_description = "Slow down the animation where the joints exceed the maximum velocity and acceleration"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        table = get_armature_joint_table(mytool.my_armature)
+        if armature_object is None or table is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+        action = fcu.get_action(armature_object, create=False)
+        if action is None:
+            printError(self, "The armature is not animated")
+            return {'CANCELLED'}
+        if mytool.my_max_velocity <= 0 and mytool.my_max_acceleration <= 0:
+            printError(self, "Set the maximum velocity or acceleration")
+            return {'CANCELLED'}
+
+        t_start = time.perf_counter()
+        fps = scene.render.fps / scene.render.fps_base
+        joint_names = table.controllable_names()
+        time_map = retiming.compute_time_map(armature_object, joint_names, scene.frame_start, scene.frame_end, fps,
+                                             mytool.my_max_velocity, mytool.my_max_acceleration)
+        # All the F-curves of the action move together, the joints are baked if requested
+        baked = set()
+        if mytool.my_retime_mode == 'BAKE':
+            retiming.bake_joints(armature_object, joint_names, time_map)
+            baked = {fcu.joint_data_path(name) for name in joint_names}
+        for fcurve in action.fcurves:
+            if not (fcurve.data_path in baked and fcurve.array_index == fcu.JOINT_INDEX):
+                retiming.remap_keys(fcurve, time_map)
+
+        old_end = scene.frame_end
+        scene.frame_end = int(round(time_map.new_frames[-1]))
+        scene.frame_set(scene.frame_current)
+        # The interpolation between the moved keys is not retimed, the caps are checked again
+        velocity, acceleration = retiming.peak_rates(armature_object, joint_names, scene.frame_start,
+                                                     scene.frame_end, fps)
+        message = (f"Frame range end moved from {old_end} to {scene.frame_end}, peak velocity {velocity:.1f} deg/s, "
+                   f"peak acceleration {acceleration:.1f} deg/s^2 ({time.perf_counter() - t_start:.2f} s)")
+        # 1% of tolerance for the finite differences
+        if ((mytool.my_max_velocity > 0 and velocity > 1.01 * mytool.my_max_velocity)
+                or (mytool.my_max_acceleration > 0 and acceleration > 1.01 * mytool.my_max_acceleration)):
+            self.report({'WARNING'}, message + ": the caps are still exceeded between the keys, use Bake")
+        else:
+            self.report({'INFO'}, message)
+        return {'FINISHED'}
+
+
+class WM_OT_CheckDynamics(bpy.types.Operator):
+    bl_label = "Check dynamics"
+    bl_idname = "wm.check_dynamics"
+
+    bl_description = "Compute the joint torques and the center of mass in every frame of the scene range, marking on the timeline the frames over the thresholds"
+
+    def execute(self, context):
+        global dynamics_result
+        scene = context.scene
+        mytool = scene.my_tool
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        if armature_object is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+        if ikv.iDynTreeModel is None:
+            printError(self, "The urdf model is not loaded")
+            return {'CANCELLED'}
+        support_frames = [name.strip() for name in mytool.my_support_frames.split(",") if name.strip()]
+        for name in support_frames:
+            if ikv.iDynTreeModel.getFrameIndex(name) < 0:
+                printError(self, "Frame", name, "not found in the model")
+                return {'CANCELLED'}
+
+        t_start = time.perf_counter()
+        fps = scene.render.fps / scene.render.fps_base
+        frames = np.arange(scene.frame_start, scene.frame_end + 1, dtype=np.float64)
+        joint_names = dynamics_check.model_joint_names(ikv.iDynTreeModel)
+        q = fcu.evaluate_joints(armature_object, joint_names, frames)
+        torques, com, margin = dynamics_check.analyze(scene['model_urdf'], q, 1.0 / fps, support_frames,
+                                                      (mytool.my_support_half_length, mytool.my_support_half_width),
+                                                      mytool.my_batch_workers)
+        dynamics_result = dynamics_check.DynamicsResult(frames, joint_names, torques, com, margin,
+                                                        mytool.my_max_torque, mytool.my_min_com_margin)
+        elapsed = time.perf_counter() - t_start
+
+        # The markers of the previous check are replaced
+        for marker in [marker for marker in scene.timeline_markers if marker.name.startswith("dynamics: ")]:
+            scene.timeline_markers.remove(marker)
+        flagged = 0
+        for column in np.flatnonzero(dynamics_result.torque_flags.any(axis=0)):
+            flagged += 1
+            for first, last in limit_validator.runs(dynamics_result.torque_flags[:, column]):
+                scene.timeline_markers.new(f"dynamics: {joint_names[column]} torque", frame=int(frames[first]))
+                print(f"Joint {joint_names[column]}: torque over {mytool.my_max_torque} Nm from frame "
+                      f"{int(frames[first])} to {int(frames[last])}, "
+                      f"peak {np.abs(torques[first:last + 1, column]).max():.2f} Nm")
+        for first, last in limit_validator.runs(dynamics_result.margin_flags):
+            flagged += 1
+            scene.timeline_markers.new("dynamics: COM", frame=int(frames[first]))
+            print(f"Center of mass margin under {mytool.my_min_com_margin} m from frame {int(frames[first])} "
+                  f"to {int(frames[last])}, minimum {margin[first:last + 1].min():.3f} m")
+
+        message = f"Dynamics of {len(frames)} frames computed in {elapsed:.2f} s"
+        if flagged:
+            self.report({'WARNING'}, message + ", thresholds exceeded, see the markers and the console")
+        else:
+            self.report({'INFO'}, message)
+        return {'FINISHED'}
+
+
+class WM_OT_ExportDynamics(bpy.types.Operator, ExportHelper):
+    bl_label = "Export dynamics"
+    bl_idname = "wm.export_dynamics"
+    bl_description = "export the torques and center of mass time series of the last dynamics check (.npz format)"
+
+    filename_ext = ".npz"
+
+    filter_glob: StringProperty(
+        default='*.npz',
+        options={'HIDDEN'}
+    )
+
+    def execute(self, context):
+        if dynamics_result is None:
+            printError(self, "Run the dynamics check first")
+            return {'CANCELLED'}
+        try:
+            dynamics_result.save(self.filepath)
+        except OSError as e:
+            printError(self, "Cannot export the dynamics:", str(e))
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+
+class WM_OT_CheckSelfCollisions(bpy.types.Operator):
+    bl_label = "Check self-collisions"
+    bl_idname = "wm.check_self_collisions"
+
+    bl_description = "Check the collisions between the link meshes in every frame of the scene range"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        armature_object = bpy.data.objects.get(mytool.my_armature)
+        if armature_object is None:
+            printError(self, "Armature", mytool.my_armature, "not found")
+            return {'CANCELLED'}
+        if ikv.iDynTreeModel is None:
+            printError(self, "The urdf model is not loaded")
+            return {'CANCELLED'}
+
+        t_start = time.perf_counter()
+        fk = BatchedForwardKinematics(ikv.iDynTreeModel)
+        bodies = link_bodies(armature_object, fk, mytool.my_collision_convex)
+        # The pairs touching in the rest configuration are not reported
+        checker = SelfCollisionChecker(fk, bodies, np.zeros(fk.dofs))
+        frames = np.arange(scene.frame_start, scene.frame_end + 1)
+        collisions = checker.check_frames(armature_object, frames)
+        elapsed = time.perf_counter() - t_start
+
+        if not collisions:
+            self.report({'INFO'}, f"No self-collisions in {len(frames)} frames ({len(bodies)} meshes, {elapsed:.2f} s)")
+            return {'FINISHED'}
+        for (mesh_a, mesh_b), ranges in sorted(collisions.items()):
+            text = ", ".join(f"{first}-{last}" if first != last else f"{first}" for first, last in ranges)
+            print(f"Self-collision {mesh_a} - {mesh_b}: frames {text}")
+        self.report({'WARNING'}, f"{len(collisions)} colliding pairs in {len(frames)} frames ({elapsed:.2f} s), "
+                                 "see the console for the frames")
+        return {'FINISHED'}
+
+
+class WM_OT_BuildReachabilityMap(bpy.types.Operator):
+    bl_label = "Build reachability map"
+    bl_idname = "wm.build_reachability_map"
+
+    bl_description = "Sample the poses reachable by the end-effector, used to reject the targets out of reach and to seed the inverse kinematics"
+
+    def execute(self, context):
+        mytool = context.scene.my_tool
+        base_frame = mytool.my_baseframeenum
+        endeffector_frame = mytool.my_eeframeenum
+        if base_frame == endeffector_frame:
+            printError(self, "Base frame and end-effector frame are coincident!")
+            return {'CANCELLED'}
+        # The cached solver gives the joints of the chain
+        solver = get_ik_solver(self, base_frame, endeffector_frame)
+        if solver is None:
+            return {'CANCELLED'}
+
+        t_start = time.perf_counter()
+        reach_map, filepath = reachability.build_reachability_map(ikv.inverseKinematics.fullModel(), base_frame,
+                                                                 endeffector_frame, solver.considered_joints,
+                                                                 armature_joint_limits(mytool.my_armature),
+                                                                 mytool.my_reach_samples)
+        message = f"Sampled {len(reach_map.positions)} poses in {time.perf_counter() - t_start:.2f} s"
+        if filepath is None:
+            self.report({'WARNING'}, message + ", save the .blend file for keeping the map")
+        else:
+            self.report({'INFO'}, message + ", saved in " + filepath)
+        return {'FINISHED'}
+
+
+class WM_OT_AddIkTarget(bpy.types.Operator):
+    bl_label = "Add target"
+    bl_idname = "wm.add_ik_target"
+    bl_description = "Add a target to the ones reached together"
+
+    def execute(self, context):
+        scene = context.scene
+        scene.my_ik_targets.add()
+        scene.my_ik_target_index = len(scene.my_ik_targets) - 1
+        return {'FINISHED'}
+
+
+class WM_OT_RemoveIkTarget(bpy.types.Operator):
+    bl_label = "Remove target"
+    bl_idname = "wm.remove_ik_target"
+    bl_description = "Remove the selected target"
+
+    def execute(self, context):
+        scene = context.scene
+        if 0 <= scene.my_ik_target_index < len(scene.my_ik_targets):
+            scene.my_ik_targets.remove(scene.my_ik_target_index)
+            scene.my_ik_target_index = max(0, scene.my_ik_target_index - 1)
+        return {'FINISHED'}
+
+
+class WM_OT_ReachAllTargets(bpy.types.Operator):
+    bl_label = "Reach all targets"
+    bl_idname = "wm.reach_all_targets"
+
+    bl_description = "Reach all the targets of the list in a single inverse kinematics problem"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        base_frame = mytool.my_baseframeenum
+        targets = scene.my_ik_targets
+        if len(targets) == 0:
+            printError(self, "Add at least one target")
+            return {'CANCELLED'}
+        frames = [target.frame for target in targets]
+        if base_frame in frames:
+            printError(self, "Base frame and target frame are coincident!")
+            return {'CANCELLED'}
+        if len(set(frames)) != len(frames):
+            printError(self, "Each frame can have only one target")
+            return {'CANCELLED'}
+
+        solver = get_multi_target_ik_solver(self, base_frame, {target.frame: target.mode for target in targets})
+        if solver is None:
+            return {'CANCELLED'}
+
+        # The first solve starts from the current pose of the armature
+        initial = None
+        if solver.last_solution is None:
+            initial = current_joint_positions(mytool.my_armature, solver.joint_names)
+
+        # Same transforms of the single target, expressed in the base frame
+        desired = [(iDynTree.Transform(iDynTree.Rotation.RPY(math.radians(target.roll),
+                                                             math.radians(target.pitch),
+                                                             math.radians(target.yaw)),
+                                       iDynTree.Position(target.x, target.y, target.z)),
+                    target.position_weight, target.rotation_weight)
+                   for target in targets]
+
+        joint_positions = solver.solve_targets(desired, initial)
+        if joint_positions is None:
+            printError(self, "Impossible to solve inverse kinematics problem.")
+            return {'CANCELLED'}
+
+        apply_joint_positions(mytool.my_armature, solver.joint_names, joint_positions)
+        return {'FINISHED'}
+
+
 class WM_OT_initiate_drag_drop(bpy.types.Operator):
     """Process input while Control key is pressed"""
     bl_idname = 'wm.initiate_drag_drop'
@@ -515,6 +1845,10 @@ class ModalOperator(bpy.types.Operator):
         self.mouse_pos = [0.0, 0.0]
         self.object = None
         self.loc_3d = [0.0, 0.0, 0.0]
+        self.worker = None
+        self.reach_map = None
+        # The mouse was released, the keys are inserted when the worker is idle
+        self.releasing = False
 
     def __del__(self):
         print("End operator")
@@ -523,19 +1857,25 @@ class ModalOperator(bpy.types.Operator):
         print("location: ", self.loc_3d[0], self.loc_3d[1], self.loc_3d[2])
         return {'FINISHED'}
 
+    def mouse_to_3d(self, event):
+        self.loc_3d = [event.mouse_region_x, event.mouse_region_y]
+
+        self.object = bpy.context.object
+        region = bpy.context.region
+        region3D = bpy.context.space_data.region_3d
+        #The direction indicated by the mouse position from the current view
+        view_vector = view3d_utils.region_2d_to_vector_3d(region, region3D, self.loc_3d)
+        #The 3D location in this direction
+        self.loc_3d = view3d_utils.region_2d_to_location_3d(region, region3D, self.loc_3d, view_vector)
+        #The 3D location converted in object local coordinates
+        # self.loc_3d = self.object.matrix_world.inverted() * mouse_loc
+
     def modal(self, context, event):
+        if self.worker is not None:
+            return self.modal_live(context, event)
+
         if event.type == 'LEFTMOUSE':  # Apply
-            self.loc_3d = [event.mouse_region_x, event.mouse_region_y]
-
-            self.object = bpy.context.object
-            region = bpy.context.region
-            region3D = bpy.context.space_data.region_3d
-            #The direction indicated by the mouse position from the current view
-            view_vector = view3d_utils.region_2d_to_vector_3d(region, region3D, self.loc_3d)
-            #The 3D location in this direction
-            self.loc_3d = view3d_utils.region_2d_to_location_3d(region, region3D, self.loc_3d, view_vector)
-            #The 3D location converted in object local coordinates
-            # self.loc_3d = self.object.matrix_world.inverted() * mouse_loc
+            self.mouse_to_3d(event)
 
             InverseKinematics.execute(self, self.loc_3d)
 
@@ -547,6 +1887,49 @@ class ModalOperator(bpy.types.Operator):
 
         return {'RUNNING_MODAL'}
 
+    def modal_live(self, context, event):
+        # The mouse moves are coalesced by the worker, which solves only the latest target.
+        # The solutions are applied by the timer, the keyframes are inserted on release.
+        mytool = context.scene.my_tool
+        if event.type == 'LEFTMOUSE' and event.value == 'PRESS':
+            self.dragging = True
+            self.releasing = False
+        if event.type in {'LEFTMOUSE', 'MOUSEMOVE'} and self.dragging:
+            self.mouse_to_3d(event)
+            target = target_transform(mytool, self.loc_3d)
+            # The targets out of reach are not even submitted
+            if self.reach_map is None or self.reach_map.is_reachable(target.getPosition().toNumPy()):
+                self.worker.submit(target)
+
+        if event.type == 'TIMER':
+            joint_positions = self.worker.take_result()
+            if joint_positions is not None:
+                apply_joint_positions(mytool.my_armature, self.worker.solver.joint_names, joint_positions,
+                                      insert_key=False)
+            # The UI is not blocked waiting for the last solve, it is checked at every tick
+            if self.releasing and self.worker.wait_idle(timeout=0.0):
+                self.releasing = False
+                joint_positions = self.worker.solver.last_solution
+                if joint_positions is not None:
+                    apply_joint_positions(mytool.my_armature, self.worker.solver.joint_names, joint_positions)
+                self.execute(context)
+
+        elif event.type == 'LEFTMOUSE' and event.value == 'RELEASE' and self.dragging:
+            self.dragging = False
+            self.releasing = True
+
+        elif event.type in {'RIGHTMOUSE', 'ESC'}:  # Cancel
+            print("Quit pressed")
+            self.stop_live(context)
+            return {'CANCELLED'}
+
+        return {'RUNNING_MODAL'}
+
+    def stop_live(self, context):
+        self.worker.stop()
+        self.worker = None
+        context.window_manager.event_timer_remove(self._timer)
+
     def invoke(self, context, event):
         if context.area.type == 'VIEW_3D':
             print("Drag and Drop operator invoked")
@@ -559,6 +1942,26 @@ class ModalOperator(bpy.types.Operator):
 
             self.object = context.object
 
+            self.worker = None
+            mytool = context.scene.my_tool
+            if mytool.my_live_drag:
+                if mytool.my_baseframeenum == mytool.my_eeframeenum:
+                    printError(self, "Base frame and end-effector frame are coincident!")
+                    return {'CANCELLED'}
+                solver = get_ik_solver(self, mytool.my_baseframeenum, mytool.my_eeframeenum, mytool.my_ik_solver)
+                if solver is None:
+                    return {'CANCELLED'}
+                if solver.last_solution is None:
+                    solver.last_solution = current_joint_positions(mytool.my_armature, solver.joint_names)
+                self.worker = IkWorker(solver)
+                self.reach_map = reachability.get_reachability_map(mytool.my_baseframeenum, mytool.my_eeframeenum,
+                                                                   solver.considered_joints,
+                                                                   armature_joint_limits(mytool.my_armature),
+                                                                   mytool.my_reach_samples)
+                self.dragging = False
+                # The solutions are applied at display rate
+                self._timer = context.window_manager.event_timer_add(1.0 / 60.0, window=context.window)
+
             context.window_manager.modal_handler_add(self)
             return {'RUNNING_MODAL'}
         else:
@@ -588,9 +1991,6 @@ class OBJECT_PT_robot_controller(Panel):
 
     def draw(self, context):
 
-        if not bones_with_driver:
-            look_for_bones_with_drivers(context.scene.my_tool.my_armature)
-
         if ikv.iDynTreeModel is None:
             configure_ik()
 
@@ -610,17 +2010,57 @@ class OBJECT_PT_robot_controller(Panel):
                           "my_list", scene, "list_index")
 
         box.prop(mytool, "my_string")
+        box.prop(mytool, "my_backend")
+        if mytool.my_backend == "FAKE":
+            box.prop(mytool, "my_fake_latency")
+            box.prop(mytool, "my_fake_time_constant")
         row_connect = box.row(align=True)
         row_connect.operator("wm.connect")
         layout.separator()
         row_disconnect = box.row(align=True)
         row_disconnect.operator("wm.disconnect")
+        row_connect_all = box.row(align=True)
+        row_connect_all.operator("wm.connect_all")
+        row_connect_all.prop(mytool, "my_connect_timeout")
+        if WM_OT_ConnectAll.progress:
+            box.label(text=WM_OT_ConnectAll.progress)
+        box.prop(mytool, "my_bool")
+        box.prop(mytool, "my_dry_run_log")
+        row_replay = box.row(align=True)
+        row_replay.operator("wm.replay_command_log")
+        row_replay.prop(mytool, "my_replay_speed")
+        broadcast_box = box.box()
+        row_broadcast = broadcast_box.row(align=True)
+        row_broadcast.prop(mytool, "my_broadcast")
+        row_broadcast.prop(mytool, "my_broadcast_record")
+        broadcast_box.prop(mytool, "my_publish_address")
+        if active_broadcaster is not None:
+            for sink in active_broadcaster.sinks:
+                broadcast_box.label(text=f"{sink.name}: {sink.summary()}")
+        mirror_box = box.box()
+        mirror_box.label(text="Mirror robot")
+        row_mirror_rate = mirror_box.row(align=True)
+        row_mirror_rate.prop(mytool, "my_mirror_rate")
+        row_mirror_rate.prop(mytool, "my_mirror_display_rate")
+        row_mirror = mirror_box.row(align=True)
+        row_mirror.operator("wm.mirror_robot",
+                            text="Stop mirroring" if robot_mirror.is_running() else "Start mirroring")
+        row_mirror.prop(mytool, "my_mirror_record")
+        log_box = box.box()
+        log_box.label(text="Encoder log")
+        log_box.prop(mytool, "my_log_axis_names")
+        log_box.prop(mytool, "my_log_header_columns")
+        row_log = log_box.row(align=True)
+        row_log.prop(mytool, "my_log_resample")
+        row_log.prop(mytool, "my_log_tolerance")
+        log_box.operator("wm.import_encoder_log")
         layout.separator()
 
         reach_box = layout.box()
         reach_box.label(text="Reach target")
         reach_box.row(align=True).prop(mytool, "my_baseframeenum")
         reach_box.row(align=True).prop(mytool, "my_eeframeenum")
+        reach_box.row(align=True).prop(mytool, "my_ik_solver")
 
         reach_box.label(text="Position")
         reach_box.row(align=True).prop(mytool, "my_reach_x")
@@ -632,13 +2072,96 @@ class OBJECT_PT_robot_controller(Panel):
         reach_box.row(align=True).prop(mytool, "my_reach_pitch")
         reach_box.row(align=True).prop(mytool, "my_reach_yaw")
         reach_box.operator("wm.reach_target")
+        reach_box.row(align=True).prop(mytool, "my_show_trajectory")
+        row_collisions = reach_box.row(align=True)
+        row_collisions.operator("wm.check_self_collisions")
+        row_collisions.prop(mytool, "my_collision_convex")
+        row_reach_map = reach_box.row(align=True)
+        row_reach_map.operator("wm.build_reachability_map")
+        row_reach_map.prop(mytool, "my_reach_samples")
+
+        row_drag = reach_box.row(align=True)
+        row_drag.operator("wm.initiate_drag_drop")
+        row_drag.prop(mytool, "my_live_drag")
+
+        targets_box = reach_box.box()
+        targets_box.label(text="Multiple targets")
+        row_targets = targets_box.row()
+        row_targets.template_list("MY_UL_IkTargets", "ik_targets", scene, "my_ik_targets",
+                                  scene, "my_ik_target_index")
+        col_targets = row_targets.column(align=True)
+        col_targets.operator("wm.add_ik_target", icon='ADD', text="")
+        col_targets.operator("wm.remove_ik_target", icon='REMOVE', text="")
+        if 0 <= scene.my_ik_target_index < len(scene.my_ik_targets):
+            target = scene.my_ik_targets[scene.my_ik_target_index]
+            targets_box.prop(target, "frame")
+            targets_box.prop(target, "mode")
+            row_position = targets_box.row(align=True)
+            for prop in ("x", "y", "z"):
+                row_position.prop(target, prop)
+            row_rotation = targets_box.row(align=True)
+            for prop in ("roll", "pitch", "yaw"):
+                row_rotation.prop(target, prop)
+            row_weights = targets_box.row(align=True)
+            row_weights.prop(target, "position_weight")
+            row_weights.prop(target, "rotation_weight")
+        targets_box.operator("wm.reach_all_targets")
+
+        row_target = reach_box.row(align=True)
+        row_target.prop(mytool, "my_ik_target_object")
+        row_target.prop(mytool, "my_ik_target_rotation")
+        row_batch = reach_box.row(align=True)
+        row_batch.operator("wm.batch_reach_target")
+        row_batch.prop(mytool, "my_batch_workers")
+
+        layout.separator()
+
+        validation_box = layout.box()
+        validation_box.label(text="Limits validation")
+        validation_box.prop(mytool, "my_validation_rate")
+        validation_box.prop(mytool, "my_max_velocity")
+        validation_box.prop(mytool, "my_max_acceleration")
+        validation_box.operator("wm.validate_limits")
+        row_retime = validation_box.row(align=True)
+        row_retime.operator("wm.retime")
+        row_retime.prop(mytool, "my_retime_mode", text="")
+
+        dynamics_box = validation_box.box()
+        dynamics_box.label(text="Dynamics")
+        dynamics_box.prop(mytool, "my_max_torque")
+        dynamics_box.prop(mytool, "my_support_frames")
+        row_support = dynamics_box.row(align=True)
+        row_support.prop(mytool, "my_support_half_length")
+        row_support.prop(mytool, "my_support_half_width")
+        dynamics_box.prop(mytool, "my_min_com_margin")
+        row_dynamics = dynamics_box.row(align=True)
+        row_dynamics.operator("wm.check_dynamics")
+        row_dynamics.operator("wm.export_dynamics")
+        dynamics_box.enabled = ikv.configured
+
+        layout.separator()
 
-        reach_box.operator("wm.initiate_drag_drop")
+        stats_box = layout.box()
+        stats_box.label(text="Streaming statistics")
+        stats_box.prop(mytool, "my_settle_tolerance")
+        stats_box.prop(mytool, "my_scrub_rate")
+        row_jump = stats_box.row(align=True)
+        row_jump.prop(mytool, "my_jump_threshold")
+        row_jump.prop(mytool, "my_approach_speed")
+        for part_name, stats in sstats.part_stats.items():
+            stats_box.label(text=f"{part_name}: {stats.summary()}")
+        row_stats = stats_box.row(align=True)
+        row_stats.operator("wm.reset_streaming_stats")
+        row_stats.operator("wm.export_streaming_stats")
 
         layout.separator()
 
         box_joints = layout.box()
         box_joints.label(text="joint angles")
+        box_joints.operator("wm.key_full_pose")
+        row_thin = box_joints.row(align=True)
+        row_thin.operator("wm.thin_keyframes")
+        row_thin.prop(mytool, "my_thinning_tolerance")
 
         try:
             scene.my_joints
@@ -646,15 +2169,10 @@ class OBJECT_PT_robot_controller(Panel):
             joints_exist = False
         else:
             joints_exist = True
-            for joint_name, joint in bpy.data.objects[mytool.my_armature].pose.bones.items():
-                # We do not have to add the entry in the list for the bones that have drivers
-                # since they have not to be controlled directly, but throgh the driver.s
-                if joint_name in bones_with_driver:
-                    continue
-                # Our bones rotate around y (revolute joint), translate along y (prismatic joint), if both are locked, it
-                # means it is a fixed joint.
-                if joint.lock_rotation[1] and joint.lock_location[1]:
-                    continue
+            table = get_armature_joint_table(mytool.my_armature)
+            # We do not have to add the entry in the list for the bones that have drivers
+            # since they have not to be controlled directly, but throgh the driver.s
+            for joint_name in table.controllable_names() if table is not None else []:
                 box_joints.prop(scene.my_joints, joint_name)
 
         if len(context.scene.my_list) == 0 or not joints_exist:
@@ -668,11 +2186,14 @@ class OBJECT_PT_robot_controller(Panel):
             if bpy.context.screen.is_animation_playing:
                 row_disconnect.enabled = False
                 row_connect.enabled = False
+                row_connect_all.enabled = False
+                row_replay.enabled = False
                 box_joints.enabled = False
                 reach_box.enabled = False
             else:
                 box_joints.enabled = True
                 reach_box.enabled = ikv.configured
+                row_connect_all.enabled = not WM_OT_ConnectAll.progress
                 if getattr(parts[scene.list_index], "value") in rcb_wrapper.keys():
                     row_disconnect.enabled = True
                     row_connect.enabled = False
@@ -700,6 +2221,9 @@ class OT_OpenConfigurationFile(Operator, ImportHelper):
             item = context.scene.my_list.add()
             item.value = p[0]
             item.viewValue = p[1]
+            # The optional third element lists the axes of the part
+            if len(p) > 2:
+                item.axisNames = ",".join(p[2])
 
     def execute(self, context):
         filename, extension = os.path.splitext(self.filepath)
@@ -716,7 +2240,8 @@ def configure_ik():
     model_urdf = bpy.context.scene['model_urdf']
     mdlLoader = iDynTree.ModelLoader()
     mdlLoader.loadModelFromString(model_urdf)
-    ikv.iDynTreeModel = mdlLoader.model()
+    # Copied, the model of the loader is freed with it and it is used by the batched kinematics
+    ikv.iDynTreeModel = mdlLoader.model().copy()
 
     # list_of_links = []
     for link_idx in range(ikv.iDynTreeModel.getNrOfLinks()):
@@ -725,6 +2250,11 @@ def configure_ik():
                               ""))
 
     ikv.inverseKinematics.setModel(ikv.iDynTreeModel)
+    # The cached chains refer to the previous model
+    ikv.traversal = None
+    ikv.solvers.clear()
+    reachability.maps.clear()
+    trajectory_overlay.set_model(ikv.iDynTreeModel)
     # Setup the ik problem
     ikv.inverseKinematics.setCostTolerance(0.0001)
     ikv.inverseKinematics.setConstraintsTolerance(0.00001)
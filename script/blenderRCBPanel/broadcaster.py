@@ -0,0 +1,214 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import collections
+import json
+import socket
+import threading
+import time
+
+from . import streaming_stats as sstats
+
+
+class Tick:
+    """Targets (degrees, ordered as the joint names of the broadcaster) extracted in a frame.
+    The same instance is shared by all the sinks, that must not modify it."""
+
+    def __init__(self, frame, timestamp, targets, frame_step=1, is_playing=False, scrubbing=False):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.targets = targets
+        self.frame_step = frame_step
+        self.is_playing = is_playing
+        self.scrubbing = scrubbing
+
+
+class Sink:
+    """Consumer of the ticks with its own sender thread, offer() never blocks.
+
+    A sink slower than the ticks keeps only the most recent one, or with keep_all
+    a bounded queue of them. The ticks replaced or discarded are counted as dropped.
+    """
+
+    def __init__(self, name, keep_all=False, max_queue=10000):
+        self.name = name
+        self.queue = collections.deque(maxlen=max_queue if keep_all else 1)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        self.sent = 0
+        self.dropped = 0
+        self.send_time = 0.0
+        self.thread = threading.Thread(target=self._run, name=f"rcb_sink_{name}", daemon=True)
+        self.thread.start()
+
+    def offer(self, tick):
+        with self.lock:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(tick)
+        self.wake.set()
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.wait_timeout())
+            self.wake.clear()
+            while True:
+                with self.lock:
+                    if not self.queue:
+                        break
+                    tick = self.queue.popleft()
+                start = time.monotonic()
+                self.send(tick)
+                self.send_time += time.monotonic() - start
+                self.sent += 1
+            self.idle()
+        self.stop()
+
+    def send(self, tick):
+        raise NotImplementedError
+
+    def wait_timeout(self):
+        # Seconds the sender thread waits for a tick before calling idle(), None for no limit
+        return None
+
+    def idle(self):
+        # Called by the sender thread after the ticks received, or after wait_timeout()
+        pass
+
+    def stop(self):
+        # Called by the sender thread when the sink is closed
+        pass
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+
+    def summary(self):
+        mean = 1000.0 * self.send_time / self.sent if self.sent else 0.0
+        return f"{self.sent} sent, {self.dropped} dropped, send {mean:.2f} ms"
+
+
+class BoardSink(Sink):
+    """Streams the targets of a part to its control board in position direct.
+
+    The targets go through the command_coalescing.PartCoalescer of the part, owned by the
+    sender thread: while scrubbing they are sent at most at rate, the jumps are approached
+    at approach_speed, and the streaming statistics of the part are updated as move() does.
+    """
+
+    def __init__(self, name, board, columns, coalescer, stats, jump_threshold, settle_tolerance, rate,
+                 approach_speed):
+        # columns: [(axis, column), ...]
+        self.board = board
+        self.columns = columns
+        self.coalescer = coalescer
+        self.stats = stats
+        self.jump_threshold = jump_threshold
+        self.settle_tolerance = settle_tolerance
+        self.period = 1.0 / rate
+        self.max_step = approach_speed / rate
+        self.next_flush = 0.0
+        super().__init__(name)
+
+    def send(self, tick):
+        self.stats.frame_changed(tick.frame, tick.frame_step, tick.is_playing)
+        self.coalescer.frame_changed(tick.frame, tick.frame_step, tick.is_playing)
+        encs = self.board.get_encoders()
+        if encs is None:
+            self.stats.frame_dropped()
+            self.stats.handler_done(tick.timestamp, sstats.now())
+            return
+        self.stats.encoders_read(encs, self.settle_tolerance, sstats.now())
+        for axis, column in self.columns:
+            target = tick.targets[column]
+            t_extract = sstats.now()
+            if self.coalescer.submit(axis, target, encs[axis], tick.scrubbing, self.jump_threshold, self.stats):
+                self.board.set_position(axis, target)
+                self.stats.command_sent(axis, target, tick.timestamp, t_extract, sstats.now())
+        self.stats.handler_done(tick.timestamp, sstats.now())
+
+    def wait_timeout(self):
+        if not self.coalescer.pending:
+            return None
+        return max(self.next_flush - time.monotonic(), 0.0)
+
+    def idle(self):
+        # The pending targets are sent at most once per period
+        if self.coalescer.pending and time.monotonic() >= self.next_flush:
+            self.coalescer.flush(self.max_step, self.stats)
+            self.next_flush = time.monotonic() + self.period
+
+
+class RecorderSink(Sink):
+    """Writes every tick to a command_log.CommandRecorder, that is not closed with the sink."""
+
+    def __init__(self, name, recorder, parts):
+        # parts: [(part name, axis names, [(axis, column), ...]), ...]
+        self.recorder = recorder
+        self.parts = parts
+        super().__init__(name, keep_all=True)
+
+    def send(self, tick):
+        for part_name, axis_names, columns in self.parts:
+            for axis, column in columns:
+                self.recorder.record(part_name, axis_names, axis, tick.targets[column], tick.timestamp)
+
+
+class UdpPublisherSink(Sink):
+    """Publishes every tick as a JSON datagram {"frame", "time", "joints": {name: degrees}}."""
+
+    def __init__(self, name, address, joint_names):
+        self.address = address
+        self.joint_names = list(joint_names)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        super().__init__(name)
+
+    def send(self, tick):
+        message = {"frame": tick.frame,
+                   "time": tick.timestamp,
+                   "joints": dict(zip(self.joint_names, [float(value) for value in tick.targets]))}
+        try:
+            self.socket.sendto(json.dumps(message).encode("utf-8"), self.address)
+        except OSError:
+            self.dropped += 1
+
+    def stop(self):
+        self.socket.close()
+
+
+class Broadcaster:
+    """Fans out the targets extracted once per frame to any number of sinks."""
+
+    def __init__(self, joint_names):
+        self.joint_names = list(joint_names)
+        self.sinks = []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, name):
+        for sink in [sink for sink in self.sinks if sink.name == name]:
+            self.sinks.remove(sink)
+            sink.close()
+
+    def publish(self, frame, timestamp, targets, frame_step=1, is_playing=False, scrubbing=False):
+        tick = Tick(frame, timestamp, targets, frame_step, is_playing, scrubbing)
+        for sink in self.sinks:
+            sink.offer(tick)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+
+
+def parse_address(address):
+    # "host:port" -> (host, port), ValueError if it is not valid
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
@@ -0,0 +1,134 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bpy
+
+from . import streaming_stats as sstats
+
+# Frames that the playback may skip to keep the frame rate, in frame steps, a larger change
+# of frame is a jump
+MAX_PLAYBACK_GAP = 5
+
+
+class PartCoalescer:
+    """Targets of a part that are not sent by move() directly.
+
+    While scrubbing only the most recent target of each joint is kept and the targets
+    are sent by a timer at a bounded rate. The targets farther than the jump threshold
+    from the last command are approached, from the encoder, with steps limited by the
+    approach speed, both while scrubbing and during the playback. The distance from the
+    encoder is checked too when the stream resumes (out of the playback, on its first frame
+    and after a jump of frame), not during the continuous playback that the robot follows
+    with some lag.
+    """
+
+    def __init__(self, board):
+        self.board = board
+        # joint -> last commanded position and joint -> target waiting for the timer
+        self.last_sent = {}
+        self.pending = {}
+        # joints moving towards their target with limited steps
+        self.approaching = set()
+        self.last_frame = None
+        self.continuous = False
+
+    def frame_changed(self, frame, frame_step, is_playing):
+        # The playback is continuous from its second frame until the frame jumps
+        self.continuous = (is_playing and self.last_frame is not None
+                           and 0 < abs(frame - self.last_frame) <= MAX_PLAYBACK_GAP * frame_step)
+        self.last_frame = frame if is_playing else None
+
+    def submit(self, joint, target, current, scrubbing, jump_threshold, stats):
+        """Returns True if the target can be sent immediately, otherwise it is kept for the timer."""
+        last = self.last_sent.setdefault(joint, current)
+        distance = abs(target - last) if self.continuous else max(abs(target - last), abs(target - current))
+        if joint not in self.approaching and distance > jump_threshold:
+            stats.jump_detected()
+            self.approaching.add(joint)
+            # The robot may be far from the last command, the approach starts where it is
+            self.last_sent[joint] = current
+        if joint in self.pending:
+            # A newer target replaces the one not sent yet
+            stats.command_merged()
+        elif not scrubbing and joint not in self.approaching:
+            self.last_sent[joint] = target
+            return True
+        self.pending[joint] = target
+        return False
+
+    def flush(self, max_step, stats):
+        # One step towards each pending target, the reached ones are removed
+        t_now = sstats.now()
+        for joint, target in list(self.pending.items()):
+            last = self.last_sent[joint]
+            command = target
+            if joint in self.approaching:
+                command = last + max(-max_step, min(max_step, target - last))
+            self.board.set_position(joint, command)
+            stats.command_sent(joint, command, t_now, t_now, sstats.now())
+            self.last_sent[joint] = command
+            if command == target:
+                del self.pending[joint]
+                self.approaching.discard(joint)
+
+
+class CoalescingState:
+    rate = 20.0
+    approach_speed = 30.0
+    timer_registered = False
+
+
+# part name -> PartCoalescer
+coalescers = {}
+
+
+def get_coalescer(part_name, board):
+    # A new coalescer when the part is connected to a new board
+    coalescer = coalescers.get(part_name)
+    if coalescer is None or coalescer.board is not board:
+        coalescer = PartCoalescer(board)
+        coalescers[part_name] = coalescer
+    return coalescer
+
+
+def flush_timer():
+    max_step = CoalescingState.approach_speed / CoalescingState.rate
+    rcb_wrappers = getattr(bpy.types.Scene, "rcb_wrapper", {})
+    busy = False
+    for part_name, coalescer in list(coalescers.items()):
+        # The boards of the parts disconnected in the meantime are not commanded
+        rcb_instance = rcb_wrappers.get(part_name)
+        if rcb_instance is None or rcb_instance.board is not coalescer.board:
+            del coalescers[part_name]
+            continue
+        if coalescer.pending:
+            coalescer.flush(max_step, sstats.get_part_stats(part_name))
+            busy = busy or bool(coalescer.pending)
+    if not busy:
+        CoalescingState.timer_registered = False
+        return None
+    return 1.0 / CoalescingState.rate
+
+
+def schedule_flush(rate, approach_speed):
+    """Starts the timer sending the pending targets, it stops by itself when they are all sent."""
+    CoalescingState.rate = rate
+    CoalescingState.approach_speed = approach_speed
+    if not CoalescingState.timer_registered:
+        CoalescingState.timer_registered = True
+        bpy.app.timers.register(flush_timer, first_interval=1.0 / rate)
+
+
+def reset(part_name):
+    # The last commands and the pending targets do not survive a new connection of the part
+    coalescers.pop(part_name, None)
+
+
+def clear():
+    coalescers.clear()
+    if CoalescingState.timer_registered and bpy.app.timers.is_registered(flush_timer):
+        bpy.app.timers.unregister(flush_timer)
+    CoalescingState.timer_registered = False
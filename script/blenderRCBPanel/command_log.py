@@ -0,0 +1,144 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import struct
+import threading
+import time
+
+# Binary, append-only log of the position direct commands.
+# The file starts with MAGIC, followed by records introduced by a type byte:
+#  - PART:    part id (uint16), length (uint16) and utf-8 "part_name:axis0,axis1,..."
+#  - COMMAND: timestamp in seconds from the start of the recording (double),
+#             part id (uint16), joint index (uint16), target in degrees (double)
+#  - SESSION: no payload, a new recording appended to the log. Its timestamps restart
+#             from 0 and its part ids are defined again.
+MAGIC = b"RCBLOG01"
+RECORD_PART = 0
+RECORD_COMMAND = 1
+RECORD_SESSION = 2
+PART_HEADER = struct.Struct("<BHH")
+COMMAND = struct.Struct("<BdHHd")
+
+
+class CommandRecorder:
+    """Buffers the commands and writes them to the log from a background thread."""
+
+    def __init__(self, filepath, flush_period=0.1):
+        self.filepath = filepath
+        self.flush_period = flush_period
+        self.part_ids = {}
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        self.start = time.monotonic()
+        self.file = open(filepath, "ab", buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        else:
+            self.file.write(bytes([RECORD_SESSION]))
+        self.thread = threading.Thread(target=self._run, name="rcb_command_recorder", daemon=True)
+        self.thread.start()
+
+    def record(self, part_name, axis_names, joint, target, timestamp=None):
+        t = (time.monotonic() if timestamp is None else timestamp) - self.start
+        with self.lock:
+            part_id = self.part_ids.get(part_name)
+            if part_id is None:
+                part_id = len(self.part_ids)
+                self.part_ids[part_name] = part_id
+                definition = (part_name + ":" + ",".join(axis_names)).encode("utf-8")
+                self.buffer.append(PART_HEADER.pack(RECORD_PART, part_id, len(definition)) + definition)
+            self.buffer.append(COMMAND.pack(RECORD_COMMAND, t, part_id, joint, target))
+
+    def _flush(self):
+        with self.lock:
+            chunk, self.buffer = self.buffer, []
+        if chunk:
+            self.file.write(b"".join(chunk))
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.flush_period)
+            self.wake.clear()
+            self._flush()
+        self._flush()
+        self.file.close()
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+
+
+def read_log(filepath):
+    """Yields (timestamp, part_name, axis_name, joint, target) for each command of the log.
+    The sessions appended to the log follow the previous ones, the timestamps keep increasing."""
+    parts = {}
+    # Time of the previous sessions and last timestamp of the current one
+    base = 0.0
+    last = 0.0
+    with open(filepath, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{filepath} is not a command log")
+    offset = len(MAGIC)
+    while offset < len(data):
+        record_type = data[offset]
+        if record_type == RECORD_PART:
+            if offset + PART_HEADER.size > len(data):
+                break
+            _, part_id, length = PART_HEADER.unpack_from(data, offset)
+            if offset + PART_HEADER.size + length > len(data):
+                break
+            offset += PART_HEADER.size
+            part_name, axes = data[offset:offset + length].decode("utf-8").split(":", 1)
+            parts[part_id] = (part_name, axes.split(",") if axes else [])
+            offset += length
+        elif record_type == RECORD_COMMAND:
+            if offset + COMMAND.size > len(data):
+                # truncated record at the end of a log that has not been closed
+                break
+            _, t, part_id, joint, target = COMMAND.unpack_from(data, offset)
+            offset += COMMAND.size
+            if part_id not in parts:
+                raise ValueError(f"Command of the undefined part {part_id} at byte {offset} of {filepath}")
+            part_name, axes = parts[part_id]
+            axis_name = axes[joint] if joint < len(axes) else ""
+            last = t
+            yield base + t, part_name, axis_name, joint, target
+        elif record_type == RECORD_SESSION:
+            offset += 1
+            base += last
+            last = 0.0
+            parts = {}
+        else:
+            raise ValueError(f"Unknown record type {record_type} at byte {offset} of {filepath}")
+
+
+def replay(filepath, boards, speed=1.0, stop_event=None):
+    """Sends the commands of the log to the boards (dict part name -> board) respecting
+    the recorded timing, scaled by speed. The joints are matched by axis name when the
+    board exposes it, so a board with a different order of the axes can be used.
+    Returns the number of commands sent."""
+    axis_maps = {}
+    for part_name, board in boards.items():
+        axis_maps[part_name] = {name: idx for idx, name in enumerate(board.get_axis_names())}
+
+    sent = 0
+    start = time.monotonic()
+    for t, part_name, axis_name, joint, target in read_log(filepath):
+        if stop_event is not None and stop_event.is_set():
+            break
+        board = boards.get(part_name)
+        if board is None:
+            continue
+        delay = start + t / speed - time.monotonic()
+        if delay > 0.0:
+            time.sleep(delay)
+        board.set_position(axis_maps[part_name].get(axis_name, joint), target)
+        sent += 1
+    return sent
@@ -1,6 +1,10 @@
 import bpy
 import math
+import re
 import idyntree.bindings as iDynTree
+from . import joint_table as jt
+from . import reachability
+from .dls_ik import DlsChainSolver
 
 
 class IkVariables:
@@ -8,21 +12,306 @@ class IkVariables:
     dynComp = iDynTree.KinDynComputations()
     iDynTreeModel = None
     configured = False
+    traversal = None
+    # (base frame, end-effector frame, method) -> IkChainSolver or DlsChainSolver
+    solvers = {}
 
-bones_with_driver = []
+# Names of the bones moved by drivers, parsed from the data paths of the armature's drivers
+bones_with_driver = set()
+# Armature and data paths bones_with_driver has been computed for
+drivers_state = {"armature": None, "signature": None}
+
+BONE_DATA_PATH = re.compile(r'pose\.bones\["((?:[^"\\]|\\.)*)"\]')
 
 
 def printError(object, *args):
     object.report({"ERROR"}, " ".join(args))
 
+def drivers_signature(armature_object):
+    # It means that there are no drivers
+    if armature_object is None or armature_object.animation_data is None:
+        return ()
+    return tuple(d.data_path for d in armature_object.animation_data.drivers)
+
+
 def look_for_bones_with_drivers(armature_name):
-    for joint_name in bpy.data.objects[armature_name].pose.bones.keys():
-        # It means that there are no drivers
-        if bpy.context.object.animation_data is None:
+    # Parse again the drivers only if they changed, returns True in that case
+    signature = drivers_signature(bpy.data.objects.get(armature_name))
+    if drivers_state["armature"] == armature_name and drivers_state["signature"] == signature:
+        return False
+    bones_with_driver.clear()
+    for data_path in signature:
+        match = BONE_DATA_PATH.match(data_path)
+        if match:
+            bones_with_driver.add(match.group(1).replace('\\"', '"').replace('\\\\', '\\'))
+    drivers_state["armature"] = armature_name
+    drivers_state["signature"] = signature
+    return True
+
+
+def drivers_update_handler(scene, depsgraph):
+    # Drivers are added or removed on the armature object, its updates are the only ones
+    # that can change the driven bones
+    armature_name = drivers_state["armature"]
+    if armature_name is None:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and update.id.name == armature_name:
+            if look_for_bones_with_drivers(armature_name):
+                table = jt.get_joint_table(armature_name)
+                if table is not None:
+                    table.set_driven(bones_with_driver)
             return
-        for d in bpy.context.object.animation_data.drivers:
-            if ('"%s"' % joint_name) in d.data_path:
-                bones_with_driver.append(joint_name)
+
+def get_armature_joint_table(armature_name):
+    if drivers_state["armature"] != armature_name:
+        look_for_bones_with_drivers(armature_name)
+    return jt.get_joint_table(armature_name, bones_with_driver)
+
+
+def chain_joints(object, model, traversal, base_frame, endeffector_frame):
+    # Returns the list of the joints of the chain that goes from the base to the
+    # end-effector, None if there is no such chain
+    considered_joints = []
+
+    # TODO substitute the traversal part with this block after
+    # DHChain has been added to the bindings
+    # dhChain = iDynTree.DHChain()
+    # dhChain.fromModel(model, base_frame, endeffector_frame)
+
+    # for chain_idx in range(dhChain.getNrOfDOFs()):
+    #    considered_joints.append(dhChain.getDOFName(chain_idx))
+
+    base_link_idx = model.getLinkIndex(base_frame)
+    endeffector_link_idx = model.getLinkIndex(endeffector_frame)
+    if base_link_idx < 0 or endeffector_link_idx < 0:
+        return None
+
+    visitedLinkIdx = endeffector_link_idx
+    # create the list of considered joints, it is the list of the joints of
+    # the selected chain
+    while visitedLinkIdx != base_link_idx:
+        parentLink = traversal.getParentLinkFromLinkIndex(visitedLinkIdx)
+        if parentLink is None:
+            printError(object, "Unable to find a single chain that goes from", base_frame, "to", endeffector_frame)
+            return None
+        parentLinkIdx = parentLink.getIndex()
+        joint = traversal.getParentJointFromLinkIndex(visitedLinkIdx)
+        visitedLinkIdx = parentLinkIdx
+        if joint.getNrOfDOFs() == 0:
+            continue
+        considered_joints.append(model.getJointName(joint.getIndex()))
+    return considered_joints
+
+
+def target_transform(mytool, xyz=[], rpy=[]):
+    # Transform of the cartesian target, taken from the panel if xyz or rpy are not given
+    if not rpy:
+        iDynTreeRotation = iDynTree.Rotation.RPY(mytool.my_reach_roll * math.pi / 180,
+                                                 mytool.my_reach_pitch * math.pi / 180,
+                                                 mytool.my_reach_yaw * math.pi / 180)
+    else:
+        iDynTreeRotation = iDynTree.Rotation.RPY(rpy[0] * math.pi / 180,
+                                                 rpy[1] * math.pi / 180,
+                                                 rpy[2] * math.pi / 180)
+
+    if not xyz:
+        iDynTreePosition = iDynTree.Position(mytool.my_reach_x, mytool.my_reach_y, mytool.my_reach_z)
+    else:
+        iDynTreePosition = iDynTree.Position(-xyz[0], xyz[1], xyz[2])
+
+    return iDynTree.Transform(iDynTreeRotation, iDynTreePosition)
+
+
+def armature_joint_limits(armature_name):
+    # joint name -> (min, max) in radians, from the joint table
+    table = get_armature_joint_table(armature_name)
+    if table is None:
+        return {}
+    return {name: tuple(table.limits[idx]) for name, idx in table.index.items()}
+
+
+# How each target of a multi-target problem is enforced
+TARGET_RESOLUTION_MODES = {
+    "COST": iDynTree.InverseKinematicsTreatTargetAsConstraintNone,
+    "POSITION": iDynTree.InverseKinematicsTreatTargetAsConstraintPositionOnly,
+    "ROTATION": iDynTree.InverseKinematicsTreatTargetAsConstraintRotationOnly,
+    "FULL": iDynTree.InverseKinematicsTreatTargetAsConstraintFull,
+}
+
+
+class MultiTargetIkSolver:
+    """Inverse kinematics of several frames solved in a single problem.
+
+    The problem is defined over the given joints (e.g. the union of the chains going
+    from the base to each target frame). The targets are weighted in the cost unless
+    their resolution mode (frame name -> key of TARGET_RESOLUTION_MODES) makes them
+    constraints. The reduced model, the joints mapping and the problem are prepared
+    once, every solve warm-starts from the previous solution. It does not use bpy.
+    """
+
+    def __init__(self, model, base_frame, target_frames, considered_joints, resolution_modes={}):
+        self.base_frame = base_frame
+        self.target_frames = list(target_frames)
+        self.considered_joints = considered_joints
+        self.resolution_modes = dict(resolution_modes)
+
+        # Extract reduced model
+        self.ik = iDynTree.InverseKinematics()
+        self.ik.setModel(model, considered_joints)
+        # Setup the ik problem
+        self.ik.setCostTolerance(0.0001)
+        self.ik.setConstraintsTolerance(0.00001)
+        self.ik.setDefaultTargetResolutionMode(iDynTree.InverseKinematicsTreatTargetAsConstraintNone)
+        self.ik.setRotationParametrization(iDynTree.InverseKinematicsRotationParametrizationRollPitchYaw)
+
+        self.dynComp = iDynTree.KinDynComputations()
+        self.dynComp.loadRobotModel(self.ik.reducedModel())
+        self.dofs = self.ik.reducedModel().getNrOfDOFs()
+        # joint names in the order of the reduced model
+        self.joint_names = [self.ik.reducedModel().getJointName(idx) for idx in range(self.dofs)]
+        self.joint_positions = iDynTree.VectorDynSize(self.dofs)
+
+        # Note: the InverseKinematics class actually implements a floating base inverse kinematics,
+        # meaning that both the joint position and the robot base are optimized to reach the desired cartesian position
+        self.world_H_base = self.dynComp.getWorldTransform(base_frame)
+        self.ik.setFloatingBaseOnFrameNamed(base_frame)
+        self.ik.addFrameConstraint(base_frame, self.world_H_base)
+
+        self.targets_added = set()
+        self.last_solution = None
+
+    def solve_targets(self, targets, initial=None):
+        """targets is a list of (base_H_frame_desired, position_weight, rotation_weight), one
+        for each target frame. Returns the joint positions (ordered as joint_names) reaching
+        the targets, None if the problem cannot be solved. initial overrides the warm start."""
+        for frame, (transform, position_weight, rotation_weight) in zip(self.target_frames, targets):
+            if frame in self.targets_added:
+                ok = self.ik.updateTarget(frame, transform, position_weight, rotation_weight)
+            else:
+                ok = self.ik.addTarget(frame, transform, position_weight, rotation_weight)
+                if ok and frame in self.resolution_modes:
+                    ok = self.ik.setTargetResolutionMode(frame, TARGET_RESOLUTION_MODES[self.resolution_modes[frame]])
+                if ok:
+                    self.targets_added.add(frame)
+            if not ok:
+                return None
+
+        # Initialize ik
+        seed = initial if initial is not None else self.last_solution
+        for idx in range(self.dofs):
+            self.joint_positions.setVal(idx, seed[idx] if seed is not None else 0.0)
+        self.ik.setReducedInitialCondition(self.world_H_base, self.joint_positions)
+
+        if not self.ik.solve():
+            return None
+
+        base_transform = iDynTree.Transform.Identity()
+
+        # Get the solution
+        self.ik.getReducedSolution(base_transform, self.joint_positions)
+        self.dynComp.setJointPos(self.joint_positions)
+        self.last_solution = [self.joint_positions.getVal(idx) for idx in range(self.dofs)]
+        return self.last_solution
+
+
+class IkChainSolver(MultiTargetIkSolver):
+    """Inverse kinematics of a single base/end-effector chain."""
+
+    def __init__(self, model, base_frame, endeffector_frame, considered_joints):
+        super().__init__(model, base_frame, [endeffector_frame], considered_joints)
+        self.endeffector_frame = endeffector_frame
+
+    def solve(self, base_H_ee_desired, initial=None):
+        """Returns the joint positions (ordered as joint_names) reaching the target,
+        None if the problem cannot be solved. initial overrides the warm start."""
+        # We want that the end effector reaches the target
+        return self.solve_targets([(base_H_ee_desired, 1.0, 1.0)], initial)
+
+
+def get_ik_solver(object, base_frame, endeffector_frame, method="OPTIMIZATION"):
+    # Solvers are cached per chain, they are dropped when the model is loaded again.
+    # method is OPTIMIZATION (iDynTree InverseKinematics) or DLS (damped least-squares,
+    # that uses the optimization as fallback)
+    key = (base_frame, endeffector_frame, method)
+    solver = IkVariables.solvers.get(key)
+    if solver is not None:
+        return solver
+
+    if method == "DLS":
+        fallback = get_ik_solver(object, base_frame, endeffector_frame)
+        if fallback is None:
+            return None
+        # The limits are the ones of the armature's constraints
+        limits = armature_joint_limits(bpy.context.scene.my_tool.my_armature)
+        solver = DlsChainSolver(IkVariables.inverseKinematics.fullModel(), base_frame, endeffector_frame,
+                                fallback.considered_joints, limits, fallback=fallback)
+        IkVariables.solvers[key] = solver
+        return solver
+
+    model = IkVariables.inverseKinematics.fullModel()
+    if IkVariables.traversal is None:
+        traversal = iDynTree.Traversal()
+        if not model.computeFullTreeTraversal(traversal):
+            printError(object, "Unable to get the traversal")
+            return None
+        IkVariables.traversal = traversal
+
+    considered_joints = chain_joints(object, model, IkVariables.traversal, base_frame, endeffector_frame)
+    if considered_joints is None:
+        return None
+
+    solver = IkChainSolver(model, base_frame, endeffector_frame, considered_joints)
+    IkVariables.solvers[key] = solver
+    return solver
+
+
+def get_multi_target_ik_solver(object, base_frame, resolution_modes):
+    # resolution_modes is a dict target frame -> resolution mode, the solver is defined
+    # over the union of the chains from the base to the targets and cached like the others
+    key = (base_frame, tuple(resolution_modes.items()), "MULTI")
+    solver = IkVariables.solvers.get(key)
+    if solver is not None:
+        return solver
+
+    considered_joints = []
+    for frame in resolution_modes:
+        chain = get_ik_solver(object, base_frame, frame)
+        if chain is None:
+            return None
+        considered_joints.extend(name for name in chain.considered_joints if name not in considered_joints)
+
+    solver = MultiTargetIkSolver(IkVariables.inverseKinematics.fullModel(), base_frame, list(resolution_modes),
+                                 considered_joints, resolution_modes)
+    IkVariables.solvers[key] = solver
+    return solver
+
+
+def current_joint_positions(armature_name, joint_names):
+    # Values of the joints in the armature, 0 for the ones that are not bones
+    pose_bones = bpy.data.objects[armature_name].pose.bones
+    return [pose_bones[name].rotation_euler[1] if name in pose_bones else 0.0 for name in joint_names]
+
+
+def apply_joint_positions(armature_name, joint_names, joint_positions, insert_key=True):
+    pose_bones = bpy.data.objects[armature_name].pose.bones
+    table = get_armature_joint_table(armature_name)
+    for joint_name, joint_value in zip(joint_names, joint_positions):
+        if joint_name not in table.index:
+            continue
+
+        joint = pose_bones[joint_name]
+
+        # It is a prismatic joint (to be tested)
+        if table.is_prismatic(joint_name):
+            # joint.delta_location[1] = joint_value
+            joint.lock_location[1] = int(joint_value)
+        # It is a revolute joint
+        else:
+            joint.rotation_euler[1] = joint_value
+            if insert_key:
+                joint.keyframe_insert(data_path="rotation_euler")
+
 
 class InverseKinematics:
 
@@ -32,9 +321,6 @@ class InverseKinematics:
     @staticmethod
     def execute(object, xyz=[], rpy=[]):
         scene = bpy.context.scene
-        considered_joints = []
-        ik = IkVariables.inverseKinematics
-        model = ik.fullModel()
 
         # bpy.ops.object.wm_ot_reachTarget
         mytool = scene.my_tool
@@ -46,118 +332,33 @@ class InverseKinematics:
             printError(object, "Base frame and end-effector frame are coincident!")
             return {'CANCELLED'}
 
-        # TODO substitute the traversal part with this block after
-        # DHChain has been added to the bindings
-        # dhChain = iDynTree.DHChain()
-        # dhChain.fromModel(model, base_frame, endeffector_frame)
-
-        # for chain_idx in range(dhChain.getNrOfDOFs()):
-        #    considered_joints.append(dhChain.getDOFName(chain_idx))
-
-        traversal = iDynTree.Traversal()
-        ok_traversal = model.computeFullTreeTraversal(traversal)
-
-        if not ok_traversal:
-            printError(object, "Unable to get the traversal")
-            return {'CANCELLED'}
-
-        base_link_idx = model.getLinkIndex(base_frame)
-        endeffector_link_idx = model.getLinkIndex(endeffector_frame)
-        if base_link_idx < 0 or endeffector_link_idx < 0:
+        solver = get_ik_solver(object, base_frame, endeffector_frame, mytool.my_ik_solver)
+        if solver is None:
             return {'CANCELLED'}
 
-        visitedLinkIdx = endeffector_link_idx
-        # create the list of considered joints, it is the list of the joints of
-        # the selected chain
-        while visitedLinkIdx != base_link_idx:
-            parentLink = traversal.getParentLinkFromLinkIndex(visitedLinkIdx)
-            if parentLink is None:
-                printError(object, "Unable to find a single chain that goes from", base_frame, "to", endeffector_frame)
-                return {'CANCELLED'}
-            parentLinkIdx = parentLink.getIndex()
-            joint = traversal.getParentJointFromLinkIndex(visitedLinkIdx)
-            visitedLinkIdx = parentLinkIdx
-            if joint.getNrOfDOFs() == 0:
-                continue
-            considered_joints.append(model.getJointName(joint.getIndex()))
-
-        # Extract reduced model
-
-        ik.setModel(model, considered_joints)
-        IkVariables.dynComp.loadRobotModel(ik.reducedModel())
-        joint_positions = iDynTree.VectorDynSize(ik.reducedModel().getNrOfDOFs())
-
-        # Note: the InverseKinematics class actually implements a floating base inverse kinematics,
-        # meaning that both the joint position and the robot base are optimized to reach the desired cartesian position
-        world_H_base = IkVariables.dynComp.getWorldTransform(base_frame)
-
-        ok = IkVariables.inverseKinematics.setFloatingBaseOnFrameNamed(base_frame)
-
-        ik.addFrameConstraint(base_frame, world_H_base)
-
-        # base_H_ee_initial = IkVariables.dynComp.getRelativeTransform(base_frame, endeffector_frame);
-
-        if not rpy:
-            iDynTreeRotation = iDynTree.Rotation.RPY(mytool.my_reach_roll * math.pi / 180,
-                                                     mytool.my_reach_pitch * math.pi / 180,
-                                                     mytool.my_reach_yaw * math.pi / 180)
-        else:
-            iDynTreeRotation = iDynTree.Rotation.RPY(rpy[0] * math.pi / 180,
-                                                     rpy[1] * math.pi / 180,
-                                                     rpy[2] * math.pi / 180)
-
-        if not xyz:
-            iDynTreePosition = iDynTree.Position(mytool.my_reach_x, mytool.my_reach_y, mytool.my_reach_z)
-        else:
-            iDynTreePosition = iDynTree.Position(-xyz[0], xyz[1], xyz[2])
-
         # Define the transform of the selected cartesian target
-        base_H_ee_desired = iDynTree.Transform(iDynTreeRotation, iDynTreePosition)
-
-        # We want that the end effector reaches the target
-        ok = ik.addTarget(endeffector_frame, base_H_ee_desired)
-        if not ok:
-            ok = ik.updateTarget(endeffector_frame, base_H_ee_desired)
-            if not ok:
-                printError(object, "Impossible to add target on ", endeffector_frame)
+        base_H_ee_desired = target_transform(mytool, xyz, rpy)
+
+        initial = None
+        reach_map = reachability.get_reachability_map(base_frame, endeffector_frame, solver.considered_joints,
+                                                      armature_joint_limits(mytool.my_armature),
+                                                      mytool.my_reach_samples)
+        if reach_map is not None:
+            position = base_H_ee_desired.getPosition().toNumPy()
+            if not reach_map.is_reachable(position):
+                printError(object, "The target is out of reach.")
                 return {'CANCELLED'}
-        # Initialize ik
-        IkVariables.dynComp.getJointPos(joint_positions)
-        ik.setReducedInitialCondition(world_H_base, joint_positions)
-        # ik.setDesiredReducedJointConfiguration(joint_positions)
-
-        # TODO: The following line generated the WARNING:
-        #  [WARNING] InverseKinematics: joint l_elbow (index 20)
-        #           initial condition is outside the limits 0.261799 1.85005. Actual value: 0
-        #  [WARNING] InverseKinematics: joint r_elbow (index 28)
-        #           initial condition is outside the limits 0.261799 1.85005. Actual value: 0
-        ok = ik.solve()
-
-        if not ok:
+            # The closest sampled configuration is the warm start
+            initial = reach_map.seed(position, base_H_ee_desired.getRotation().toNumPy(), solver.joint_names)
+        elif solver.last_solution is None:
+            # The first solve of a chain starts from the current pose of the armature
+            initial = current_joint_positions(mytool.my_armature, solver.joint_names)
+
+        joint_positions = solver.solve(base_H_ee_desired, initial)
+        if joint_positions is None:
             printError(object, "Impossible to solve inverse kinematics problem.")
             return {'CANCELLED'}
 
-        base_transform = iDynTree.Transform.Identity()
-
-        # Get the solution
-        ik.getReducedSolution(base_transform, joint_positions)
-        IkVariables.dynComp.setJointPos(joint_positions)
-
-        pose_bones = bpy.data.objects[bpy.context.scene.my_tool.my_armature].pose.bones
-        for idyn_joint_idx in range(ik.reducedModel().getNrOfDOFs()):
-
-            # It is a prismatic joint (to be tested)
-            joint_name = ik.reducedModel().getJointName(idyn_joint_idx)
-
-            joint = pose_bones[joint_name]
-            joint_value = joint_positions[idyn_joint_idx]
-
-            if joint.lock_rotation[1]:
-                # joint.delta_location[1] = joint_value
-                joint.lock_location[1] = int(joint_value)
-            # It is a revolute joint
-            else:
-                joint.rotation_euler[1] = joint_value
-                joint.keyframe_insert(data_path="rotation_euler")
+        apply_joint_positions(mytool.my_armature, solver.joint_names, joint_positions)
 
         return {'FINISHED'}
@@ -0,0 +1,340 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import math
+import threading
+import time
+
+# Control modes understood by all the backends
+CM_POSITION = "position"
+CM_POSITION_DIRECT = "position_direct"
+
+
+class ControlBoardBackend:
+    """Interface of a control board, the panel talks to the robot only through it."""
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def is_valid(self):
+        raise NotImplementedError
+
+    def get_axes(self):
+        raise NotImplementedError
+
+    def get_axis_name(self, joint):
+        raise NotImplementedError
+
+    def set_control_mode(self, joint, mode):
+        raise NotImplementedError
+
+    def set_position(self, joint, ref):
+        # position direct, ref in degrees
+        raise NotImplementedError
+
+    def set_ref_speed(self, joint, speed):
+        raise NotImplementedError
+
+    def position_move(self, joint, ref):
+        raise NotImplementedError
+
+    def is_motion_done(self, joint):
+        raise NotImplementedError
+
+    def get_encoders(self):
+        # Returns the list of encoders in degrees, None if they cannot be read
+        raise NotImplementedError
+
+    def get_limits(self, joint):
+        # Returns the pair (min, max) in degrees
+        raise NotImplementedError
+
+    # Multi-joint versions, the backends override them when they can do it in a single call
+
+    def set_control_modes(self, mode):
+        return all([self.set_control_mode(joint, mode) for joint in range(self.get_axes())])
+
+    def get_axis_names(self):
+        return [self.get_axis_name(joint) for joint in range(self.get_axes())]
+
+    def get_all_limits(self):
+        return [self.get_limits(joint) for joint in range(self.get_axes())]
+
+
+class YarpControlBoard(ControlBoardBackend):
+    """remote_controlboard opened through a yarp.PolyDriver."""
+
+    network_initialized = False
+
+    @classmethod
+    def init_network(cls):
+        # yarp.Network.init is done once and kept for all the following connections
+        import yarp
+        if not cls.network_initialized:
+            yarp.Network.init()
+            cls.network_initialized = True
+        return yarp.Network.checkNetwork()
+
+    def __init__(self, robot, local, remote):
+        self.robot = robot
+        self.local = local
+        self.remote = remote
+        self.driver = None
+
+    def open(self):
+        # yarp is imported here so that the fake board can be used without the bindings
+        import yarp
+        self.yarp = yarp
+        options = yarp.Property()
+        self.driver = yarp.PolyDriver()
+
+        # set the poly driver options
+        options.put("robot", self.robot)
+        options.put("device", "remote_controlboard")
+        print(f'local port: {self.local}')
+        options.put("local", self.local)
+        print(f'remote port: {self.remote}')
+        options.put("remote", self.remote)
+
+        # opening the drivers
+        print('Opening the motor driver...')
+        self.driver.open(options)
+        if not self.driver.isValid():
+            return False
+
+        print('Viewing motor position/encoders...')
+        self.icm = self.driver.viewIControlMode()
+        self.iposDir = self.driver.viewIPositionDirect()
+        self.ipos = self.driver.viewIPositionControl()
+        self.ienc = self.driver.viewIEncoders()
+        self.iax = self.driver.viewIAxisInfo()
+        self.ilim = self.driver.viewIControlLimits()
+        if self.ienc is None or self.ipos is None or self.icm is None or self.iposDir is None \
+                or self.iax is None or self.ilim is None:
+            self.driver.close()
+            return False
+        self.encs = yarp.Vector(self.ipos.getAxes())
+        return True
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.close()
+
+    def is_valid(self):
+        return self.driver is not None and self.driver.isValid()
+
+    def _vocab(self, mode):
+        if mode == CM_POSITION:
+            return self.yarp.VOCAB_CM_POSITION
+        return self.yarp.VOCAB_CM_POSITION_DIRECT
+
+    def get_axes(self):
+        return self.ipos.getAxes()
+
+    def get_axis_name(self, joint):
+        return self.iax.getAxisName(joint)
+
+    def set_control_mode(self, joint, mode):
+        return self.icm.setControlMode(joint, self._vocab(mode))
+
+    def set_control_modes(self, mode):
+        modes = self.yarp.IVector(self.get_axes(), self._vocab(mode))
+        return self.icm.setControlModes(modes)
+
+    def set_position(self, joint, ref):
+        return self.iposDir.setPosition(joint, ref)
+
+    def set_ref_speed(self, joint, speed):
+        return self.ipos.setRefSpeed(joint, speed)
+
+    def position_move(self, joint, ref):
+        return self.ipos.positionMove(joint, ref)
+
+    def is_motion_done(self, joint):
+        return self.ipos.isMotionDone(joint)
+
+    def get_encoders(self):
+        if not self.ienc.getEncoders(self.encs.data()):
+            return None
+        return [self.encs[i] for i in range(self.encs.size())]
+
+    def get_limits(self, joint):
+        min = self.yarp.Vector(1)
+        max = self.yarp.Vector(1)
+        self.ilim.getLimits(joint, min.data(), max.data())
+        return min.get(0), max.get(0)
+
+    def get_all_limits(self):
+        # IControlLimits has no multi-joint getter, reuse the same buffers for all the joints
+        min = self.yarp.Vector(1)
+        max = self.yarp.Vector(1)
+        limits = []
+        for joint in range(self.get_axes()):
+            self.ilim.getLimits(joint, min.data(), max.data())
+            limits.append((min.get(0), max.get(0)))
+        return limits
+
+
+class FakeControlBoard(ControlBoardBackend):
+    """In-process control board simulating the joints, it does not need a YARP server.
+
+    Every call is delayed by `latency` seconds. In position direct the joints follow
+    the reference as a first order system with time constant `time_constant`, in
+    position control they move towards the reference at the reference speed. In both
+    cases the velocity is saturated at `max_speed` (degrees/s).
+    """
+
+    def __init__(self, axis_names, limits=None, latency=0.0, time_constant=0.05, max_speed=200.0):
+        self.axis_names = list(axis_names)
+        n = len(self.axis_names)
+        self.limits = list(limits) if limits is not None else [(-360.0, 360.0)] * n
+        self.latency = latency
+        self.time_constant = time_constant
+        self.max_speed = max_speed
+        self.modes = [CM_POSITION] * n
+        self.positions = [0.0] * n
+        self.references = [0.0] * n
+        self.ref_speeds = [10.0] * n
+        self.last_update = time.monotonic()
+        self.opened = False
+        self.lock = threading.Lock()
+
+    def _delay(self):
+        if self.latency > 0.0:
+            time.sleep(self.latency)
+
+    def _clamp(self, joint, value):
+        return min(max(value, self.limits[joint][0]), self.limits[joint][1])
+
+    def _integrate(self):
+        now = time.monotonic()
+        dt = now - self.last_update
+        self.last_update = now
+        if dt <= 0.0:
+            return
+        for j in range(len(self.positions)):
+            error = self.references[j] - self.positions[j]
+            if self.modes[j] == CM_POSITION_DIRECT:
+                step = error * (1.0 - math.exp(-dt / self.time_constant)) if self.time_constant > 0.0 else error
+                max_step = self.max_speed * dt
+            else:
+                step = error
+                max_step = min(self.ref_speeds[j], self.max_speed) * dt
+            self.positions[j] += max(-max_step, min(max_step, step))
+
+    def open(self):
+        self._delay()
+        self.opened = True
+        self.last_update = time.monotonic()
+        return True
+
+    def close(self):
+        self.opened = False
+
+    def is_valid(self):
+        return self.opened
+
+    def get_axes(self):
+        return len(self.axis_names)
+
+    def get_axis_name(self, joint):
+        return self.axis_names[joint]
+
+    def set_control_mode(self, joint, mode):
+        self._delay()
+        with self.lock:
+            self._integrate()
+            self.modes[joint] = mode
+            self.references[joint] = self.positions[joint]
+        return True
+
+    def set_position(self, joint, ref):
+        self._delay()
+        with self.lock:
+            if self.modes[joint] != CM_POSITION_DIRECT:
+                return False
+            self._integrate()
+            self.references[joint] = self._clamp(joint, ref)
+        return True
+
+    def set_ref_speed(self, joint, speed):
+        self._delay()
+        self.ref_speeds[joint] = speed
+        return True
+
+    def position_move(self, joint, ref):
+        self._delay()
+        with self.lock:
+            if self.modes[joint] != CM_POSITION:
+                return False
+            self._integrate()
+            self.references[joint] = self._clamp(joint, ref)
+        return True
+
+    def is_motion_done(self, joint):
+        self._delay()
+        with self.lock:
+            self._integrate()
+            return abs(self.references[joint] - self.positions[joint]) < 1e-3
+
+    def get_encoders(self):
+        self._delay()
+        with self.lock:
+            self._integrate()
+            return list(self.positions)
+
+    def get_limits(self, joint):
+        self._delay()
+        return self.limits[joint]
+
+    def set_control_modes(self, mode):
+        self._delay()
+        with self.lock:
+            self._integrate()
+            self.modes = [mode] * len(self.modes)
+            self.references = list(self.positions)
+        return True
+
+    def get_all_limits(self):
+        self._delay()
+        return list(self.limits)
+
+
+# Boards released by a disconnection are kept open and reused by the next connection
+# of the same part, the key identifies the part (e.g. its local and remote ports).
+board_pool = {}
+board_pool_lock = threading.Lock()
+
+
+def acquire_board(key, new_board):
+    # Returns the board parked for the key if still valid, otherwise opens new_board.
+    # None if it cannot be opened.
+    with board_pool_lock:
+        board = board_pool.pop(key, None)
+    if board is not None and board.is_valid():
+        return board
+    if not new_board.open():
+        return None
+    return new_board
+
+
+def release_board(key, board):
+    with board_pool_lock:
+        previous = board_pool.get(key)
+        board_pool[key] = board
+    if previous is not None and previous is not board:
+        previous.close()
+
+
+def close_all_boards():
+    with board_pool_lock:
+        boards = list(board_pool.values())
+        board_pool.clear()
+    for board in boards:
+        board.close()
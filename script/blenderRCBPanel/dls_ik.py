@@ -0,0 +1,120 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import numpy as np
+import idyntree.bindings as iDynTree
+
+
+def rotation_error(R, R_desired):
+    # Angular error (axis * angle) that brings R to R_desired, expressed in the world frame
+    R_err = R_desired @ R.T
+    cos_angle = np.clip((np.trace(R_err) - 1.0) / 2.0, -1.0, 1.0)
+    angle = np.arccos(cos_angle)
+    axis = np.array([R_err[2, 1] - R_err[1, 2],
+                     R_err[0, 2] - R_err[2, 0],
+                     R_err[1, 0] - R_err[0, 1]])
+    sin_angle = np.sin(angle)
+    if sin_angle < 1e-6:
+        if cos_angle > 0.0:
+            # small angles, the skew part is already the error
+            return 0.5 * axis
+        # about pi the skew part vanishes, the axis comes from the symmetric part R_err = 2 a a^T - I
+        B = (R_err + np.eye(3)) / 2.0
+        column = np.argmax(np.diag(B))
+        return B[:, column] / np.sqrt(max(B[column, column], 1e-12)) * angle
+    return axis * angle / (2.0 * sin_angle)
+
+
+class DlsChainSolver:
+    """Differential inverse kinematics of a single chain with damped least-squares.
+
+    It iterates on the frame Jacobian computed by KinDynComputations on the model
+    reduced to the chain, with the base frame fixed, clamping the joints in their
+    limits. When it does not converge the fallback solver (if any) is used.
+    It has the same interface of IkChainSolver and does not use bpy: the targets are
+    expressed in the world frame of the reduced model, placed on its default base link
+    like IkChainSolver does, so both solvers reach the same pose.
+    """
+
+    def __init__(self, model, base_frame, endeffector_frame, considered_joints, limits,
+                 fallback=None, damping=0.05, max_iterations=50, tolerance=1e-4, orientation_weight=0.5):
+        self.base_frame = base_frame
+        self.endeffector_frame = endeffector_frame
+        self.considered_joints = considered_joints
+        self.fallback = fallback
+        self.damping = damping
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.orientation_weight = orientation_weight
+
+        mdlLoader = iDynTree.ModelLoader()
+        mdlLoader.loadReducedModelFromFullModel(model, considered_joints)
+        self.dynComp = iDynTree.KinDynComputations()
+        # The default base of the reduced model is kept, the joints between it and the base
+        # frame are not in the chain, so the base frame does not move
+        self.dynComp.loadRobotModel(mdlLoader.model())
+        self.dynComp.setFrameVelocityRepresentation(iDynTree.MIXED_REPRESENTATION)
+
+        reduced_model = self.dynComp.model()
+        self.dofs = reduced_model.getNrOfDOFs()
+        # joint names in the order of the reduced model
+        self.joint_names = [reduced_model.getJointName(idx) for idx in range(self.dofs)]
+        self.ee_index = reduced_model.getFrameIndex(endeffector_frame)
+        # limits is a dict joint name -> (min, max) in radians
+        self.lower = np.array([limits.get(name, (-np.inf, np.inf))[0] for name in self.joint_names])
+        self.upper = np.array([limits.get(name, (-np.inf, np.inf))[1] for name in self.joint_names])
+
+        self.jacobian = iDynTree.MatrixDynSize(6, 6 + self.dofs)
+        self.last_solution = None
+
+    def forward(self, q):
+        self.dynComp.setJointPos(iDynTree.VectorDynSize.FromPython(q))
+        H = self.dynComp.getWorldTransform(self.ee_index)
+        return H.getPosition().toNumPy(), H.getRotation().toNumPy()
+
+    def solve_dls(self, p_desired, R_desired, q):
+        """Returns (q, error norm) after the damped least-squares iterations."""
+        damping2 = self.damping ** 2 * np.eye(6)
+        error_norm = np.inf
+        for _ in range(self.max_iterations):
+            p, R = self.forward(q)
+            error = np.concatenate((p_desired - p,
+                                    self.orientation_weight * rotation_error(R, R_desired)))
+            error_norm = np.linalg.norm(error)
+            if error_norm < self.tolerance:
+                break
+            self.dynComp.getFrameFreeFloatingJacobian(self.ee_index, self.jacobian)
+            J = self.jacobian.toNumPy()[:, 6:]
+            J[3:, :] *= self.orientation_weight
+            dq = J.T @ np.linalg.solve(J @ J.T + damping2, error)
+            q = np.clip(q + dq, self.lower, self.upper)
+        return q, error_norm
+
+    def solve(self, base_H_ee_desired, initial=None):
+        seed = initial if initial is not None else self.last_solution
+        q = np.zeros(self.dofs) if seed is None else np.clip(np.asarray(seed, dtype=np.float64),
+                                                             self.lower, self.upper)
+        p_desired = base_H_ee_desired.getPosition().toNumPy()
+        R_desired = base_H_ee_desired.getRotation().toNumPy()
+
+        q, error_norm = self.solve_dls(p_desired, R_desired, q)
+        if error_norm > 10 * self.tolerance and self.fallback is not None:
+            # Difficult target (e.g. far away or close to a singularity), use the optimizer
+            solution = self.fallback.solve(base_H_ee_desired,
+                                           self.reorder(q, self.joint_names, self.fallback.joint_names))
+            if solution is None:
+                return None
+            q = np.array(self.reorder(solution, self.fallback.joint_names, self.joint_names))
+        elif error_norm > 10 * self.tolerance:
+            return None
+
+        self.last_solution = q.tolist()
+        return self.last_solution
+
+    @staticmethod
+    def reorder(values, from_names, to_names):
+        by_name = dict(zip(from_names, values))
+        return [by_name.get(name, 0.0) for name in to_names]
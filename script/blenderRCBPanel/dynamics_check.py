@@ -0,0 +1,150 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import concurrent.futures
+import numpy as np
+import idyntree.bindings as iDynTree
+
+from .batch_ik import fork_context
+
+GRAVITY = (0.0, 0.0, -9.81)
+
+
+def model_joint_names(model):
+    # Names of the joints with one DOF, in the order of the DOFs of the model
+    names = [""] * model.getNrOfDOFs()
+    for joint_idx in range(model.getNrOfJoints()):
+        joint = model.getJoint(joint_idx)
+        if joint.getNrOfDOFs() == 1:
+            names[joint.getDOFsOffset()] = model.getJointName(joint_idx)
+    return names
+
+
+def convex_hull(points):
+    # 2D convex hull (monotone chain), counter-clockwise
+    points = sorted(set(map(tuple, points)))
+    if len(points) < 3:
+        return np.array(points)
+
+    def half(sequence):
+        hull = []
+        for p in sequence:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (p[1] - hull[-2][1]) -
+                                      (hull[-1][1] - hull[-2][1]) * (p[0] - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append(p)
+        return hull
+
+    return np.array(half(points)[:-1] + half(reversed(points))[:-1])
+
+
+def support_margin(point, polygon):
+    """Signed distance of a 2D point from the boundary of a counter-clockwise convex
+    polygon, positive inside. The distance from the segment or point if it is degenerate."""
+    if len(polygon) == 0:
+        return -np.inf
+    if len(polygon) < 3:
+        a, b = polygon[0], polygon[-1]
+        ab = b - a
+        t = np.clip(np.dot(point - a, ab) / max(np.dot(ab, ab), 1e-12), 0.0, 1.0)
+        return -np.linalg.norm(point - (a + t * ab))
+    edges = np.roll(polygon, -1, axis=0) - polygon
+    normals = np.stack((edges[:, 1], -edges[:, 0]), axis=1) / np.linalg.norm(edges, axis=1)[:, None]
+    # Distance from each edge line, negative on the inner side
+    distances = np.einsum("ij,ij->i", point - polygon, normals)
+    if distances.max() <= 0:
+        return -distances.max()
+    # Outside, distance from the closest edge segment
+    t = np.clip(np.einsum("ij,ij->i", point - polygon, edges) / np.einsum("ij,ij->i", edges, edges), 0.0, 1.0)
+    return -np.linalg.norm(point - (polygon + t[:, None] * edges), axis=1).min()
+
+
+def analyze_chunk(model_urdf, q, dq, ddq, support_frames, support_half_size):
+    """Inverse dynamics (fixed base, no external forces) and center of mass of the configurations.
+    Returns (torques (N x dofs), com (N x 3), margin (N,)) with the margin of the projection of
+    the center of mass from the support polygon, the hull of rectangles of half sizes
+    support_half_size centered on the support frames. It runs in the worker processes."""
+    mdlLoader = iDynTree.ModelLoader()
+    mdlLoader.loadModelFromString(model_urdf)
+    model = mdlLoader.model()
+    kinDyn = iDynTree.KinDynComputations()
+    kinDyn.loadRobotModel(model)
+    dofs = model.getNrOfDOFs()
+
+    world_H_base = iDynTree.Transform.Identity()
+    base_velocity = iDynTree.Twist()
+    base_velocity.zero()
+    base_acceleration = iDynTree.Vector6()
+    base_acceleration.zero()
+    gravity = iDynTree.Vector3.FromPython(list(GRAVITY))
+    external_wrenches = iDynTree.LinkWrenches(model)
+    external_wrenches.zero()
+    generalized_torques = iDynTree.FreeFloatingGeneralizedTorques(model)
+    support_indices = [kinDyn.model().getFrameIndex(name) for name in support_frames]
+    half_x, half_y = support_half_size
+    corners = np.array([[half_x, half_y, 0.0], [half_x, -half_y, 0.0], [-half_x, half_y, 0.0], [-half_x, -half_y, 0.0]])
+
+    n = len(q)
+    torques = np.empty((n, dofs))
+    com = np.empty((n, 3))
+    margin = np.full(n, np.nan)
+    for idx in range(n):
+        kinDyn.setRobotState(world_H_base, iDynTree.VectorDynSize.FromPython(q[idx]), base_velocity,
+                             iDynTree.VectorDynSize.FromPython(dq[idx]), gravity)
+        kinDyn.inverseDynamics(base_acceleration, iDynTree.VectorDynSize.FromPython(ddq[idx]),
+                               external_wrenches, generalized_torques)
+        torques[idx] = generalized_torques.jointTorques().toNumPy()
+        com[idx] = kinDyn.getCenterOfMassPosition().toNumPy()
+        if support_indices:
+            points = []
+            for frame_idx in support_indices:
+                H = kinDyn.getWorldTransform(frame_idx)
+                R, p = H.getRotation().toNumPy(), H.getPosition().toNumPy()
+                points.extend((corners @ R.T + p)[:, :2])
+            margin[idx] = support_margin(com[idx, :2], convex_hull(np.round(points, 9)))
+    return torques, com, margin
+
+
+def analyze(model_urdf, q, dt, support_frames=(), support_half_size=(0.0, 0.0), n_workers=1):
+    """Dynamics of a trajectory sampled every dt, (N x dofs) ordered as the DOFs of the model.
+
+    The velocities and accelerations are finite differences. The frames are split in contiguous
+    chunks analyzed by a pool of forked processes (see batch_ik.fork_context, otherwise sequentially).
+    """
+    dq = np.gradient(q, dt, axis=0) if len(q) > 1 else np.zeros_like(q)
+    ddq = np.gradient(dq, dt, axis=0) if len(q) > 1 else np.zeros_like(q)
+    n = len(q)
+    n_chunks = max(1, min(n_workers, n // 200))
+    context = fork_context() if n_chunks > 1 else None
+    if context is None:
+        return analyze_chunk(model_urdf, q, dq, ddq, list(support_frames), support_half_size)
+
+    bounds = np.linspace(0, n, n_chunks + 1).astype(int)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_chunks, mp_context=context) as executor:
+        futures = [executor.submit(analyze_chunk, model_urdf, q[begin:end], dq[begin:end], ddq[begin:end],
+                                   list(support_frames), support_half_size)
+                   for begin, end in zip(bounds[:-1], bounds[1:])]
+        results = [future.result() for future in futures]
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+class DynamicsResult:
+    """Time series of an analysis, with the flags of the samples over the thresholds.
+    A max_torque of 0 is not checked, the margin only if there are support frames."""
+
+    def __init__(self, frames, joint_names, torques, com, margin, max_torque, min_margin):
+        self.frames = frames
+        self.joint_names = joint_names
+        self.torques = torques
+        self.com = com
+        self.margin = margin
+        self.torque_flags = np.abs(torques) > max_torque if max_torque > 0 else np.zeros(torques.shape, dtype=bool)
+        self.margin_flags = margin < min_margin if np.isfinite(margin).any() else np.zeros(len(margin), dtype=bool)
+
+    def save(self, filepath):
+        np.savez(filepath, frames=self.frames, joint_names=np.array(self.joint_names), torques=self.torques,
+                 com=self.com, com_margin=self.margin, torque_flags=self.torque_flags,
+                 com_margin_flags=self.margin_flags)
@@ -0,0 +1,146 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bpy
+import numpy as np
+
+# Our bones rotate around y, so the joint value is the channel 1 of rotation_euler
+JOINT_INDEX = 1
+
+
+def joint_data_path(joint_name):
+    return f'pose.bones["{joint_name}"].rotation_euler'
+
+
+def get_action(armature_object, create=True):
+    anim = armature_object.animation_data
+    if anim is None:
+        if not create:
+            return None
+        anim = armature_object.animation_data_create()
+    if anim.action is None and create:
+        anim.action = bpy.data.actions.new(armature_object.name + "Action")
+    return anim.action
+
+
+def joint_fcurve(armature_object, joint_name, create=True):
+    # F-curve of the joint value, None if it does not exist and create is False
+    action = get_action(armature_object, create)
+    if action is None:
+        return None
+    fcurve = action.fcurves.find(joint_data_path(joint_name), index=JOINT_INDEX)
+    if fcurve is None and create:
+        fcurve = action.fcurves.new(joint_data_path(joint_name), index=JOINT_INDEX, action_group=joint_name)
+    return fcurve
+
+
+def insert_key(fcurve, frame, value):
+    # Single key, replacing the one already present on the same frame
+    fcurve.keyframe_points.insert(frame, value, options={'REPLACE', 'FAST'})
+    fcurve.update()
+
+
+def get_keys(fcurve):
+    # (frames, values) of the keyframes as numpy arrays
+    n = len(fcurve.keyframe_points)
+    co = np.empty(2 * n, dtype=np.float64)
+    fcurve.keyframe_points.foreach_get("co", co)
+    return co[0::2], co[1::2]
+
+
+# Enum attributes of the keyframes and the values given to the new keys
+KEY_ENUMS = {"interpolation": 'BEZIER',
+             "easing": 'AUTO',
+             "handle_left_type": 'AUTO_CLAMPED',
+             "handle_right_type": 'AUTO_CLAMPED'}
+
+
+def enum_value(name, identifier):
+    # Integer value of an enum item of the keyframes, as foreach_set expects it
+    return bpy.types.Keyframe.bl_rna.properties[name].enum_items[identifier].value
+
+
+def key_attributes(fcurve):
+    """Per-key attributes of the keyframes as numpy arrays: the enums of KEY_ENUMS and the
+    handles (2 values per key), in the format taken by set_keys."""
+    points = fcurve.keyframe_points
+    n = len(points)
+    attributes = {}
+    for name in KEY_ENUMS:
+        attributes[name] = np.empty(n, dtype=np.int32)
+        points.foreach_get(name, attributes[name])
+    for name in ("handle_left", "handle_right"):
+        attributes[name] = np.empty(2 * n, dtype=np.float64)
+        points.foreach_get(name, attributes[name])
+    return attributes
+
+
+def set_keys(fcurve, frames, values, interpolation='BEZIER', attributes=None):
+    """Replaces all the keyframes of the F-curve in bulk, frames must be sorted.
+
+    The keys get the interpolation and automatic clamped handles, whatever the keys they
+    replace or the user preferences, unless attributes (see key_attributes) gives them per key.
+    """
+    points = fcurve.keyframe_points
+    n = len(frames)
+    points.clear()
+    points.add(n)
+    co = np.empty(2 * n, dtype=np.float64)
+    co[0::2] = frames
+    co[1::2] = values
+    points.foreach_set("co", co)
+    defaults = dict(KEY_ENUMS, interpolation=interpolation)
+    for name, identifier in defaults.items():
+        if attributes is not None and name in attributes:
+            points.foreach_set(name, np.asarray(attributes[name], dtype=np.int32))
+        else:
+            points.foreach_set(name, np.full(n, enum_value(name, identifier), dtype=np.int32))
+    # The handles without attributes are placed on the keys, fcurve.update() recomputes the automatic ones
+    for name in ("handle_left", "handle_right"):
+        points.foreach_set(name, attributes[name] if attributes is not None and name in attributes else co)
+    fcurve.update()
+
+
+def merge_keys(fcurve, frames, values, interpolation='BEZIER', replace_range=None):
+    """Adds the keyframes in bulk, the new ones replace the existing keys on the same frames and,
+    if replace_range (first, last) is given, all the existing keys within it.
+    The existing keys keep their interpolation, easing and handles."""
+    old_frames, old_values = get_keys(fcurve)
+    old_attributes = key_attributes(fcurve)
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    keep = ~np.isin(old_frames, frames)
+    if replace_range is not None:
+        keep &= (old_frames < replace_range[0]) | (old_frames > replace_range[1])
+    all_frames = np.concatenate((old_frames[keep], frames))
+    all_values = np.concatenate((old_values[keep], values))
+    order = np.argsort(all_frames, kind="stable")
+
+    attributes = {}
+    for name, identifier in dict(KEY_ENUMS, interpolation=interpolation).items():
+        new = np.full(len(frames), enum_value(name, identifier), dtype=np.int32)
+        attributes[name] = np.concatenate((old_attributes[name][keep], new))[order]
+    new_co = np.stack((frames, values), axis=1)
+    for name in ("handle_left", "handle_right"):
+        handles = np.concatenate((old_attributes[name].reshape(-1, 2)[keep], new_co))
+        attributes[name] = handles[order].ravel()
+    set_keys(fcurve, all_frames[order], all_values[order], attributes=attributes)
+
+
+def evaluate_joints(armature_object, joint_names, frames):
+    """Values of the joints in the given frames, (len(frames) x len(joint_names)).
+    The joints that are not animated keep the value of the pose, the ones that are not bones are 0."""
+    values = np.zeros((len(frames), len(joint_names)))
+    pose_bones = armature_object.pose.bones
+    for column, joint_name in enumerate(joint_names):
+        if joint_name not in pose_bones:
+            continue
+        fcurve = joint_fcurve(armature_object, joint_name, create=False)
+        if fcurve is None or len(fcurve.keyframe_points) == 0:
+            values[:, column] = pose_bones[joint_name].rotation_euler[JOINT_INDEX]
+        else:
+            values[:, column] = [fcurve.evaluate(frame) for frame in frames]
+    return values
@@ -0,0 +1,77 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import threading
+
+
+class IkWorker:
+    """Solves the inverse kinematics of a chain on a background thread.
+
+    Only the latest submitted target is kept: the targets arriving while a solve is
+    running are coalesced, so the superseded ones are never solved. Every completed
+    solve is published, also when a newer target is already waiting, so the solutions
+    keep arriving while the targets move faster than a solve. The solver must not be
+    used by others while the worker is running.
+    """
+
+    def __init__(self, solver):
+        self.solver = solver
+        self.condition = threading.Condition()
+        self.target = None
+        self.generation = 0
+        self.busy = False
+        self.result = None
+        self.result_generation = 0
+        self.taken_generation = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="rcb_ik_worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, target):
+        with self.condition:
+            self.target = target
+            self.generation += 1
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.target is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                target, generation = self.target, self.generation
+                self.target = None
+                self.busy = True
+
+            # The previous solution is the warm start of the next solve
+            solution = self.solver.solve(target)
+
+            with self.condition:
+                self.busy = False
+                if solution is not None:
+                    self.result = solution
+                    self.result_generation = generation
+                self.condition.notify_all()
+
+    def take_result(self):
+        # Latest solution not taken yet, None if there is nothing new
+        with self.condition:
+            if self.result_generation == self.taken_generation:
+                return None
+            self.taken_generation = self.result_generation
+            return self.result
+
+    def wait_idle(self, timeout=None):
+        # Waits until all the submitted targets have been solved
+        with self.condition:
+            return self.condition.wait_for(lambda: self.target is None and not self.busy, timeout)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
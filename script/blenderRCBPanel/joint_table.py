@@ -0,0 +1,166 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bpy
+import math
+import numpy as np
+
+REVOLUTE = 0
+PRISMATIC = 1
+
+
+def joint_definitions(armature_object):
+    """(names, types, limits, indices of the bones) of the joints of the armature."""
+    names, types, limits, bone_index = [], [], [], []
+    for idx, (joint_name, joint) in enumerate(armature_object.pose.bones.items()):
+        # Our bones rotate around y (revolute joint), translate along y (prismatic joint), if both are locked, it
+        # means it is a fixed joint.
+        if joint.lock_rotation[1] and joint.lock_location[1]:
+            continue
+        joint_min = -2 * math.pi
+        joint_max = 2 * math.pi
+        for constraint in joint.constraints:
+            if constraint.type == "LIMIT_ROTATION":
+                joint_min = constraint.min_y
+                joint_max = constraint.max_y
+                break
+        names.append(joint_name)
+        types.append(PRISMATIC if joint.lock_rotation[1] else REVOLUTE)
+        limits.append((joint_min, joint_max))
+        bone_index.append(idx)
+    return tuple(names), tuple(types), tuple(limits), tuple(bone_index)
+
+
+class JointTable:
+    """Metadata of the controllable joints of an armature, built once and shared by
+    the panel, move() and the inverse kinematics.
+
+    The joints are the bones that are not fixed, i.e. that can rotate around y
+    (revolute) or translate along y (prismatic). All the arrays are indexed like names.
+    """
+
+    def __init__(self, armature_object, driven_bones=()):
+        self.armature_name = armature_object.name
+        self.armature_data_name = armature_object.data.name
+        self.definitions = joint_definitions(armature_object)
+        names, types, limits, bone_index = self.definitions
+        self.names = list(names)
+
+        n = len(self.names)
+        self.index = {name: idx for idx, name in enumerate(self.names)}
+        self.types = np.array(types, dtype=np.int8)
+        # radians for the revolute joints
+        self.limits = np.array(limits, dtype=np.float64).reshape(n, 2)
+        # index of each joint in armature_object.pose.bones
+        self.bone_index = np.array(bone_index, dtype=np.int64)
+        self.driven = np.zeros(n, dtype=bool)
+        # YARP mapping, filled when the parts are connected: part name -> [(axis, index in the table)]
+        # of its axes that are joints of the armature
+        self.part_columns = {}
+        self.set_driven(driven_bones)
+        for part_name, axis_names in _part_axes.items():
+            self._map_part(part_name, axis_names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def limits_deg(self, joint_name):
+        return tuple(math.degrees(v) for v in self.limits[self.index[joint_name]])
+
+    def is_prismatic(self, joint_name):
+        return self.types[self.index[joint_name]] == PRISMATIC
+
+    def set_driven(self, driven_bones):
+        self.driven[:] = False
+        for name in driven_bones:
+            if name in self.index:
+                self.driven[self.index[name]] = True
+
+    def joint_values(self, armature_object):
+        """Value of rotation_euler[1] of all the joints, read in a single pass over the pose bones."""
+        pose_bones = armature_object.pose.bones
+        rotations = np.empty(3 * len(pose_bones), dtype=np.float64)
+        pose_bones.foreach_get("rotation_euler", rotations)
+        return rotations[1::3][self.bone_index]
+
+    def columns(self, part_name):
+        # (axis, index in the table) of the joints of a connected part
+        return self.part_columns.get(part_name, [])
+
+    def controllable_names(self):
+        # Joints with a slider, the driven ones are moved through their drivers
+        return [name for name, driven in zip(self.names, self.driven) if not driven]
+
+    def _map_part(self, part_name, axis_names):
+        # Returns for each axis of the part the index in the table, -1 if the joint is not in the armature
+        indices = [self.index.get(axis_name, -1) for axis_name in axis_names]
+        self.part_columns[part_name] = [(axis, idx) for axis, idx in enumerate(indices) if idx >= 0]
+        return indices
+
+    def _unmap_part(self, part_name):
+        self.part_columns.pop(part_name, None)
+
+    def signature(self):
+        # Identifies the set of joints and limits, used to avoid rebuilding identical slider classes
+        return (self.armature_name, tuple(self.names), self.limits.round(9).tobytes())
+
+
+_table = None
+# part name -> axis names of the connected parts
+_part_axes = {}
+
+
+def get_joint_table(armature_name, driven_bones=()):
+    """Returns the table of the armature, building it if it is missing or stale.
+    None if the armature does not exist."""
+    global _table
+    if _table is not None and _table.armature_name == armature_name:
+        return _table
+    armature_object = bpy.data.objects.get(armature_name)
+    if armature_object is None or armature_object.type != 'ARMATURE':
+        return None
+    _table = JointTable(armature_object, driven_bones)
+    return _table
+
+
+def map_part(part_name, axis_names):
+    # The mapping is remembered, so it survives the rebuilds of the table
+    _part_axes[part_name] = list(axis_names)
+    if _table is not None:
+        indices = _table._map_part(part_name, axis_names)
+        missing = [name for name, idx in zip(axis_names, indices) if idx < 0]
+        if missing:
+            print(f"The axes {', '.join(missing)} of {part_name} are not joints of the armature {_table.armature_name}, "
+                  "they are not moved. Check the joint names in the .urdf file or the bones in the .blend file")
+
+
+def unmap_part(part_name):
+    _part_axes.pop(part_name, None)
+    if _table is not None:
+        _table._unmap_part(part_name)
+
+
+def invalidate():
+    global _table
+    _table = None
+
+
+def armature_update_handler(scene, depsgraph):
+    # The bones are added or removed in edit mode, that is notified as an update of the armature data.
+    # The lock flags and the limit constraints are edited on the pose, that is notified as an update
+    # of the object together with every change of the pose, so the definitions are compared
+    if _table is None:
+        return
+    playing = bpy.context.screen is not None and bpy.context.screen.is_animation_playing
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Armature) and update.id.name == _table.armature_data_name:
+            invalidate()
+            return
+        if not playing and isinstance(update.id, bpy.types.Object) and update.id.name == _table.armature_name:
+            armature_object = bpy.data.objects.get(_table.armature_name)
+            if armature_object is None or joint_definitions(armature_object) != _table.definitions:
+                invalidate()
+            return
@@ -0,0 +1,70 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import numpy as np
+
+from . import fcurve_utils as fcu
+
+
+def rdp_mask(x, y, tolerance):
+    """Ramer-Douglas-Peucker simplification of the polyline (x, y), x sorted.
+
+    The error is measured along y, so tolerance bounds the difference between the values
+    and the linear interpolation of the kept samples. All the segments are split at once
+    in every iteration, at their farthest sample. Returns the mask of the kept samples.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    if n < 3:
+        keep[:] = True
+        return keep
+    idx = np.arange(n)
+    while True:
+        # The kept samples enclosing each sample
+        left = np.maximum.accumulate(np.where(keep, idx, 0))
+        right = np.minimum.accumulate(np.where(keep, idx, n - 1)[::-1])[::-1]
+        span = x[right] - x[left]
+        t = np.divide(x - x[left], span, out=np.zeros(n), where=span > 0)
+        deviation = np.abs(y - (y[left] + t * (y[right] - y[left])))
+        over = np.flatnonzero(deviation > tolerance)
+        if len(over) == 0:
+            return keep
+        # The farthest sample of each segment over the tolerance
+        segments = left[over]
+        order = np.lexsort((-deviation[over], segments))
+        first = np.unique(segments[order], return_index=True)[1]
+        keep[over[order[first]]] = True
+
+
+def thin_fcurve(fcurve, tolerance):
+    """Replaces the keys with the fewest linear keys that follow the original curve within
+    tolerance. The curve is sampled in every frame and in its keys, whatever its interpolation,
+    and it is not changed if the linear keys would not be fewer than the original ones.
+    Returns (keys before, keys after, maximum deviation from the samples)."""
+    key_frames, _ = fcu.get_keys(fcurve)
+    n = len(key_frames)
+    if n < 3:
+        return n, n, 0.0
+    frames = np.union1d(key_frames, np.arange(np.ceil(key_frames[0]), np.floor(key_frames[-1]) + 1))
+    values = np.array([fcurve.evaluate(frame) for frame in frames])
+    keep = rdp_mask(frames, values, tolerance)
+    if keep.sum() >= n:
+        return n, n, 0.0
+    deviation = np.abs(values - np.interp(frames, frames[keep], values[keep])).max()
+    fcu.set_keys(fcurve, frames[keep], values[keep], interpolation='LINEAR')
+    return n, int(keep.sum()), float(deviation)
+
+
+def thin_joints(armature_object, joint_names, tolerance):
+    """Thins the F-curves of the joints. Returns {joint name: (keys before, keys after, max deviation)}."""
+    results = {}
+    for joint_name in joint_names:
+        fcurve = fcu.joint_fcurve(armature_object, joint_name, create=False)
+        if fcurve is None or len(fcurve.keyframe_points) == 0:
+            continue
+        results[joint_name] = thin_fcurve(fcurve, tolerance)
+    return results
@@ -0,0 +1,63 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import numpy as np
+
+from . import fcurve_utils as fcu
+
+MARKER_PREFIX = "limit: "
+
+
+def sample_action(armature_object, joint_names, frame_start, frame_end, fps, rate):
+    """Values of the joints (degrees, as streamed by move()) sampled at rate Hz over the
+    frame range. Returns (frames, values) with the (fractional) frame of every sample."""
+    duration = (frame_end - frame_start) / fps
+    times = np.arange(0.0, duration + 0.5 / rate, 1.0 / rate)
+    frames = frame_start + times * fps
+    return frames, np.degrees(fcu.evaluate_joints(armature_object, joint_names, frames))
+
+
+def runs(mask):
+    # (first, last) indices of the runs of True in a boolean vector
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[0::2], edges[1::2] - 1))
+
+
+def validate(values, dt, lower, upper, max_velocity=0.0, max_acceleration=0.0):
+    """Checks the (samples x joints) values against the position limits (vectors, one per joint)
+    and the velocity and acceleration caps (0 is not checked), from finite differences.
+
+    Returns {joint column: [(kind, first sample, last sample, worst value), ...]}.
+    """
+    velocities = np.diff(values, axis=0) / dt
+    accelerations = np.diff(velocities, axis=0) / dt
+    checks = [("position", values, (values < lower) | (values > upper))]
+    if max_velocity > 0:
+        checks.append(("velocity", velocities, np.abs(velocities) > max_velocity))
+    if max_acceleration > 0:
+        checks.append(("acceleration", accelerations, np.abs(accelerations) > max_acceleration))
+
+    violations = {}
+    for kind, data, violated in checks:
+        for column in np.flatnonzero(violated.any(axis=0)):
+            for first, last in runs(violated[:, column]):
+                segment = data[first:last + 1, column]
+                worst = segment[np.argmax(np.abs(segment))]
+                violations.setdefault(column, []).append((kind, first, last, float(worst)))
+    return violations
+
+
+def clear_markers(scene):
+    for marker in [marker for marker in scene.timeline_markers if marker.name.startswith(MARKER_PREFIX)]:
+        scene.timeline_markers.remove(marker)
+
+
+def add_markers(scene, joint_names, violations, frames):
+    # One marker at the beginning of every violation
+    for column, joint_violations in violations.items():
+        for kind, first, last, worst in joint_violations:
+            scene.timeline_markers.new(f"{MARKER_PREFIX}{joint_names[column]} {kind}", frame=int(np.floor(frames[first])))
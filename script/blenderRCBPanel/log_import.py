@@ -0,0 +1,131 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import itertools
+import numpy as np
+
+from . import fcurve_utils as fcu
+from .keyframe_thinning import rdp_mask
+
+# Names of the time column in the header of the CSV logs
+TIME_COLUMNS = ("time", "timestamp", "t")
+
+
+class EncoderLog:
+    """Samples of a log: times (N,) in seconds and values (N x axes) in degrees."""
+
+    def __init__(self, axis_names, times, values):
+        self.axis_names = axis_names
+        self.times = times
+        self.values = values
+
+
+def parse_rows(lines, delimiter):
+    # Rows of numbers of a chunk of lines, the nested bottles of yarp are flattened
+    rows = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if delimiter is None:
+            line = line.replace("(", " ").replace(")", " ")
+        rows.append(line.split(delimiter))
+    if not rows:
+        return np.empty((0, 0))
+    n_columns = len(rows[0])
+    # The last line may be incomplete if the logger is still running
+    rows = [row for row in rows if len(row) == n_columns]
+    return np.array(rows, dtype=np.float64)
+
+
+def is_header(line, delimiter):
+    try:
+        [float(field) for field in line.replace("(", " ").replace(")", " ").split(delimiter)]
+    except ValueError:
+        return True
+    return False
+
+
+def read_log(filepath, axis_names=(), header_columns=2, chunk_lines=100000):
+    """Reads a yarpdatadumper / `yarp read` log or a CSV log in chunks of lines.
+
+    The text logs have header_columns leading columns (the counter and the timestamp), the
+    time is the last of them and the following columns are the axes. The CSV logs may have a
+    header with the time column and the axis names, otherwise the time is the first column.
+    The axis_names, when given, replace the names in the header.
+    """
+    delimiter = "," if filepath.lower().endswith(".csv") else None
+    chunks = []
+    with open(filepath, "r") as f:
+        first = f.readline()
+        header = []
+        if is_header(first, delimiter):
+            header = [name.strip() for name in first.split(delimiter)]
+        else:
+            chunks.append(parse_rows([first], delimiter))
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines:
+                break
+            chunks.append(parse_rows(lines, delimiter))
+
+    chunks = [chunk for chunk in chunks if chunk.size]
+    if not chunks:
+        raise ValueError(f"{filepath} does not contain any sample")
+    n_columns = chunks[0].shape[1]
+    data = np.concatenate([chunk for chunk in chunks if chunk.shape[1] == n_columns])
+
+    if header:
+        lowered = [name.lower() for name in header]
+        time_column = next((lowered.index(name) for name in TIME_COLUMNS if name in lowered), 0)
+        value_columns = [column for column in range(len(header)) if column != time_column]
+        names = [header[column] for column in value_columns]
+    else:
+        time_column = header_columns - 1 if delimiter is None else 0
+        value_columns = list(range(time_column + 1, n_columns))
+        names = []
+    if axis_names:
+        names = list(axis_names)
+    if len(names) != len(value_columns):
+        raise ValueError(f"The log has {len(value_columns)} axes, {len(names)} names were given")
+
+    times = data[:, time_column]
+    order = np.argsort(times, kind="stable")
+    return EncoderLog(names, times[order] - times[order[0]], data[order][:, value_columns])
+
+
+def resample(times, values, fps):
+    """Values in every frame (frames from 0) of the logged interval, linearly interpolated."""
+    frames = np.arange(0.0, np.floor(times[-1] * fps) + 1)
+    resampled = np.empty((len(frames), values.shape[1]))
+    for column in range(values.shape[1]):
+        resampled[:, column] = np.interp(frames / fps, times, values[:, column])
+    return frames, resampled
+
+
+def import_log(armature_object, log, frame_start, fps, resample_frames=True, tolerance=0.0):
+    """Writes the axes of the log that are bones of the armature as linear keys starting at frame_start.
+    The keys of those joints within the frames of the log are replaced, the ones before and after
+    are kept. Returns (imported names, skipped names, number of keys written)."""
+    if resample_frames:
+        frames, values = resample(log.times, log.values, fps)
+    else:
+        frames, values = log.times * fps, log.values
+    frames = frames + frame_start
+
+    imported, skipped, n_keys = [], [], 0
+    pose_bones = armature_object.pose.bones
+    for column, axis_name in enumerate(log.axis_names):
+        if axis_name not in pose_bones:
+            skipped.append(axis_name)
+            continue
+        keep = rdp_mask(frames, values[:, column], tolerance) if tolerance > 0 else slice(None)
+        fcurve = fcu.joint_fcurve(armature_object, axis_name)
+        fcu.merge_keys(fcurve, frames[keep], np.radians(values[keep, column]), interpolation='LINEAR',
+                       replace_range=(frames[0], frames[-1]))
+        imported.append(axis_name)
+        n_keys += len(frames[keep])
+    return imported, skipped, n_keys
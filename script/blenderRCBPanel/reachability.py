@@ -0,0 +1,145 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import hashlib
+import os
+import bpy
+import numpy as np
+from mathutils.kdtree import KDTree
+from .batched_fk import BatchedForwardKinematics
+
+
+class ReachabilityMap:
+    """End-effector poses of a chain sampled in its joint space.
+
+    The positions and rotations are the ones of the end-effector frame in the root link
+    of the model, the world frame in which the inverse kinematics solvers take their
+    targets, the positions are indexed by a KD-tree. A target farther than radius from
+    all the samples is considered out of reach, only its position is checked.
+    """
+
+    def __init__(self, joint_names, configurations, positions, rotations, radius):
+        self.joint_names = list(joint_names)
+        self.configurations = np.asarray(configurations, dtype=np.float64)
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.rotations = np.asarray(rotations, dtype=np.float64)
+        self.radius = float(radius)
+        # Identifies the model, joints, limits and number of samples the map was built for
+        self.signature = ""
+
+        self.tree = KDTree(len(self.positions))
+        for idx, position in enumerate(self.positions):
+            self.tree.insert(position, idx)
+        self.tree.balance()
+
+    def is_reachable(self, position):
+        _, _, distance = self.tree.find(position)
+        return distance is not None and distance <= self.radius
+
+    def seed(self, position, rotation, joint_names, k=8):
+        # Configuration of the sample closest to the target, ordered as joint_names.
+        # Among the k samples closest in position, the one with the closest rotation is taken.
+        found = self.tree.find_n(position, k)
+        if not found:
+            return None
+        indices = [idx for _, idx, _ in found]
+        errors = np.linalg.norm(self.rotations[indices] - rotation, axis=(1, 2))
+        configuration = dict(zip(self.joint_names, self.configurations[indices[int(np.argmin(errors))]]))
+        return [configuration.get(name, 0.0) for name in joint_names]
+
+    def save(self, filepath, signature):
+        np.savez(filepath, signature=signature, joint_names=np.array(self.joint_names),
+                 configurations=self.configurations, positions=self.positions,
+                 rotations=self.rotations, radius=self.radius)
+
+    @classmethod
+    def load(cls, filepath, signature):
+        # None if the file is missing or it was computed for another model
+        if not os.path.isfile(filepath):
+            return None
+        with np.load(filepath) as data:
+            if str(data["signature"]) != signature:
+                return None
+            reach_map = cls(data["joint_names"].tolist(), data["configurations"], data["positions"],
+                            data["rotations"], data["radius"])
+        reach_map.signature = signature
+        return reach_map
+
+
+def sample_chain(model, endeffector_frame, considered_joints, limits, n_samples, rng_seed=0):
+    """Samples uniformly the joints of the chain within limits (dict joint name -> (min, max)
+    in radians) and returns the ReachabilityMap of the end-effector poses in the root link,
+    the other joints at zero as in the reduced model of the solvers."""
+    lower = np.array([limits.get(name, (-np.pi, np.pi))[0] for name in considered_joints])
+    upper = np.array([limits.get(name, (-np.pi, np.pi))[1] for name in considered_joints])
+
+    rng = np.random.default_rng(rng_seed)
+    configurations = rng.uniform(lower, upper, size=(n_samples, len(considered_joints)))
+    root_H_ee = BatchedForwardKinematics(model).frame_poses(configurations, [endeffector_frame], considered_joints)[:, 0]
+
+    reach_map = ReachabilityMap(considered_joints, configurations, root_H_ee[:, :3, 3], root_H_ee[:, :3, :3], 0.0)
+    reach_map.radius = coverage_radius(reach_map, rng)
+    return reach_map
+
+
+def coverage_radius(reach_map, rng, n_probes=500):
+    # Twice the typical distance between neighbouring samples, so that the gaps
+    # between the samples inside the workspace are not rejected
+    n = len(reach_map.positions)
+    if n < 2:
+        return 0.0
+    probes = rng.choice(n, size=min(n_probes, n), replace=False)
+    distances = [reach_map.tree.find_n(reach_map.positions[idx], 2)[1][2] for idx in probes]
+    return 2.0 * float(np.percentile(distances, 95))
+
+
+# (base frame, end-effector frame) -> ReachabilityMap, dropped when the model is loaded again
+maps = {}
+
+
+def map_signature(model_urdf, considered_joints, limits, n_samples):
+    # A map built for other limits or another number of samples is stale
+    chain_limits = [(name, *(round(float(v), 9) for v in limits.get(name, (-np.pi, np.pi))))
+                    for name in considered_joints]
+    content = model_urdf + repr(chain_limits) + repr(int(n_samples))
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def map_filepath(base_frame, endeffector_frame):
+    # The maps are saved next to the .blend, None if it has not been saved yet
+    if not bpy.data.filepath:
+        return None
+    stem = os.path.splitext(bpy.data.filepath)[0]
+    return f"{stem}.reach.{bpy.path.clean_name(base_frame)}.{bpy.path.clean_name(endeffector_frame)}.npz"
+
+
+def get_reachability_map(base_frame, endeffector_frame, considered_joints, limits, n_samples):
+    """Returns the map of the chain, loading it from the disk if needed. None if it has not been
+    built, or if it was built for other limits or another number of samples."""
+    if 'model_urdf' not in bpy.context.scene:
+        return None
+    key = (base_frame, endeffector_frame)
+    signature = map_signature(bpy.context.scene['model_urdf'], considered_joints, limits, n_samples)
+    reach_map = maps.get(key)
+    if reach_map is not None and reach_map.signature == signature:
+        return reach_map
+    filepath = map_filepath(base_frame, endeffector_frame)
+    if filepath is None:
+        return None
+    reach_map = ReachabilityMap.load(filepath, signature)
+    if reach_map is not None:
+        maps[key] = reach_map
+    return reach_map
+
+
+def build_reachability_map(model, base_frame, endeffector_frame, considered_joints, limits, n_samples):
+    reach_map = sample_chain(model, endeffector_frame, considered_joints, limits, n_samples)
+    reach_map.signature = map_signature(bpy.context.scene['model_urdf'], considered_joints, limits, n_samples)
+    maps[(base_frame, endeffector_frame)] = reach_map
+    filepath = map_filepath(base_frame, endeffector_frame)
+    if filepath is not None:
+        reach_map.save(filepath, reach_map.signature)
+    return reach_map, filepath
@@ -0,0 +1,139 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import numpy as np
+
+from . import fcurve_utils as fcu
+
+# Minimum path speed (frames per second), it avoids infinite durations where the limits cannot be met
+MIN_PATH_SPEED = 1e-3
+
+
+def acceleration_range(dq, ddq, x, max_acceleration):
+    # Admissible path accelerations at a sample where the squared path speed is x:
+    # |dq * sdd + ddq * x| <= max_acceleration for every joint that moves along the path
+    moving = np.abs(dq) > 1e-9
+    if not moving.any():
+        return -np.inf, np.inf
+    a = (max_acceleration - ddq[moving] * x) / dq[moving]
+    b = (-max_acceleration - ddq[moving] * x) / dq[moving]
+    return np.minimum(a, b).max(), np.maximum(a, b).min()
+
+
+def path_speed(q, ds, max_velocity, max_acceleration, max_speed):
+    """Time-parameterization of a path sampled every ds, (samples x joints).
+
+    Returns the path speed in each sample (ds units per second, at most max_speed) that
+    respects the velocity and acceleration caps of the joints (0 is not checked). Like in
+    TOPP, the maximum speed curve given by the caps is integrated forward with the maximum
+    acceleration and backward with the maximum deceleration, so the path only slows down
+    where it is needed.
+    """
+    dq = np.gradient(q, ds, axis=0)
+    ddq = np.gradient(dq, ds, axis=0)
+    # Squared path speed
+    x_max = np.full(len(q), float(max_speed) ** 2)
+    with np.errstate(divide="ignore"):
+        if max_velocity > 0:
+            x_max = np.minimum(x_max, (max_velocity / np.abs(dq)).min(axis=1) ** 2)
+        if max_acceleration > 0:
+            # The centripetal term alone must stay within the limit
+            x_max = np.minimum(x_max, (max_acceleration / np.abs(ddq)).min(axis=1))
+    if max_acceleration <= 0:
+        return np.maximum(np.sqrt(x_max), MIN_PATH_SPEED)
+
+    x = x_max.copy()
+    for i in range(len(q) - 1):
+        _, upper = acceleration_range(dq[i], ddq[i], x[i], max_acceleration)
+        x[i + 1] = min(x[i + 1], max(x[i] + 2.0 * ds * upper, 0.0))
+    for i in range(len(q) - 2, -1, -1):
+        lower, _ = acceleration_range(dq[i + 1], ddq[i + 1], x[i + 1], max_acceleration)
+        x[i] = min(x[i], max(x[i + 1] - 2.0 * ds * lower, 0.0))
+    return np.maximum(np.sqrt(x), MIN_PATH_SPEED)
+
+
+def sample_times(speed, ds):
+    # Time of each sample, the speed is linear between the samples
+    dt = 2.0 * ds / (speed[:-1] + speed[1:])
+    return np.concatenate(([0.0], np.cumsum(dt)))
+
+
+class TimeMap:
+    """Maps the frames of the original animation to the retimed ones."""
+
+    def __init__(self, frames, new_frames):
+        self.frames = frames
+        self.new_frames = new_frames
+
+    def __call__(self, frame):
+        # The frames outside the range are shifted with its ends
+        frame = np.asarray(frame, dtype=np.float64)
+        mapped = np.interp(frame, self.frames, self.new_frames)
+        before = frame < self.frames[0]
+        mapped[before] = frame[before] + self.new_frames[0] - self.frames[0]
+        after = frame > self.frames[-1]
+        mapped[after] = frame[after] + self.new_frames[-1] - self.frames[-1]
+        return mapped
+
+    def inverse(self, new_frame):
+        return np.interp(new_frame, self.new_frames, self.frames)
+
+
+def compute_time_map(armature_object, joint_names, frame_start, frame_end, fps, max_velocity, max_acceleration,
+                     substeps=2):
+    """TimeMap that slows down the joints animation (degrees) where it exceeds the caps."""
+    ds = 1.0 / substeps
+    frames = np.arange(frame_start, frame_end + ds / 2, ds)
+    q = np.degrees(fcu.evaluate_joints(armature_object, joint_names, frames))
+    speed = path_speed(q, ds, max_velocity, max_acceleration, fps)
+    return TimeMap(frames, frame_start + sample_times(speed, ds) * fps)
+
+
+def peak_rates(armature_object, joint_names, frame_start, frame_end, fps, substeps=2):
+    """Maximum velocity (deg/s) and acceleration (deg/s^2) of the joints in the frame range.
+
+    Moving the keys does not change the interpolation between them, so the retimed
+    animation is checked again against the caps.
+    """
+    ds = 1.0 / substeps
+    frames = np.arange(frame_start, frame_end + ds / 2, ds)
+    if len(frames) < 2:
+        return 0.0, 0.0
+    q = np.degrees(fcu.evaluate_joints(armature_object, joint_names, frames))
+    dq = np.gradient(q, ds / fps, axis=0)
+    ddq = np.gradient(dq, ds / fps, axis=0)
+    return float(np.abs(dq).max(initial=0.0)), float(np.abs(ddq).max(initial=0.0))
+
+
+def remap_keys(fcurve, time_map):
+    # Moves the keys and their handles, the values are not changed
+    points = fcurve.keyframe_points
+    n = len(points)
+    if n == 0:
+        return
+    for prop in ("co", "handle_left", "handle_right"):
+        co = np.empty(2 * n, dtype=np.float64)
+        points.foreach_get(prop, co)
+        co[0::2] = time_map(co[0::2])
+        points.foreach_set(prop, co)
+    fcurve.update()
+
+
+def bake_joints(armature_object, joint_names, time_map):
+    """Replaces the keys of the joints in the range with one key per retimed frame,
+    the keys outside the range are moved like remap_keys does."""
+    new_frames = np.arange(np.ceil(time_map.new_frames[0]), np.floor(time_map.new_frames[-1]) + 1)
+    values = fcu.evaluate_joints(armature_object, joint_names, time_map.inverse(new_frames))
+    for column, joint_name in enumerate(joint_names):
+        fcurve = fcu.joint_fcurve(armature_object, joint_name, create=False)
+        if fcurve is None or len(fcurve.keyframe_points) == 0:
+            continue
+        old_frames, old_values = fcu.get_keys(fcurve)
+        outside = (old_frames < time_map.frames[0]) | (old_frames > time_map.frames[-1])
+        frames = np.concatenate((time_map(old_frames[outside]), new_frames))
+        order = np.argsort(frames, kind="stable")
+        fcu.set_keys(fcurve, frames[order], np.concatenate((old_values[outside], values[:, column]))[order],
+                     interpolation='LINEAR')
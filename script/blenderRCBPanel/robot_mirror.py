@@ -0,0 +1,178 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import math
+import threading
+import time
+
+import bpy
+import numpy as np
+
+from . import command_coalescing
+from . import joint_table as jt
+from . import log_import
+
+
+class EncoderReader:
+    """Reads the encoders of the parts at a fixed rate on a background thread.
+
+    Only the most recent snapshot is kept for the display, all the samples are kept
+    when recording. The parts can be replaced while it runs. It never touches bpy.
+    """
+
+    def __init__(self, boards, axis_names, rate, record=False):
+        # part name -> board and part name -> axis names
+        self.boards = dict(boards)
+        self.axis_names = dict(axis_names)
+        self.period = 1.0 / rate
+        self.record = record
+        self.lock = threading.Lock()
+        # Held during a pass over the boards, so a replaced board is not read any more
+        self.boards_lock = threading.Lock()
+        self.snapshot = {}
+        self.sequence = 0
+        self.samples = {part_name: [] for part_name in self.boards}
+        self.reads = 0
+        self.failed_reads = 0
+        self.start_time = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rcb_mirror", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            snapshot = {}
+            with self.boards_lock:
+                for part_name, board in self.boards.items():
+                    encs = board.get_encoders()
+                    self.reads += 1
+                    if encs is None:
+                        self.failed_reads += 1
+                        continue
+                    snapshot[part_name] = encs
+                    if self.record:
+                        self.samples[part_name].append((time.monotonic() - self.start_time, encs))
+            with self.lock:
+                self.snapshot.update(snapshot)
+                self.sequence += 1
+            # The schedule is kept on the monotonic clock, the late reads are not recovered
+            next_time = max(next_time + self.period, time.monotonic())
+            self.stop_event.wait(next_time - time.monotonic())
+
+    def set_parts(self, boards, axis_names):
+        """Replaces the parts that are read, it returns after the current pass over the
+        previous boards. The samples of the removed parts are kept."""
+        with self.boards_lock:
+            self.boards = dict(boards)
+            self.axis_names.update(axis_names)
+            for part_name in self.boards:
+                self.samples.setdefault(part_name, [])
+        with self.lock:
+            self.snapshot = {name: encs for name, encs in self.snapshot.items() if name in self.boards}
+
+    def latest(self):
+        with self.lock:
+            return self.sequence, dict(self.snapshot)
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def recorded_logs(self):
+        # One EncoderLog per part, the times are measured from the start of the mirroring
+        logs = []
+        for part_name, samples in self.samples.items():
+            if samples:
+                logs.append(log_import.EncoderLog(self.axis_names[part_name],
+                                                  np.array([t for t, _ in samples]),
+                                                  np.array([encs for _, encs in samples], dtype=np.float64)))
+        return logs
+
+
+class MirrorState:
+    reader = None
+    armature_name = ""
+    display_period = 1.0 / 30.0
+    applied_sequence = -1
+    applied = {}
+    updates = 0
+
+
+def is_running():
+    return MirrorState.reader is not None
+
+
+def apply_snapshot(armature_object, snapshot, axis_names, table):
+    """Writes the encoders (degrees) of the parts that changed since the last update on the
+    pose bones, in a single pass. Returns the number of bones written."""
+    pose_bones = armature_object.pose.bones
+    written = 0
+    for part_name, encs in snapshot.items():
+        if MirrorState.applied.get(part_name) == encs:
+            continue
+        MirrorState.applied[part_name] = encs
+        for axis_name, value in zip(axis_names[part_name], encs):
+            if axis_name not in table.index:
+                continue
+            if table.is_prismatic(axis_name):
+                pose_bones[axis_name].delta_location[1] = value
+            else:
+                pose_bones[axis_name].rotation_euler[1] = math.radians(value)
+            written += 1
+    return written
+
+
+def mirror_timer():
+    # Runs on the main thread at most at the display rate, the reads are done by the reader
+    reader = MirrorState.reader
+    if reader is None:
+        return None
+    sequence, snapshot = reader.latest()
+    if sequence != MirrorState.applied_sequence:
+        MirrorState.applied_sequence = sequence
+        armature_object = bpy.data.objects.get(MirrorState.armature_name)
+        table = jt.get_joint_table(MirrorState.armature_name)
+        if armature_object is not None and table is not None:
+            if apply_snapshot(armature_object, snapshot, reader.axis_names, table):
+                MirrorState.updates += 1
+    return MirrorState.display_period
+
+
+def start(armature_name, rcb_wrappers, rate, display_rate, record=False):
+    stop()
+    # The targets waiting to be streamed would move the robot while it is mirrored
+    command_coalescing.clear()
+    MirrorState.reader = EncoderReader({name: rcb.board for name, rcb in rcb_wrappers.items()},
+                                       {name: rcb.axis_names for name, rcb in rcb_wrappers.items()},
+                                       rate, record)
+    MirrorState.armature_name = armature_name
+    MirrorState.display_period = 1.0 / display_rate
+    MirrorState.applied_sequence = -1
+    MirrorState.applied = {}
+    MirrorState.updates = 0
+    bpy.app.timers.register(mirror_timer, first_interval=0.0)
+
+
+def update_parts(rcb_wrappers):
+    # Called when a part is connected or disconnected while mirroring
+    if MirrorState.reader is not None:
+        MirrorState.reader.set_parts({name: rcb.board for name, rcb in rcb_wrappers.items()},
+                                     {name: rcb.axis_names for name, rcb in rcb_wrappers.items()})
+
+
+def stop():
+    """Stops the reader, returns it (None if the mirroring was not running)."""
+    reader = MirrorState.reader
+    if reader is None:
+        return None
+    MirrorState.reader = None
+    if bpy.app.timers.is_registered(mirror_timer):
+        bpy.app.timers.unregister(mirror_timer)
+    reader.stop()
+    # The robot moved while mirrored, the last commands are not valid any more
+    command_coalescing.clear()
+    return reader
@@ -0,0 +1,157 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bmesh
+import numpy as np
+from mathutils.bvhtree import BVHTree
+
+from . import fcurve_utils as fcu
+
+
+class LinkBody:
+    """Geometry of a link mesh, built once: its vertices and polygons (or the ones of its
+    convex hull) in the mesh space, their BVH tree and their bounding sphere."""
+
+    def __init__(self, mesh_object, link_idx, link_H_mesh, convex):
+        self.name = mesh_object.name
+        self.link_idx = link_idx
+        self.link_H_mesh = link_H_mesh
+
+        bm = bmesh.new()
+        bm.from_mesh(mesh_object.data)
+        if convex:
+            hull = bmesh.ops.convex_hull(bm, input=bm.verts)
+            bmesh.ops.delete(bm, geom=hull["geom_interior"] + hull["geom_unused"], context='VERTS')
+        bm.verts.index_update()
+        self.vertices = np.array([v.co for v in bm.verts], dtype=np.float64).reshape(-1, 3)
+        self.polygons = [[v.index for v in face.verts] for face in bm.faces]
+        bm.free()
+
+        self.tree = BVHTree.FromPolygons(self.vertices.tolist(), self.polygons)
+        lower = self.vertices.min(axis=0) if len(self.vertices) else np.zeros(3)
+        upper = self.vertices.max(axis=0) if len(self.vertices) else np.zeros(3)
+        self.center = (lower + upper) / 2.0
+        radius = np.linalg.norm(self.vertices - self.center, axis=1).max() if len(self.vertices) else 0.0
+        # The mesh may be scaled respect to the link
+        self.radius = radius * np.linalg.norm(link_H_mesh[:3, :3], axis=0).max()
+
+    def placed_tree(self, space_H_mesh):
+        # BVH tree of the body placed in another space
+        vertices = self.vertices @ space_H_mesh[:3, :3].T + space_H_mesh[:3, 3]
+        return BVHTree.FromPolygons(vertices.tolist(), self.polygons)
+
+    def overlaps(self, other, self_H_other):
+        # The tree of this body is reused, the other one is placed in its space
+        return len(self.tree.overlap(other.placed_tree(self_H_other))) > 0
+
+
+def link_bodies(armature_object, fk, convex=True):
+    """Bodies of the meshes parented to the bones of the armature.
+
+    The bones are named as the joints (or as the root link), the mesh moves with the
+    link of the joint. The transform between link and mesh is taken from the current pose.
+    """
+    q = np.array([[armature_object.pose.bones[name].rotation_euler[fcu.JOINT_INDEX]
+                   if name in armature_object.pose.bones else 0.0 for name in fk.joint_names]])
+    armature_inverse = np.linalg.inv(np.array(armature_object.matrix_world))
+    meshes = [obj for obj in armature_object.children if obj.type == 'MESH' and obj.parent_type == 'BONE']
+    links = []
+    for mesh_object in meshes:
+        link_idx = fk.joint_child_link.get(mesh_object.parent_bone, fk.model.getLinkIndex(mesh_object.parent_bone))
+        if link_idx < 0:
+            continue
+        links.append((mesh_object, link_idx))
+
+    poses = fk.link_poses(q, [link_idx for _, link_idx in links])
+    bodies = []
+    for mesh_object, link_idx in links:
+        root_H_mesh = armature_inverse @ np.array(mesh_object.matrix_world)
+        link_H_mesh = np.linalg.inv(poses[link_idx][0]) @ root_H_mesh
+        body = LinkBody(mesh_object, link_idx, link_H_mesh, convex)
+        if len(body.polygons):
+            bodies.append(body)
+    return bodies
+
+
+def frame_ranges(frames):
+    # Sorted frames -> list of (first, last) of the consecutive runs
+    ranges = []
+    for frame in frames:
+        if ranges and frame == ranges[-1][1] + 1:
+            ranges[-1][1] = frame
+        else:
+            ranges.append([frame, frame])
+    return [tuple(r) for r in ranges]
+
+
+class SelfCollisionChecker:
+    """Checks the self-collisions of the link bodies for batches of joint configurations.
+
+    The broad phase compares the bounding spheres of all the pairs at once, the narrow
+    phase tests the BVH trees of the candidate pairs. A body in a single candidate pair of
+    a configuration keeps the tree built in its mesh space, the other body is placed there;
+    the bodies in several pairs are placed in the root space once per configuration. The
+    pairs of links connected by a joint and the ones already colliding in the reference
+    configuration are ignored.
+    """
+
+    def __init__(self, fk, bodies, reference_configuration):
+        self.fk = fk
+        self.bodies = bodies
+        n = len(bodies)
+        self.radii = np.array([body.radius for body in bodies])
+        self.centers = np.array([body.center for body in bodies]).reshape(n, 3)
+        self.allowed = np.eye(n, dtype=bool)
+        for i, a in enumerate(bodies):
+            for j, b in enumerate(bodies):
+                if a.link_idx == b.link_idx or fk.parent[a.link_idx] == b.link_idx or fk.parent[b.link_idx] == a.link_idx:
+                    self.allowed[i, j] = True
+        for _, i, j in self.collisions(np.atleast_2d(reference_configuration)):
+            self.allowed[i, j] = self.allowed[j, i] = True
+
+    def body_poses(self, q):
+        # root_H_mesh of the bodies, (N, n bodies, 4, 4)
+        poses = self.fk.link_poses(q, {body.link_idx for body in self.bodies})
+        return np.stack([poses[body.link_idx] @ body.link_H_mesh for body in self.bodies], axis=1)
+
+    def collisions(self, q):
+        """Yields (configuration index, body index, body index) of the colliding pairs."""
+        if len(self.bodies) < 2:
+            return
+        H = self.body_poses(q)
+        centers = np.einsum("fbij,bj->fbi", H[..., :3, :3], self.centers) + H[..., :3, 3]
+        distances = np.linalg.norm(centers[:, :, None, :] - centers[:, None, :, :], axis=-1)
+        candidates = (distances <= self.radii[:, None] + self.radii[None, :]) & ~self.allowed
+        candidates &= np.triu(np.ones_like(self.allowed), 1)
+        f_idx, i_idx, j_idx = np.nonzero(candidates)
+        current = -1
+        for f, i, j in zip(f_idx, i_idx, j_idx):
+            if f != current:
+                # Number of candidate pairs of each body and root space trees of this configuration
+                begin, end = np.searchsorted(f_idx, [f, f + 1])
+                pair_count = np.bincount(np.concatenate((i_idx[begin:end], j_idx[begin:end])), minlength=len(self.bodies))
+                placed = {}
+                current = f
+            if pair_count[i] == 1 and pair_count[j] == 1:
+                # The meshes may be scaled, the transforms are inverted as affine ones
+                colliding = self.bodies[i].overlaps(self.bodies[j], np.linalg.inv(H[f, i]) @ H[f, j])
+            else:
+                for k in (i, j):
+                    if k not in placed:
+                        placed[k] = self.bodies[k].placed_tree(H[f, k])
+                colliding = len(placed[i].overlap(placed[j])) > 0
+            if colliding:
+                yield f, i, j
+
+    def check_frames(self, armature_object, frames, chunk_size=1000):
+        """Returns {(mesh name, mesh name): [(first frame, last frame), ...]} over the frames."""
+        colliding = {}
+        for begin in range(0, len(frames), chunk_size):
+            chunk = frames[begin:begin + chunk_size]
+            q = fcu.evaluate_joints(armature_object, self.fk.joint_names, chunk)
+            for f, i, j in self.collisions(q):
+                colliding.setdefault((self.bodies[i].name, self.bodies[j].name), []).append(int(chunk[f]))
+        return {pair: frame_ranges(sorted(pair_frames)) for pair, pair_frames in colliding.items()}
@@ -0,0 +1,193 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bisect
+import json
+import platform
+import time
+
+# Upper edges (in milliseconds) of the histogram bins, roughly logarithmic so
+# that both sub-millisecond handler times and multi-second settle times fit.
+HISTOGRAM_EDGES_MS = [0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0,
+                      100.0, 200.0, 500.0, 1000.0, 2000.0, 5000.0]
+
+
+def now():
+    # All the streaming timestamps are taken with the same monotonic clock
+    return time.monotonic()
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # The last bin collects everything above the last edge
+        self.bins = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value_s):
+        value_ms = value_s * 1000.0
+        self.bins[bisect.bisect_left(HISTOGRAM_EDGES_MS, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.min = value_ms if self.min is None else min(self.min, value_ms)
+        self.max = value_ms if self.max is None else max(self.max, value_ms)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        # Approximated with the upper edge of the bin containing the percentile
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        accumulated = 0
+        for idx, n in enumerate(self.bins):
+            accumulated += n
+            if accumulated >= rank:
+                if idx < len(HISTOGRAM_EDGES_MS):
+                    return min(HISTOGRAM_EDGES_MS[idx], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {"edges_ms": HISTOGRAM_EDGES_MS,
+                "bins": list(self.bins),
+                "count": self.count,
+                "mean_ms": self.mean(),
+                "min_ms": self.min,
+                "max_ms": self.max,
+                "p50_ms": self.percentile(50),
+                "p95_ms": self.percentile(95),
+                "p99_ms": self.percentile(99)}
+
+
+class PartStreamingStats:
+    """Timing of the commands streamed to a single part of the robot.
+
+    The jitter is the variation between the intervals of the first command sent in
+    consecutive frames. The encoders are read only when move() runs, so the settle
+    latency is quantized to the interval between two frame changes.
+    """
+
+    def __init__(self, part_name):
+        self.part_name = part_name
+        self.handler_duration = LatencyHistogram()
+        self.extraction_latency = LatencyHistogram()
+        self.send_latency = LatencyHistogram()
+        self.settle_latency = LatencyHistogram()
+        self.jitter = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        for h in (self.handler_duration, self.extraction_latency, self.send_latency,
+                  self.settle_latency, self.jitter):
+            h.reset()
+        self.commands = 0
+        self.dropped_frames = 0
+        # targets replaced by a newer one before being sent, and large jumps approached gradually
+        self.merged_commands = 0
+        self.jumps = 0
+        self.last_frame = None
+        self.last_send = None
+        self.last_interval = None
+        # first command sent in the current frame
+        self.frame_send = None
+        # joint index -> (target, timestamp of the send) waiting for the encoders
+        self.pending = {}
+
+    def frame_changed(self, frame, frame_step, is_playing):
+        # During playback every frame should reach the handler, the gaps are dropped frames
+        if is_playing and self.last_frame is not None:
+            gap = frame - self.last_frame
+            if gap > frame_step:
+                self.dropped_frames += gap // frame_step - 1
+        self.last_frame = frame
+
+    def frame_dropped(self):
+        self.dropped_frames += 1
+
+    def command_merged(self):
+        self.merged_commands += 1
+
+    def jump_detected(self):
+        self.jumps += 1
+
+    def command_sent(self, joint, target, t_frame, t_extract, t_sent):
+        self.commands += 1
+        self.extraction_latency.add(t_extract - t_frame)
+        self.send_latency.add(t_sent - t_extract)
+        self.pending[joint] = (target, t_sent)
+        if self.frame_send is None:
+            self.frame_send = t_sent
+
+    def handler_done(self, t_frame, t_end):
+        self.handler_duration.add(t_end - t_frame)
+        # The jitter is the variation between two consecutive inter-command intervals,
+        # the frames without commands do not count
+        t_send, self.frame_send = self.frame_send, None
+        if t_send is None:
+            return
+        if self.last_send is not None:
+            interval = t_send - self.last_send
+            if self.last_interval is not None:
+                self.jitter.add(abs(interval - self.last_interval))
+            self.last_interval = interval
+        self.last_send = t_send
+
+    def encoders_read(self, encs, tolerance, t_read):
+        for joint in list(self.pending.keys()):
+            target, t_sent = self.pending[joint]
+            if joint < len(encs) and abs(encs[joint] - target) <= tolerance:
+                self.settle_latency.add(t_read - t_sent)
+                del self.pending[joint]
+
+    def summary(self):
+        return (f"{self.commands} cmds, send p95 {self.send_latency.percentile(95):.2f} ms, "
+                f"jitter p95 {self.jitter.percentile(95):.2f} ms, dropped {self.dropped_frames}, "
+                f"merged {self.merged_commands}, jumps {self.jumps}")
+
+    def to_dict(self):
+        return {"part": self.part_name,
+                "commands": self.commands,
+                "dropped_frames": self.dropped_frames,
+                "merged_commands": self.merged_commands,
+                "jumps": self.jumps,
+                "handler_duration": self.handler_duration.to_dict(),
+                "extraction_latency": self.extraction_latency.to_dict(),
+                "send_latency": self.send_latency.to_dict(),
+                "settle_latency": self.settle_latency.to_dict(),
+                "jitter": self.jitter.to_dict()}
+
+
+# part name -> PartStreamingStats, kept across disconnections so that they can still be exported
+part_stats = {}
+
+
+def get_part_stats(part_name):
+    if part_name not in part_stats:
+        part_stats[part_name] = PartStreamingStats(part_name)
+    return part_stats[part_name]
+
+
+def reset_all():
+    for stats in part_stats.values():
+        stats.reset()
+
+
+def export_json(filepath, transport=""):
+    data = {"host": platform.node(),
+            "platform": platform.platform(),
+            "transport": transport,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "parts": [stats.to_dict() for stats in part_stats.values()]}
+    with open(filepath, "w") as f:
+        json.dump(data, f, indent=4)
@@ -0,0 +1,213 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bpy
+import gpu
+import numpy as np
+from gpu_extras.batch import batch_for_shader
+
+from . import fcurve_utils as fcu
+from .batched_fk import BatchedForwardKinematics
+
+PATH_COLOR = (1.0, 0.6, 0.0, 1.0)
+CURRENT_COLOR = (1.0, 1.0, 1.0, 1.0)
+
+
+def keys_signature(armature_object, joint_name):
+    # Keys and handles of the joint F-curve, the value of the pose if the joint is not animated
+    fcurve = fcu.joint_fcurve(armature_object, joint_name, create=False)
+    if fcurve is None or len(fcurve.keyframe_points) == 0:
+        return armature_object.pose.bones[joint_name].rotation_euler[fcu.JOINT_INDEX]
+    n = len(fcurve.keyframe_points)
+    co = np.empty(6 * n, dtype=np.float64)
+    fcurve.keyframe_points.foreach_get("co", co[:2 * n])
+    fcurve.keyframe_points.foreach_get("handle_left", co[2 * n:4 * n])
+    fcurve.keyframe_points.foreach_get("handle_right", co[4 * n:])
+    return co
+
+
+def key_rows(signature):
+    # (keys x 6) rows of frame, value, left handle and right handle of each key
+    n = len(signature) // 6
+    return signature.reshape(3, n, 2).transpose(1, 0, 2).reshape(n, 6)
+
+
+def affected_frames(old, new, first_frame, n_frames):
+    # Frames whose value may differ between two versions of the keys of a F-curve. The keys
+    # are compared by frame, the ones added, removed or modified affect the segments around
+    # them, extended by one key on each side because of the automatic handles
+    affected = np.zeros(n_frames, dtype=bool)
+    if not isinstance(old, np.ndarray) or not isinstance(new, np.ndarray):
+        affected[:] = True
+        return affected
+    rows, counts = np.unique(np.concatenate((key_rows(old), key_rows(new))), axis=0, return_counts=True)
+    changed = np.unique(rows[counts == 1, 0])
+    if len(changed) == 0:
+        return affected
+    frames = np.unique(np.concatenate((old[:len(old) // 3:2], new[:len(new) // 3:2])))
+    position = np.searchsorted(frames, changed)
+    padded = np.concatenate(([-np.inf, -np.inf], frames, [np.inf, np.inf]))
+    begin = np.clip(np.ceil(padded[position] - first_frame), 0, n_frames).astype(int)
+    end = np.clip(np.floor(padded[position + 4] - first_frame) + 1, 0, n_frames).astype(int)
+    # Union of the intervals [begin, end) of the changed keys
+    delta = np.zeros(n_frames + 1, dtype=np.int64)
+    np.add.at(delta, begin, 1)
+    np.add.at(delta, end, -1)
+    affected[:] = np.cumsum(delta[:-1]) > 0
+    return affected
+
+
+class TrajectoryCache:
+    """Positions of a frame of the model, in the armature space, over the frame range.
+
+    The positions are computed with the batched forward kinematics only for the frames
+    that are not valid: the ones affected by the keys that changed since the last refresh.
+    """
+
+    def __init__(self, fk, armature_name, frame_name, frame_start, frame_end):
+        self.fk = fk
+        self.armature_name = armature_name
+        self.frame_name = frame_name
+        self.frame_start = frame_start
+        self.n_frames = frame_end - frame_start + 1
+        self.positions = np.zeros((self.n_frames, 3), dtype=np.float32)
+        self.valid = np.zeros(self.n_frames, dtype=bool)
+        # joint name -> keys signature
+        self.signatures = {}
+        self.batch = None
+        self.matrix_world = None
+
+    def matches(self, fk, armature_name, frame_name, frame_start, frame_end):
+        return (fk is self.fk and armature_name == self.armature_name and frame_name == self.frame_name
+                and frame_start == self.frame_start and frame_end - frame_start + 1 == self.n_frames)
+
+    def invalidate_changed_keys(self, armature_object):
+        for joint_name in self.fk.joint_names:
+            if joint_name not in armature_object.pose.bones:
+                continue
+            signature = keys_signature(armature_object, joint_name)
+            previous = self.signatures.get(joint_name)
+            if type(previous) is type(signature) and np.array_equal(previous, signature):
+                continue
+            self.valid &= ~affected_frames(previous, signature, self.frame_start, self.n_frames)
+            self.signatures[joint_name] = signature
+
+    def refresh(self, armature_object):
+        """Recomputes the frames that are not valid, returns True if something changed."""
+        self.invalidate_changed_keys(armature_object)
+        invalid = np.flatnonzero(~self.valid)
+        if len(invalid) == 0:
+            return False
+        q = fcu.evaluate_joints(armature_object, self.fk.joint_names, invalid + self.frame_start)
+        poses = self.fk.frame_poses(q, [self.frame_name])
+        self.positions[invalid] = poses[:, 0, :3, 3]
+        self.valid[invalid] = True
+        self.batch = None
+        return True
+
+    def position(self, frame):
+        idx = frame - self.frame_start
+        if 0 <= idx < self.n_frames and self.valid[idx]:
+            return self.positions[idx]
+        return None
+
+
+class OverlayState:
+    cache = None
+    fk = None
+    model = None
+    dirty = True
+    handle = None
+
+
+def get_shader():
+    # The name of the builtin shader changed in Blender 3.4
+    try:
+        return gpu.shader.from_builtin('UNIFORM_COLOR')
+    except ValueError:
+        return gpu.shader.from_builtin('3D_UNIFORM_COLOR')
+
+
+def draw_trajectory():
+    scene = bpy.context.scene
+    mytool = scene.my_tool
+    armature_object = bpy.data.objects.get(mytool.my_armature)
+    model = OverlayState.model
+    if armature_object is None or model is None or not mytool.my_eeframeenum:
+        return
+
+    if OverlayState.fk is None or OverlayState.fk.model is not model:
+        OverlayState.fk = BatchedForwardKinematics(model)
+    cache = OverlayState.cache
+    if cache is None or not cache.matches(OverlayState.fk, armature_object.name, mytool.my_eeframeenum,
+                                          scene.frame_start, scene.frame_end):
+        try:
+            cache = TrajectoryCache(OverlayState.fk, armature_object.name, mytool.my_eeframeenum,
+                                    scene.frame_start, scene.frame_end)
+            cache.fk.frame_link(mytool.my_eeframeenum)
+        except ValueError:
+            return
+        OverlayState.cache = cache
+        OverlayState.dirty = True
+    if OverlayState.dirty:
+        cache.refresh(armature_object)
+        OverlayState.dirty = False
+
+    shader = get_shader()
+    matrix_world = np.array(armature_object.matrix_world, dtype=np.float32)
+    if cache.batch is None or not np.array_equal(cache.matrix_world, matrix_world):
+        world = cache.positions @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+        cache.batch = batch_for_shader(shader, 'LINE_STRIP', {"pos": world.tolist()})
+        cache.matrix_world = matrix_world
+
+    shader.bind()
+    shader.uniform_float("color", PATH_COLOR)
+    gpu.state.line_width_set(2.0)
+    cache.batch.draw(shader)
+
+    position = cache.position(scene.frame_current)
+    if position is not None:
+        world = matrix_world[:3, :3] @ position + matrix_world[:3, 3]
+        gpu.state.point_size_set(8.0)
+        shader.uniform_float("color", CURRENT_COLOR)
+        batch_for_shader(shader, 'POINTS', {"pos": [world.tolist()]}).draw(shader)
+    gpu.state.line_width_set(1.0)
+    gpu.state.point_size_set(1.0)
+
+
+def show(enable):
+    if enable and OverlayState.handle is None:
+        OverlayState.handle = bpy.types.SpaceView3D.draw_handler_add(draw_trajectory, (), 'WINDOW', 'POST_VIEW')
+        OverlayState.dirty = True
+    elif not enable and OverlayState.handle is not None:
+        bpy.types.SpaceView3D.draw_handler_remove(OverlayState.handle, 'WINDOW')
+        OverlayState.handle = None
+        OverlayState.cache = None
+    for area in bpy.context.screen.areas if bpy.context.screen else []:
+        if area.type == 'VIEW_3D':
+            area.tag_redraw()
+
+
+def set_model(model):
+    # The cached positions refer to the previous model
+    OverlayState.model = model
+    OverlayState.fk = None
+    OverlayState.cache = None
+
+
+def overlay_update_handler(scene, depsgraph):
+    # The edits of the keys are notified as updates of the action, the ones of the pose as updates
+    # of the armature. The cache checks which keys changed at the next redraw.
+    if OverlayState.handle is None:
+        return
+    # During the playback the armature is updated in every frame, only the edits of the keys count
+    playing = bpy.context.screen is not None and bpy.context.screen.is_animation_playing
+    armature_name = scene.my_tool.my_armature
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Action) or (not playing and isinstance(update.id, bpy.types.Object)
+                                                       and update.id.name == armature_name):
+            OverlayState.dirty = True
+            return
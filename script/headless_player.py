@@ -0,0 +1,239 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Streams an action of a rig to the robot without the GUI of blender, at the rate of the controller.
+# The parts are connected as the blenderRCBPanel does, reading the same .json configuration file.
+#
+# Usage:
+#   blender -b rig.blend --python-use-system-env -P headless_player.py -- --parts parts.json --action wave --rate 100
+
+import bpy
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import blenderRCBPanel
+from blenderRCBPanel import blenderRCBPanel as rcb
+from blenderRCBPanel import controlboard_backends as cb
+from blenderRCBPanel import fcurve_utils as fcu
+
+# The last milliseconds before a deadline are spent spinning, time.sleep is not precise enough
+SPIN_TIME = 0.001
+
+
+def read_parts(filepath):
+    # Same format read by the Configure button: [yarp name, displayed name, optional axes]
+    with open(filepath) as f:
+        data = json.load(f)
+    return [(p[0], list(p[2]) if len(p) > 2 else []) for p in data['parts']]
+
+
+def connect(parts, mytool):
+    rcb_instances = {}
+    for part_name, axis_names in parts:
+        rcb_instance = rcb.open_rcb(rcb.board_pool_key(part_name, mytool),
+                                    rcb.create_board(part_name, axis_names, mytool))
+        if rcb_instance is None:
+            print(f"Cannot open the driver of {part_name}")
+            continue
+        rcb.register_rcb(rcb_instance, part_name)
+        rcb_instances[part_name] = rcb_instance
+    return rcb_instances
+
+
+def disconnect(rcb_instances):
+    for part_name, rcb_instance in rcb_instances.items():
+        rcb.unregister_rcb(part_name)
+        rcb_instance.board.close()
+
+
+def sample_trajectory(armature_object, joint_names, frame_start, frame_end, fps, rate, speed):
+    """Targets (degrees) of the joints at every tick of the controller, (ticks x joints)."""
+    duration = (frame_end - frame_start) / (fps * speed)
+    frames = frame_start + np.arange(0.0, duration + 0.5 / rate, 1.0 / rate) * fps * speed
+    return np.degrees(fcu.evaluate_joints(armature_object, joint_names, frames))
+
+
+def approach(rcb_instances, columns, first_targets, ref_speed):
+    # Reaches the first pose in position control, so the stream does not start with a jump
+    for part_name, rcb_instance in rcb_instances.items():
+        board = rcb_instance.board
+        for joint, column in columns[part_name]:
+            board.set_control_mode(joint, cb.CM_POSITION)
+            board.set_ref_speed(joint, ref_speed)
+            board.position_move(joint, first_targets[column])
+    for part_name, rcb_instance in rcb_instances.items():
+        board = rcb_instance.board
+        for joint, _ in columns[part_name]:
+            while not board.is_motion_done(joint):
+                time.sleep(0.01)
+        board.set_control_modes(cb.CM_POSITION_DIRECT)
+
+
+def loop_transition(targets, speed, rate):
+    """Ticks from the last targets back to the first ones, moving the joints at most at speed (deg/s).
+    They are sent before every repetition after the first, so the loop does not wrap with a jump."""
+    if speed <= 0 or len(targets) == 0:
+        return targets[:0]
+    n_steps = int(np.ceil(np.abs(targets[0] - targets[-1]).max(initial=0.0) * rate / speed))
+    if n_steps <= 1:
+        return targets[:0]
+    fraction = np.arange(1, n_steps)[:, None] / n_steps
+    return targets[-1] + fraction * (targets[0] - targets[-1])
+
+
+def wait_until(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining > SPIN_TIME:
+        time.sleep(remaining - SPIN_TIME)
+    while time.monotonic() < deadline:
+        pass
+
+
+def play(rcb_instances, columns, targets, rate, loops, stop_after, transition=None):
+    """Sends one row of targets per tick on a monotonic-clock schedule.
+
+    A tick later than half a period is a deadline miss, the ticks whose time has already
+    passed are skipped, so the timing of the animation is kept. The rows of transition are
+    sent before every repetition after the first. Returns the statistics.
+    """
+    period = 1.0 / rate
+    sent = misses = skipped = 0
+    lateness = []
+    start = time.monotonic()
+    loop_start = start
+    loop = 0
+    try:
+        while loops == 0 or loop < loops:
+            ticks = targets
+            if loop > 0 and transition is not None and len(transition):
+                ticks = np.concatenate((transition, targets))
+            n_ticks = len(ticks)
+            tick = 0
+            while tick < n_ticks:
+                deadline = loop_start + tick * period
+                if stop_after > 0 and deadline - start > stop_after:
+                    raise KeyboardInterrupt
+                wait_until(deadline)
+                late = time.monotonic() - deadline
+                lateness.append(late)
+                if late > period / 2:
+                    misses += 1
+                for part_name, rcb_instance in rcb_instances.items():
+                    board = rcb_instance.board
+                    for joint, column in columns[part_name]:
+                        board.set_position(joint, ticks[tick, column])
+                sent += 1
+                # The ticks that are already late are not sent
+                next_tick = min(max(tick + 1, int((time.monotonic() - loop_start) / period)), n_ticks)
+                skipped += next_tick - tick - 1
+                tick = next_tick
+            loop_start += n_ticks * period
+            loop += 1
+    except KeyboardInterrupt:
+        print("Playback stopped")
+    elapsed = time.monotonic() - start
+    lateness = np.array(lateness) * 1000.0 if lateness else np.zeros(1)
+    return {"ticks": sent,
+            "loops": loop,
+            "duration_s": elapsed,
+            "rate_hz": sent / elapsed if elapsed > 0 else 0.0,
+            "deadline_misses": misses,
+            "skipped_ticks": skipped,
+            "lateness_p95_ms": float(np.percentile(lateness, 95)),
+            "lateness_max_ms": float(lateness.max())}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Streams an action of the rig to the robot without the GUI.")
+    parser.add_argument("--parts", type=str, required=True, help="configuration file of the parts (.json)")
+    parser.add_argument("--armature", type=str, default="", help="armature of the rig, by default the one of the panel")
+    parser.add_argument("--action", type=str, default="", help="action to play, by default the one of the armature")
+    parser.add_argument("--robot", type=str, default="", help="name of the robot, by default the one of the panel")
+    parser.add_argument("--backend", type=str, default="YARP", choices=["YARP", "FAKE"])
+    parser.add_argument("--rate", type=float, default=100.0, help="rate of the commands in Hz")
+    parser.add_argument("--speed", type=float, default=1.0, help="scale of the speed of the animation")
+    parser.add_argument("--start", type=int, default=None, help="first frame, by default the start of the scene")
+    parser.add_argument("--end", type=int, default=None, help="last frame, by default the end of the scene")
+    parser.add_argument("--loop", type=int, default=1, help="number of repetitions, 0 for looping until Ctrl+C")
+    parser.add_argument("--stop-after", type=float, default=0.0, help="stop after these seconds, 0 for never")
+    parser.add_argument("--approach-speed", type=float, default=10.0,
+                        help="speed (deg/s) for reaching the first pose in position control and for going back "
+                             "to it between the repetitions, 0 for skipping it")
+    parser.add_argument("--output", type=str, default="", help="optional .json file for the summary")
+    args = parser.parse_args(argv)
+
+    blenderRCBPanel.register()
+    scene = bpy.context.scene
+    mytool = scene.my_tool
+    if args.armature:
+        mytool.my_armature = args.armature
+    if args.robot:
+        mytool.my_string = args.robot
+    mytool.my_backend = args.backend
+    armature_object = bpy.data.objects.get(mytool.my_armature)
+    if armature_object is None:
+        print(f"Armature {mytool.my_armature} not found")
+        return 1
+    if args.action:
+        action = bpy.data.actions.get(args.action)
+        if action is None:
+            print(f"Action {args.action} not found")
+            return 1
+        if armature_object.animation_data is None:
+            armature_object.animation_data_create()
+        armature_object.animation_data.action = action
+    frame_start = scene.frame_start if args.start is None else args.start
+    frame_end = scene.frame_end if args.end is None else args.end
+    fps = scene.render.fps / scene.render.fps_base
+
+    if args.backend == "YARP" and not cb.YarpControlBoard.init_network():
+        print("YARP server is not running!")
+        return 1
+    rcb_instances = connect(read_parts(args.parts), mytool)
+    if not rcb_instances:
+        return 1
+
+    # part name -> [(axis, column of the trajectory)], the axes that are not bones are not moved
+    joint_names = []
+    columns = {}
+    for part_name, rcb_instance in rcb_instances.items():
+        columns[part_name] = []
+        for joint, axis_name in enumerate(rcb_instance.axis_names):
+            if axis_name in armature_object.pose.bones:
+                columns[part_name].append((joint, len(joint_names)))
+                joint_names.append(axis_name)
+            else:
+                print(f"Skipping the axis {axis_name} of {part_name}, it is not a bone of {armature_object.name}")
+
+    targets = sample_trajectory(armature_object, joint_names, frame_start, frame_end, fps, args.rate, args.speed)
+    print(f"Playing frames {frame_start}-{frame_end} of {len(joint_names)} joints: "
+          f"{len(targets)} ticks at {args.rate} Hz")
+    try:
+        if args.approach_speed > 0:
+            approach(rcb_instances, columns, targets[0], args.approach_speed)
+        summary = play(rcb_instances, columns, targets, args.rate, args.loop, args.stop_after,
+                       loop_transition(targets, args.approach_speed, args.rate))
+    finally:
+        disconnect(rcb_instances)
+
+    for key, value in summary.items():
+        print(f"{key:>16}: {value:.3f}" if isinstance(value, float) else f"{key:>16}: {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv[argv.index("--") + 1:] if "--" in argv else []))